@@ -0,0 +1,368 @@
+"""
+analytics.py - Dashboard analytics sections and their cache
+"""
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+from sqlalchemy import func, desc, event, select
+
+from database import db
+from models import ServiceProvider, Promotion, Booking, BookingDailyStat
+from sketches import booking_sketch_summary
+
+# Analytics sections
+# All booking figures come from the booking_daily_stats rollup
+def most_booked_services_section(limit=10):
+    """Top `limit` service types by number of bookings"""
+    most_booked = db.session.query(
+        BookingDailyStat.service_type,
+        func.sum(BookingDailyStat.booking_count).label('count')
+    ).group_by(BookingDailyStat.service_type).having(
+        func.sum(BookingDailyStat.booking_count) > 0
+    ).order_by(desc('count')).limit(limit).all()
+    
+    return [
+        {'service': item[0] or None, 'count': int(item[1])} for item in most_booked
+    ]
+
+def top_providers_section(limit=10):
+    """Top `limit` providers by rating"""
+    return provider_leaderboard_section('rating', limit=limit)
+
+# Provider leaderboards, each read in index order from service_providers
+LEADERBOARD_ORDERS = {
+    'rating': ServiceProvider.rating,
+    'bookings': ServiceProvider.total_bookings,
+    'revenue': ServiceProvider.total_revenue
+}
+LEADERBOARD_MAX = 100
+
+def provider_leaderboard_section(by='rating', service_type=None, limit=10):
+    """Top `limit` providers by rating, bookings or revenue, optionally for one service type"""
+    column = LEADERBOARD_ORDERS[by]
+    # Only the columns shown, not whole provider rows
+    stmt = select(
+        ServiceProvider.id,
+        ServiceProvider.name,
+        ServiceProvider.service_type,
+        ServiceProvider.rating,
+        ServiceProvider.rating_count,
+        ServiceProvider.total_bookings,
+        ServiceProvider.total_revenue
+    )
+    if service_type:
+        stmt = stmt.where(ServiceProvider.service_type == service_type)
+    top_providers = db.session.execute(
+        stmt.order_by(desc(column), desc(ServiceProvider.id)).limit(limit)
+    ).all()
+    
+    return [
+        {
+            'id': p.id,
+            'name': p.name,
+            'rating': p.rating,
+            'rating_count': p.rating_count or 0,
+            'bookings': p.total_bookings,
+            'revenue': p.total_revenue or 0.0,
+            'service_type': p.service_type
+        } for p in top_providers
+    ]
+
+def service_type_leaderboards_section(by='rating', limit=10):
+    """One leaderboard per service type"""
+    service_types = db.session.execute(
+        select(ServiceProvider.service_type).where(
+            ServiceProvider.service_type.isnot(None)
+        ).distinct().order_by(ServiceProvider.service_type)
+    ).scalars().all()
+    return {
+        service_type: provider_leaderboard_section(by, service_type, limit)
+        for service_type in service_types
+    }
+
+def revenue_trends_section(days=30):
+    """Revenue per day over the last `days` days"""
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    revenue_data = db.session.query(
+        BookingDailyStat.day,
+        func.sum(BookingDailyStat.revenue).label('revenue')
+    ).filter(
+        BookingDailyStat.day >= since
+    ).group_by(BookingDailyStat.day).all()
+    
+    return [
+        {'date': str(item[0]), 'revenue': float(item[1])} for item in revenue_data
+    ]
+
+def statistics_section():
+    """Headline totals for the dashboard cards, in one round trip"""
+    total_providers = select(func.count()).select_from(ServiceProvider).scalar_subquery()
+    active_promotions = select(func.count()).select_from(Promotion).where(
+        Promotion.status == 'active'
+    ).scalar_subquery()
+    total_bookings, total_revenue, total_providers, active_promotions = db.session.execute(
+        select(
+            func.coalesce(func.sum(BookingDailyStat.booking_count), 0),
+            func.coalesce(func.sum(BookingDailyStat.revenue), 0),
+            total_providers,
+            active_promotions
+        )
+    ).one()
+    
+    return {
+        'total_bookings': int(total_bookings),
+        'total_revenue': float(total_revenue),
+        'total_providers': total_providers,
+        'active_promotions': active_promotions
+    }
+
+def unique_customers_section(days=30):
+    """Approximate unique customers and heaviest customers/providers over
+    the last `days` days, merged from the daily sketches"""
+    today = datetime.utcnow().date()
+    return booking_sketch_summary(today - timedelta(days=days - 1), today, top=5)
+
+# Analytics cache
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    
+    clear() starts a new generation. A value computed from reads made
+    before a clear() is not stored: pass set() the generation read before
+    computing it.
+    """
+    
+    def __init__(self, maxsize=128, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, key):
+        """Return (True, value) for a live entry, (False, None) otherwise"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+    
+    def set(self, key, value, generation=None):
+        """Store value, unless the cache was cleared since `generation`"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+            self.invalidations += 1
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+analytics_cache = TTLCache()
+
+def section_cache_key(name, params):
+    return (name, tuple(sorted(params.items())))
+
+def cached_section(name, compute, **params):
+    """Return compute(**params), cached under the section name and params"""
+    key = section_cache_key(name, params)
+    generation = analytics_cache.generation
+    found, value = analytics_cache.get(key)
+    if not found:
+        value = compute(**params)
+        analytics_cache.set(key, value, generation)
+    return value
+
+# Sections served by /admin/analytics/data: name -> (compute, params it takes)
+ANALYTICS_SECTIONS = {
+    'most_booked_services': (most_booked_services_section, ('limit',)),
+    'top_providers': (top_providers_section, ('limit',)),
+    'revenue_trends': (revenue_trends_section, ('days',)),
+    'statistics': (statistics_section, ()),
+    'unique_customers': (unique_customers_section, ('days',))
+}
+# Short names also accepted in ?sections=
+SECTION_ALIASES = {
+    'most_booked': 'most_booked_services',
+    'services': 'most_booked_services',
+    'providers': 'top_providers',
+    'revenue': 'revenue_trends',
+    'stats': 'statistics',
+    'customers': 'unique_customers'
+}
+ANALYTICS_DAYS_DEFAULT = 30
+ANALYTICS_DAYS_MAX = 730
+ANALYTICS_LIMIT_DEFAULT = 10
+
+def parse_section_request(args):
+    """Validate ?sections=&days=&limit= and return {section: params}"""
+    names = [name.strip() for name in (args.get('sections') or '').split(',') if name.strip()]
+    sections = []
+    for name in names or ANALYTICS_SECTIONS:
+        name = SECTION_ALIASES.get(name, name)
+        if name not in ANALYTICS_SECTIONS:
+            raise ValueError(f"sections must be among: {', '.join(ANALYTICS_SECTIONS)}")
+        if name not in sections:
+            sections.append(name)
+    
+    try:
+        days = int(args.get('days', ANALYTICS_DAYS_DEFAULT))
+        limit = int(args.get('limit', ANALYTICS_LIMIT_DEFAULT))
+    except ValueError:
+        raise ValueError('days and limit must be integers')
+    if not 1 <= days <= ANALYTICS_DAYS_MAX:
+        raise ValueError(f'days must be between 1 and {ANALYTICS_DAYS_MAX}')
+    if not 1 <= limit <= LEADERBOARD_MAX:
+        raise ValueError(f'limit must be between 1 and {LEADERBOARD_MAX}')
+    
+    values = {'days': days, 'limit': limit}
+    return {
+        name: {param: values[param] for param in ANALYTICS_SECTIONS[name][1]}
+        for name in sections
+    }
+
+# Section pool
+class SectionPool:
+    """Thread pool computing sections, each on its own app context, session
+    and pooled connection. Tasks run in a copy of the submitter's context
+    variables, so per-request accounting follows them. Started on first use."""
+    
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def configure(self, workers):
+        with self._lock:
+            if workers != self.workers and self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.workers = workers
+    
+    def submit(self, compute, params):
+        """Run compute(**params) on a pool thread under the current app"""
+        app = current_app._get_current_object()
+        use_replica = bool(g.get('use_read_replica'))
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analytics')
+            return self._executor.submit(
+                contextvars.copy_context().run, self._run, app, use_replica, compute, params
+            )
+    
+    @staticmethod
+    def _run(app, use_replica, compute, params):
+        with app.app_context():
+            g.use_read_replica = use_replica
+            return compute(**params)
+
+section_pool = SectionPool()
+
+def compute_sections(requested):
+    """Return {section: value} for {section: params}, from the cache where
+    possible. With more than one miss, the misses run in parallel, so the
+    wait is that of the slowest section rather than the sum of them all.
+    """
+    results = {}
+    misses = []
+    generation = analytics_cache.generation
+    for name, params in requested.items():
+        key = section_cache_key(name, params)
+        found, value = analytics_cache.get(key)
+        if found:
+            results[name] = value
+        else:
+            misses.append((name, key, params))
+    
+    if len(misses) > 1 and section_pool.workers > 1:
+        futures = [
+            (name, key, section_pool.submit(ANALYTICS_SECTIONS[name][0], params))
+            for name, key, params in misses
+        ]
+        computed = [(name, key, future.result()) for name, key, future in futures]
+    else:
+        computed = [
+            (name, key, ANALYTICS_SECTIONS[name][0](**params))
+            for name, key, params in misses
+        ]
+    
+    for name, key, value in computed:
+        analytics_cache.set(key, value, generation)
+        results[name] = value
+    # Keep the caller's section order
+    return {name: results[name] for name in requested}
+
+# Tables whose commits make cached analytics stale
+ANALYTICS_TABLES = {'bookings', 'service_providers', 'promotions', 'booking_daily_stats', 'cohort_activity'}
+ANALYTICS_MODELS = (Booking, ServiceProvider, Promotion, BookingDailyStat)
+
+@event.listens_for(db.session, 'after_flush')
+def mark_analytics_changes(session, flush_context):
+    """Remember that this transaction touched data the analytics read"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ANALYTICS_MODELS):
+            session.info['analytics_stale'] = True
+            return
+
+@event.listens_for(db.session, 'do_orm_execute')
+def mark_analytics_bulk_changes(orm_execute_state):
+    """Catch bulk INSERT/UPDATE/DELETE statements run through the session"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) in ANALYTICS_TABLES:
+        orm_execute_state.session.info['analytics_stale'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_analytics_cache(session):
+    """Drop cached analytics once a change to their tables is committed.
+    
+    This only clears the cache of the current process; other workers pick
+    the change up when their entries reach ANALYTICS_CACHE_TTL.
+    """
+    if session.info.pop('analytics_stale', False):
+        analytics_cache.clear()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_analytics_changes(session):
+    session.info.pop('analytics_stale', None)
+
+def init_app(app):
+    analytics_cache.maxsize = app.config['ANALYTICS_CACHE_SIZE']
+    analytics_cache.ttl = app.config['ANALYTICS_CACHE_TTL']
+    section_pool.configure(app.config['ANALYTICS_SECTION_WORKERS'])
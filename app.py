@@ -1,81 +1,206 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Blueprint, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, current_app
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
-from werkzeug.security import generate_password_hash, check_password_hash
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///local_service.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-
-db = SQLAlchemy(app)
-
-# Models
-class ServiceProvider(db.Model):
-    __tablename__ = 'service_providers'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True)
-    service_type = db.Column(db.String(50))
-    rating = db.Column(db.Float, default=0.0)
-    total_bookings = db.Column(db.Integer, default=0)
-    is_premium = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Promotion(db.Model):
-    __tablename__ = 'promotions'
-    id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
-    promotion_type = db.Column(db.String(50))  # 'featured', 'banner'
-    title = db.Column(db.String(200))
-    description = db.Column(db.Text)
-    start_date = db.Column(db.DateTime, nullable=False)
-    end_date = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, active, expired
-    price = db.Column(db.Float)
-    impressions = db.Column(db.Integer, default=0)
-    clicks = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    provider = db.relationship('ServiceProvider', backref='promotions')
-
-class Booking(db.Model):
-    __tablename__ = 'bookings'
-    id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
-    user_id = db.Column(db.Integer)
-    service_type = db.Column(db.String(50))
-    amount = db.Column(db.Float)
-    status = db.Column(db.String(20))
-    booking_date = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    provider = db.relationship('ServiceProvider', backref='bookings')
-
-class Admin(db.Model):
-    __tablename__ = 'admins'
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), unique=True, nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    def set_password(self, password):
-        """Hash and set the password"""
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        """Check if the provided password matches the hash"""
-        return check_password_hash(self.password_hash, password)
+import base64
+import csv
+import hmac
+import io
+import json
+import os
+from sqlalchemy import desc, or_, and_, select, update, delete
+
+import analytics
+import assets
+import columnar
+import commands
+import database
+import etags
+import live
+import metrics
+import promotions
+import rollups
+import search
+import sketches
+from archive import archive_reaches
+from analytics import (
+    analytics_cache, cached_section, provider_leaderboard_section, service_type_leaderboards_section,
+    compute_sections, parse_section_request, LEADERBOARD_ORDERS, LEADERBOARD_MAX
+)
+from cohorts import cohort_retention, parse_cohort_request
+from columnar import booking_columns, parse_booking_query, query_bookings
+from database import db, chunks, use_read_replica
+from etags import conditional_on
+from live import analytics_stream
+from serializers import PROMOTION, PROMOTION_SUMMARY, PROVIDER, json_response
+from sketches import booking_sketch_summary
+from models import ServiceProvider, Promotion, Booking, PromotionHourlyStat, Admin, ArchivedBooking, ArchivedPromotion
+from search import provider_search, SEARCH_LIMIT_DEFAULT, SEARCH_LIMIT_MAX
+from geo import (
+    nearest_providers, NEARBY_RADIUS_DEFAULT_KM, NEARBY_RADIUS_MAX_KM,
+    NEARBY_LIMIT_DEFAULT, NEARBY_LIMIT_MAX
+)
+from promotions import (
+    promotion_counters, promotion_scheduler, featured_index, parse_promotion_payload,
+    parse_tracking_id, parse_tracking_ids, PROMOTION_STATUSES
+)
+
+bp = Blueprint('main', __name__)
+
+def create_app(config=None):
+    """Build the Flask app.
+    
+    `config` is a config class or import path; it defaults to the APP_CONFIG
+    environment variable, then config.DevelopmentConfig. No database I/O
+    happens here: create the schema with `flask --app app init-db` and the
+    default admin/providers with `flask --app app seed`.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config or os.getenv('APP_CONFIG', 'config.DevelopmentConfig'))
+    
+    database.init_app(app)
+    metrics.init_app(app)
+    rollups.init_app(app)
+    promotions.init_app(app)
+    search.init_app(app)
+    analytics.init_app(app)
+    columnar.init_app(app)
+    sketches.init_app(app)
+    live.init_app(app)
+    assets.init_app(app)
+    etags.init_app(app)
+    commands.init_app(app)
+    app.register_blueprint(bp)
+    
+    @app.before_request
+    def start_background_workers():
+        # Started per worker on first request, never in a pre-fork parent
+        if app.config['PROMOTION_SCHEDULER_ENABLED']:
+            promotion_scheduler.start()
+    
+    return app
+
+# Tables the dashboard sections of /admin/analytics/data read
+ANALYTICS_DATA_TABLES = (
+    'bookings', 'booking_daily_stats', 'booking_daily_sketches', 'service_providers', 'promotions'
+)
+
+# Keyset pagination
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+def page_size(args):
+    """Read the ?limit= page size, clamped to PAGE_SIZE_MAX"""
+    try:
+        limit = int(args.get('limit', PAGE_SIZE_DEFAULT))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, PAGE_SIZE_MAX))
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row into an opaque cursor token"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    """Unpack a cursor token produced by encode_cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def parse_date_arg(args, name):
+    """Parse an optional YYYY-MM-DD query argument"""
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+def promotion_filters(args):
+    """Collect promotion list filters from query arguments"""
+    filters = {
+        'status': args.get('status'),
+        'promotion_type': args.get('promotion_type'),
+        'provider_id': args.get('provider_id', type=int),
+        'date_from': parse_date_arg(args, 'from'),
+        'date_to': parse_date_arg(args, 'to')
+    }
+    return {key: value for key, value in filters.items() if value is not None and value != ''}
+
+def query_promotions(filters=None, cursor=None, limit=PAGE_SIZE_DEFAULT, shape=PROMOTION_SUMMARY):
+    """Return one page of promotions (newest first) as `shape` rows and the
+    next cursor.
+    
+    Only the shape's columns are selected, the provider name through a join
+    in the same statement, and paging continues from the (created_at, id)
+    of the previous page's last row, so every page costs one indexed query
+    regardless of table size.
+    """
+    filters = filters or {}
+    stmt = select(*shape.columns, Promotion.created_at.label('cursor_created_at')).select_from(Promotion).outerjoin(
+        ServiceProvider, Promotion.provider_id == ServiceProvider.id
+    )
+    
+    if 'status' in filters:
+        stmt = stmt.where(Promotion.status == filters['status'])
+    if 'promotion_type' in filters:
+        stmt = stmt.where(Promotion.promotion_type == filters['promotion_type'])
+    if 'provider_id' in filters:
+        stmt = stmt.where(Promotion.provider_id == filters['provider_id'])
+    # Date range matches promotions whose run overlaps [from, to]
+    if 'date_from' in filters:
+        stmt = stmt.where(Promotion.end_date >= filters['date_from'])
+    if 'date_to' in filters:
+        stmt = stmt.where(Promotion.start_date < filters['date_to'] + timedelta(days=1))
+    
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        created_at = datetime.fromisoformat(created_at)
+        stmt = stmt.where(or_(
+            Promotion.created_at < created_at,
+            and_(Promotion.created_at == created_at, Promotion.id < last_id)
+        ))
+    
+    rows = db.session.execute(
+        stmt.order_by(desc(Promotion.created_at), desc(Promotion.id)).limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_created_at, rows[-1].id)
+    return shape.serialize(rows), next_cursor
+
+def query_providers(filters=None, cursor=None, limit=PAGE_SIZE_DEFAULT):
+    """Return one page of providers ordered by id as PROVIDER rows and the
+    next cursor"""
+    filters = filters or {}
+    stmt = select(*PROVIDER.columns)
+    
+    if 'service_type' in filters:
+        stmt = stmt.where(ServiceProvider.service_type == filters['service_type'])
+    if 'is_premium' in filters:
+        stmt = stmt.where(ServiceProvider.is_premium == filters['is_premium'])
+    
+    if cursor:
+        (last_id,) = decode_cursor(cursor)
+        stmt = stmt.where(ServiceProvider.id > last_id)
+    
+    rows = db.session.execute(stmt.order_by(ServiceProvider.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return PROVIDER.serialize(rows), next_cursor
 
 # Root route
-@app.route('/')
+@bp.route('/')
 def index():
     """Home page - redirect to admin login"""
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
 # Admin login route
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     """Admin login page"""
     if request.method == 'POST':
@@ -91,34 +216,34 @@ def admin_login():
         if admin and admin.check_password(password):
             session['admin_id'] = admin.id
             session['admin_email'] = admin.email
-            return redirect(url_for('promotions_dashboard'))
+            return redirect(url_for('main.promotions_dashboard'))
         else:
             return render_template('admin_login.html', error='Invalid email or password')
     
     # If already logged in, redirect to dashboard
     if 'admin_id' in session:
-        return redirect(url_for('promotions_dashboard'))
+        return redirect(url_for('main.promotions_dashboard'))
     
     return render_template('admin_login.html')
 
 # Admin logout route
-@app.route('/admin/logout')
+@bp.route('/admin/logout')
 def admin_logout():
     """Admin logout"""
     session.pop('admin_id', None)
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
 # Routes for Promotion Management
-@app.route('/admin/promotions')
+@bp.route('/admin/promotions')
 def promotions_dashboard():
     """Display promotion management dashboard"""
     if 'admin_id' not in session:
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     
-    promotions = Promotion.query.order_by(desc(Promotion.created_at)).all()
-    return render_template('promotion.html', promotions=promotions)
+    promotions, next_cursor = query_promotions()
+    return render_template('promotion.html', promotions=promotions, next_cursor=next_cursor)
 
-@app.route('/admin/promotions/create', methods=['GET', 'POST'])
+@bp.route('/admin/promotions/create', methods=['GET', 'POST'])
 def create_promotion():
     """Create new promotion for service provider"""
     if request.method == 'POST':
@@ -128,37 +253,16 @@ def create_promotion():
         data = request.json
         
         try:
-            promotion = Promotion(
-                provider_id=int(data['provider_id']),
-                promotion_type=data['promotion_type'],
-                title=data['title'],
-                description=data['description'],
-                start_date=datetime.strptime(data['start_date'], '%Y-%m-%d'),
-                end_date=datetime.strptime(data['end_date'], '%Y-%m-%d'),
-                price=float(data['price']),
-                status='active'
-            )
+            promotion = Promotion(**parse_promotion_payload(data))
             
             db.session.add(promotion)
             db.session.commit()
+            promotion_scheduler.track(promotion.id, promotion.status, promotion.start_date, promotion.end_date)
             
-            return jsonify({
+            return json_response({
                 'success': True, 
                 'message': 'Promotion created successfully',
-                'promotion': {
-                    'id': promotion.id,
-                    'provider_id': promotion.provider_id,
-                    'provider_name': promotion.provider.name if promotion.provider else 'Unknown',
-                    'promotion_type': promotion.promotion_type,
-                    'title': promotion.title,
-                    'description': promotion.description,
-                    'start_date': promotion.start_date.strftime('%Y-%m-%d'),
-                    'end_date': promotion.end_date.strftime('%Y-%m-%d'),
-                    'status': promotion.status,
-                    'price': promotion.price,
-                    'impressions': promotion.impressions,
-                    'clicks': promotion.clicks
-                }
+                'promotion': PROMOTION.dump(promotion)
             })
         except Exception as e:
             db.session.rollback()
@@ -167,57 +271,163 @@ def create_promotion():
     providers = ServiceProvider.query.filter_by(is_premium=True).all()
     return render_template('promotion.html', providers=providers)
 
-@app.route('/admin/promotions/list')
+@bp.route('/admin/promotions/list')
+@conditional_on('promotions', 'service_providers')
+@use_read_replica
 def list_promotions():
-    """Get all promotions as JSON"""
+    """Get a page of promotions as JSON
+    
+    Query args: limit, cursor, status, promotion_type, provider_id,
+    from and to (YYYY-MM-DD, matched against the promotion's run), and
+    include=description to add each promotion's description.
+    """
     if 'admin_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
-    promotions = Promotion.query.order_by(desc(Promotion.created_at)).all()
+    try:
+        promotions, next_cursor = query_promotions(
+            promotion_filters(request.args),
+            cursor=request.args.get('cursor'),
+            limit=page_size(request.args),
+            shape=PROMOTION if request.args.get('include') == 'description' else PROMOTION_SUMMARY
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
-    return jsonify({
+    return json_response({
         'success': True,
-        'promotions': [
-            {
-                'id': p.id,
-                'provider_id': p.provider_id,
-                'provider_name': p.provider.name if p.provider else 'Unknown',
-                'promotion_type': p.promotion_type,
-                'title': p.title,
-                'description': p.description,
-                'start_date': p.start_date.strftime('%Y-%m-%d'),
-                'end_date': p.end_date.strftime('%Y-%m-%d'),
-                'status': p.status,
-                'price': p.price,
-                'impressions': p.impressions,
-                'clicks': p.clicks,
-                'created_at': p.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            } for p in promotions
-        ]
+        'next_cursor': next_cursor,
+        'promotions': promotions
     })
 
-@app.route('/admin/providers/list')
+@bp.route('/admin/providers/list')
+@conditional_on('service_providers')
+@use_read_replica
 def list_providers():
-    """Get all providers as JSON for dropdown"""
+    """Get a page of providers as JSON for dropdown
+    
+    Query args: limit, cursor, service_type, is_premium (true/false).
+    """
     if 'admin_id' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
-    providers = ServiceProvider.query.all()
+    filters = {}
+    if request.args.get('service_type'):
+        filters['service_type'] = request.args['service_type']
+    if request.args.get('is_premium'):
+        filters['is_premium'] = request.args['is_premium'].lower() in ('1', 'true', 'yes')
     
-    return jsonify({
+    try:
+        providers, next_cursor = query_providers(
+            filters,
+            cursor=request.args.get('cursor'),
+            limit=page_size(request.args)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return json_response({
         'success': True,
-        'providers': [
-            {
-                'id': p.id,
-                'name': p.name,
-                'email': p.email,
-                'service_type': p.service_type,
-                'is_premium': p.is_premium
-            } for p in providers
-        ]
+        'next_cursor': next_cursor,
+        'providers': providers
     })
 
-@app.route('/admin/promotions/<int:id>/update', methods=['PUT'])
+@bp.route('/providers/search')
+def search_providers():
+    """Prefix search over provider name, service type, location and description
+    
+    Query args: q, limit, service_type, premium (true/false). Used by the
+    admin provider picker and customer search.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_LIMIT_DEFAULT)), 1), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be an integer'}), 400
+    
+    premium = request.args.get('premium')
+    if premium is not None:
+        premium = premium.lower() in ('1', 'true', 'yes')
+    
+    query = request.args.get('q', '')
+    providers = provider_search.search(
+        query,
+        limit=limit,
+        service_type=request.args.get('service_type') or None,
+        premium=premium
+    )
+    return jsonify({'success': True, 'query': query, 'providers': providers})
+
+@bp.route('/providers/nearby')
+def nearby_providers():
+    """Nearest providers to a point
+    
+    Query args: lat, lng, radius_km, limit, service_type, premium
+    (true/false), and sort=promoted to list providers with an active
+    featured promotion, then premium ones, ahead of the rest.
+    """
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius_km = float(request.args.get('radius_km', NEARBY_RADIUS_DEFAULT_KM))
+        limit = int(request.args.get('limit', NEARBY_LIMIT_DEFAULT))
+    except KeyError:
+        return jsonify({'success': False, 'message': 'lat and lng are required'}), 400
+    except ValueError:
+        return jsonify({'success': False, 'message': 'lat, lng, radius_km and limit must be numbers'}), 400
+    
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'success': False, 'message': 'lat/lng out of range'}), 400
+    if not 0 < radius_km <= NEARBY_RADIUS_MAX_KM:
+        return jsonify({'success': False, 'message': f'radius_km must be between 0 and {NEARBY_RADIUS_MAX_KM:g}'}), 400
+    limit = min(max(limit, 1), NEARBY_LIMIT_MAX)
+    
+    premium = request.args.get('premium')
+    if premium is not None:
+        premium = premium.lower() in ('1', 'true', 'yes')
+    
+    providers = nearest_providers(
+        lat, lng,
+        radius_km=radius_km,
+        limit=limit,
+        service_type=request.args.get('service_type') or None,
+        premium=premium,
+        promoted_first=request.args.get('sort') == 'promoted'
+    )
+    return jsonify({'success': True, 'radius_km': radius_km, 'providers': providers})
+
+@bp.route('/admin/providers/leaderboard')
+@conditional_on('service_providers')
+@use_read_replica
+def provider_leaderboard():
+    """Top providers by rating, bookings or revenue
+    
+    Query args: by (rating, bookings or revenue), limit, and either
+    service_type for one type's leaderboard or group=service_type for
+    one leaderboard per type.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    by = request.args.get('by', 'rating')
+    if by not in LEADERBOARD_ORDERS:
+        return jsonify({'success': False, 'message': f"by must be one of: {', '.join(LEADERBOARD_ORDERS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), LEADERBOARD_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be an integer'}), 400
+    
+    if request.args.get('group') == 'service_type':
+        leaderboards = cached_section('service_type_leaderboards', service_type_leaderboards_section, by=by, limit=limit)
+        return jsonify({'success': True, 'by': by, 'leaderboards': leaderboards})
+    
+    service_type = request.args.get('service_type') or None
+    providers = cached_section(
+        'provider_leaderboard', provider_leaderboard_section,
+        by=by, service_type=service_type, limit=limit
+    )
+    return jsonify({'success': True, 'by': by, 'service_type': service_type, 'providers': providers})
+
+@bp.route('/admin/promotions/<int:id>/update', methods=['PUT'])
 def update_promotion(id):
     """Update promotion status"""
     promotion = Promotion.query.get_or_404(id)
@@ -227,9 +437,10 @@ def update_promotion(id):
         promotion.status = data['status']
     
     db.session.commit()
+    promotion_scheduler.track(promotion.id, promotion.status, promotion.start_date, promotion.end_date)
     return jsonify({'success': True, 'message': 'Promotion updated'})
 
-@app.route('/admin/promotions/<int:id>/delete', methods=['DELETE'])
+@bp.route('/admin/promotions/<int:id>/delete', methods=['DELETE'])
 def delete_promotion(id):
     """Delete promotion"""
     if 'admin_id' not in session:
@@ -240,129 +451,578 @@ def delete_promotion(id):
     db.session.commit()
     return jsonify({'success': True, 'message': 'Promotion deleted'})
 
+# Bulk promotion management
+BULK_MAX_ITEMS = 1000
+
+def _bulk_items(data, key):
+    """Pull the item list out of a bulk request body, or raise ValueError"""
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'{key} must be a non-empty list')
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(f'At most {BULK_MAX_ITEMS} items per request')
+    return items
+
+def _existing_ids(model, ids):
+    """Return the subset of ids present in model's table"""
+    found = set()
+    for chunk in chunks(list(ids)):
+        found.update(db.session.execute(select(model.id).where(model.id.in_(chunk))).scalars())
+    return found
+
+@bp.route('/admin/promotions/bulk/create', methods=['POST'])
+def bulk_create_promotions():
+    """Create many promotions in one transaction
+    
+    Body: {"promotions": [{provider_id, promotion_type, title, description,
+    start_date, end_date, price, status?}, ...]}. Invalid items are reported
+    in `results` and skipped; valid ones are inserted together.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        items = _bulk_items(request.json, 'promotions')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, parse_promotion_payload(item)))
+        except (ValueError, TypeError) as e:
+            results[index] = {'index': index, 'success': False, 'message': str(e)}
+    
+    known_providers = _existing_ids(ServiceProvider, {values['provider_id'] for _, values in valid})
+    promotions = []
+    for index, values in valid:
+        if values['provider_id'] not in known_providers:
+            results[index] = {'index': index, 'success': False, 'message': f"Unknown provider_id {values['provider_id']}"}
+        else:
+            promotions.append((index, Promotion(**values)))
+    
+    try:
+        # One flush batches the INSERTs into multi-row statements where the backend allows it
+        db.session.add_all([promotion for _, promotion in promotions])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error creating promotions: {str(e)}'}), 400
+    
+    for index, promotion in promotions:
+        results[index] = {'index': index, 'success': True, 'id': promotion.id}
+        promotion_scheduler.track(promotion.id, promotion.status, promotion.start_date, promotion.end_date)
+    
+    return jsonify({
+        'success': True,
+        'created': len(promotions),
+        'failed': len(items) - len(promotions),
+        'results': results
+    })
+
+@bp.route('/admin/promotions/bulk/update', methods=['PUT'])
+def bulk_update_promotions():
+    """Set the status of many promotions in one transaction
+    
+    Body: {"updates": [{"id": 1, "status": "active"}, ...]}. Rows are updated
+    with one UPDATE ... WHERE id IN (...) per target status.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        items = _bulk_items(request.json, 'updates')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    results = [None] * len(items)
+    requested = {}
+    for index, item in enumerate(items):
+        try:
+            promotion_id = int(item['id'])
+            status = item['status']
+        except (KeyError, TypeError, ValueError):
+            results[index] = {'index': index, 'success': False, 'message': 'Each update needs an integer id and a status'}
+            continue
+        if status not in PROMOTION_STATUSES:
+            results[index] = {'index': index, 'success': False, 'message': f"status must be one of: {', '.join(PROMOTION_STATUSES)}"}
+            continue
+        requested[index] = (promotion_id, status)
+    
+    existing = _existing_ids(Promotion, {promotion_id for promotion_id, _ in requested.values()})
+    by_status = {}
+    for index, (promotion_id, status) in requested.items():
+        if promotion_id not in existing:
+            results[index] = {'index': index, 'success': False, 'id': promotion_id, 'message': 'Promotion not found'}
+            continue
+        by_status.setdefault(status, []).append(promotion_id)
+        results[index] = {'index': index, 'success': True, 'id': promotion_id}
+    
+    try:
+        for status, ids in by_status.items():
+            for chunk in chunks(ids):
+                db.session.execute(
+                    update(Promotion).where(Promotion.id.in_(chunk)).values(status=status),
+                    execution_options={'synchronize_session': False}
+                )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error updating promotions: {str(e)}'}), 400
+    
+    promotion_scheduler.refresh([pid for ids in by_status.values() for pid in ids])
+    
+    updated = sum(len(ids) for ids in by_status.values())
+    return jsonify({
+        'success': True,
+        'updated': updated,
+        'failed': len(items) - updated,
+        'results': results
+    })
+
+@bp.route('/admin/promotions/bulk/delete', methods=['DELETE'])
+def bulk_delete_promotions():
+    """Delete many promotions in one transaction
+    
+    Body: {"ids": [1, 2, 3]}.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        items = _bulk_items(request.json, 'ids')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    results = [None] * len(items)
+    requested = {}
+    for index, item in enumerate(items):
+        try:
+            requested[index] = int(item)
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'success': False, 'message': 'id must be an integer'}
+    
+    existing = _existing_ids(Promotion, set(requested.values()))
+    for index, promotion_id in requested.items():
+        if promotion_id in existing:
+            results[index] = {'index': index, 'success': True, 'id': promotion_id}
+        else:
+            results[index] = {'index': index, 'success': False, 'id': promotion_id, 'message': 'Promotion not found'}
+    
+    try:
+        for chunk in chunks(sorted(existing)):
+            db.session.execute(
+                delete(Promotion).where(Promotion.id.in_(chunk)),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'Error deleting promotions: {str(e)}'}), 400
+    
+    return jsonify({
+        'success': True,
+        'deleted': len(existing),
+        'failed': len(items) - sum(1 for r in results if r['success']),
+        'results': results
+    })
+
+# Public promotion serving
+@bp.route('/promotions/featured')
+def featured_promotions():
+    """Promoted providers for a page's featured/banner slots
+    
+    Query args: service_type, promotion_type (featured or banner),
+    limit (default 3, max 20). Served from the in-memory index.
+    """
+    limit = max(1, min(request.args.get('limit', 3, type=int), 20))
+    if not featured_index.loaded:
+        featured_index.rebuild()
+    
+    entries = featured_index.select(
+        service_type=request.args.get('service_type') or None,
+        promotion_type=request.args.get('promotion_type') or None,
+        limit=limit
+    )
+    return jsonify({
+        'success': True,
+        'promotions': [
+            {key: value for key, value in entry.items() if key != 'expires_at'}
+            for entry in entries
+        ]
+    })
+
+# Public promotion tracking
+@bp.route('/promotions/<int:id>/impression', methods=['POST'])
+def track_impression(id):
+    """Record one impression of a promotion"""
+    try:
+        promotion_id = parse_tracking_id(id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if not featured_index.is_active(promotion_id):
+        return jsonify({'success': False, 'message': 'Promotion not found'}), 404
+    promotion_counters.record(promotion_id, impressions=1)
+    return jsonify({'success': True}), 202
+
+@bp.route('/promotions/<int:id>/click', methods=['POST'])
+def track_click(id):
+    """Record one click on a promotion"""
+    try:
+        promotion_id = parse_tracking_id(id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if not featured_index.is_active(promotion_id):
+        return jsonify({'success': False, 'message': 'Promotion not found'}), 404
+    promotion_counters.record(promotion_id, clicks=1)
+    return jsonify({'success': True}), 202
+
+@bp.route('/promotions/impressions', methods=['POST'])
+def track_impressions():
+    """Record impressions for every promotion shown on a page; ids of
+    promotions that aren't being served are skipped"""
+    try:
+        ids = parse_tracking_ids(request.json)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    recorded = 0
+    for pid in ids:
+        if featured_index.is_active(pid):
+            promotion_counters.record(pid, impressions=1)
+            recorded += 1
+    return jsonify({'success': True, 'recorded': recorded}), 202
+
+@bp.route('/admin/promotions/<int:id>/stats')
+@use_read_replica
+def promotion_stats(id):
+    """Hourly impressions, clicks and CTR for one promotion
+    
+    Query args: hours (default 48, max 24 * 90).
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    hours = max(1, min(request.args.get('hours', 48, type=int), 24 * 90))
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    
+    rows = PromotionHourlyStat.query.filter(
+        PromotionHourlyStat.promotion_id == id,
+        PromotionHourlyStat.hour >= since
+    ).order_by(PromotionHourlyStat.hour).all()
+    
+    return jsonify({
+        'success': True,
+        'promotion_id': id,
+        'stats': [
+            {
+                'hour': row.hour.strftime('%Y-%m-%d %H:00'),
+                'impressions': row.impressions,
+                'clicks': row.clicks,
+                'ctr': round(row.clicks / row.impressions, 4) if row.impressions else 0.0
+            } for row in rows
+        ]
+    })
+
 # Routes for Analytics & Reports
-@app.route('/admin/analytics')
+@bp.route('/admin/analytics')
 def analytics_dashboard():
     """Main analytics dashboard"""
     if 'admin_id' not in session:
-        return redirect(url_for('admin_login'))
+        return redirect(url_for('main.admin_login'))
     
     return render_template('analytics.html')
 
-@app.route('/admin/analytics/data')
+@bp.route('/admin/analytics/data')
+@conditional_on(*ANALYTICS_DATA_TABLES)
+@use_read_replica
 def get_analytics_data():
-    """Get analytics data for dashboard"""
-    
-    # Most booked services
-    most_booked = db.session.query(
-        Booking.service_type,
-        func.count(Booking.id).label('count')
-    ).group_by(Booking.service_type).order_by(desc('count')).limit(10).all()
-    
-    # Top rated providers
-    top_providers = ServiceProvider.query.order_by(
-        desc(ServiceProvider.rating)
-    ).limit(10).all()
-    
-    # Revenue trends (last 30 days)
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    revenue_data = db.session.query(
-        func.date(Booking.booking_date).label('date'),
-        func.sum(Booking.amount).label('revenue')
-    ).filter(
-        Booking.booking_date >= thirty_days_ago
-    ).group_by(func.date(Booking.booking_date)).all()
-    
-    # Total statistics
-    total_bookings = Booking.query.count()
-    total_revenue = db.session.query(func.sum(Booking.amount)).scalar() or 0
-    total_providers = ServiceProvider.query.count()
-    active_promotions = Promotion.query.filter_by(status='active').count()
+    """Get analytics data for dashboard
     
+    Query args: sections (comma-separated, e.g. statistics,revenue; all
+    by default), days for the revenue trend and limit for the top-N lists.
+    """
+    try:
+        requested = parse_section_request(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return json_response(compute_sections(requested))
+
+@bp.route('/admin/analytics/query')
+@conditional_on('bookings', 'service_providers')
+@use_read_replica
+def analytics_query():
+    """Ad-hoc booking counts and revenue from the in-memory column store
+    
+    Query args: group_by (comma-separated: at most one of day, week and
+    month, plus any of service_type, provider and status), from/to
+    (YYYY-MM-DD, inclusive), service_type, provider_id and status filters
+    (comma-separated), order (key, bookings or revenue) and limit.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        params = parse_booking_query(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    rows = query_bookings(**params)
     return jsonify({
-        'most_booked_services': [
-            {'service': item[0], 'count': item[1]} for item in most_booked
-        ],
-        'top_providers': [
-            {
-                'id': p.id,
-                'name': p.name,
-                'rating': p.rating,
-                'bookings': p.total_bookings,
-                'service_type': p.service_type
-            } for p in top_providers
-        ],
-        'revenue_trends': [
-            {'date': str(item[0]), 'revenue': float(item[1])} for item in revenue_data
-        ],
-        'statistics': {
-            'total_bookings': total_bookings,
-            'total_revenue': float(total_revenue),
-            'total_providers': total_providers,
-            'active_promotions': active_promotions
-        }
+        'success': True,
+        'group_by': params['group_by'],
+        'engine': booking_columns.engine,
+        'rows': rows
     })
 
-@app.route('/admin/analytics/export')
-def export_report():
-    """Export analytics report as JSON"""
-    data = get_analytics_data().json
-    return jsonify(data)
-
-# Create database tables and initialize default admin
-with app.app_context():
-    db.create_all()
-    
-    # Create default admin if it doesn't exist
-    admin = Admin.query.filter_by(email='admin@localservice.com').first()
-    if not admin:
-        default_admin = Admin(
-            username='admin',
-            email='admin@localservice.com'
+@bp.route('/admin/analytics/customers')
+@conditional_on('booking_daily_sketches', 'service_providers')
+@use_read_replica
+def analytics_customers():
+    """Approximate unique customers and heaviest customers/providers
+    
+    Merged from the daily sketches. Query args: from/to (YYYY-MM-DD,
+    inclusive; the last 30 days by default), service_type, by
+    (service_type or day, for a unique-customer breakdown) and top.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        today = datetime.utcnow().date()
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else today
+        date_from = (
+            datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+            else date_to - timedelta(days=29)
         )
-        default_admin.set_password('admin123')
-        db.session.add(default_admin)
-        db.session.commit()
-        print("Default admin created: admin@localservice.com / admin123")
-    
-    # Create default service providers if they don't exist
-    providers_data = [
-        {
-            'name': 'ABC Plumbing',
-            'email': 'abc.plumbing@localservice.com',
-            'service_type': 'Plumber',
-            'is_premium': True
-        },
-        {
-            'name': 'BRACU Barber',
-            'email': 'bracu.barber@localservice.com',
-            'service_type': 'Barber',
-            'is_premium': True
-        },
-        {
-            'name': 'Badda Electronics',
-            'email': 'badda.electronics@localservice.com',
-            'service_type': 'Electrician',
-            'is_premium': True
-        }
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'from/to must be dates (YYYY-MM-DD) and top an integer'}), 400
+    if date_to < date_from:
+        return jsonify({'success': False, 'message': 'to must not be before from'}), 400
+    by = request.args.get('by') or None
+    if by not in (None, 'service_type', 'day'):
+        return jsonify({'success': False, 'message': 'by must be service_type or day'}), 400
+    
+    summary = booking_sketch_summary(
+        date_from, date_to,
+        service_type=request.args.get('service_type') or None,
+        by=by,
+        top=min(max(top, 0), 20)
+    )
+    return jsonify(dict(summary, success=True, **{'from': str(date_from), 'to': str(date_to)}))
+
+@bp.route('/admin/analytics/cohorts')
+@conditional_on('cohort_activity')
+@use_read_replica
+def analytics_cohorts():
+    """Customer retention curves by weekly or monthly cohort
+    
+    Query args: grain (week or month), cohorts (how many consecutive
+    cohorts), periods (how many periods of each curve) and from
+    (YYYY-MM-DD; the first cohort is the one containing it, and the last
+    `cohorts` cohorts are returned without it).
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        params = parse_cohort_request(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    retention = cached_section('cohort_retention', cohort_retention, **params)
+    return jsonify(dict(retention, success=True))
+
+@bp.route('/admin/analytics/stream')
+def analytics_live_stream():
+    """Server-Sent Events: a `snapshot` of the live dashboard figures, then
+    a `delta` with just the changed ones whenever they change"""
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    return Response(
+        analytics_stream.events(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/admin/analytics/cache')
+def analytics_cache_stats():
+    """Hit/miss counters for the analytics cache"""
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    return jsonify({'success': True, 'cache': analytics_cache.stats()})
+
+@bp.route('/admin/metrics')
+def metrics_endpoint():
+    """Request, SQL and cache metrics in Prometheus text format
+    
+    Readable with an admin session or `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and hmac.compare_digest(authorization, f'Bearer {token}')
+    if 'admin_id' not in session and not scraper:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    return Response(metrics.request_metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.route('/admin/analytics/export')
+@use_read_replica
+def export_report():
+    """Export analytics report as JSON (takes the same args as /admin/analytics/data)"""
+    return get_analytics_data()
+
+# Raw data export
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+def _export_value(value):
+    """Render a column value for CSV/NDJSON output"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+def _partitions(statements):
+    for stmt in statements:
+        result = db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        yield from result.partitions()
+
+def stream_rows(statements, columns, fmt):
+    """Yield the results of one or more queries, one after the other, as
+    CSV or NDJSON text, one chunk per batch.
+    
+    Rows are fetched EXPORT_CHUNK_SIZE at a time through a server-side
+    cursor, so memory stays flat however many rows the export covers.
+    """
+    buffer = io.StringIO()
+    
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for partition in _partitions(statements):
+            for row in partition:
+                writer.writerow([_export_value(value) for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+    else:
+        for partition in _partitions(statements):
+            for row in partition:
+                buffer.write(json.dumps(dict(zip(columns, map(_export_value, row)))))
+                buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+def bookings_export_query(args):
+    """Build the bookings export SELECTs from query arguments: archived
+    bookings first when the date range reaches back into the archive"""
+    columns = ['id', 'provider_id', 'user_id', 'service_type', 'amount', 'status', 'booking_date']
+    date_from = parse_date_arg(args, 'from')
+    date_to = parse_date_arg(args, 'to')
+    
+    def bookings_from(model):
+        stmt = select(*[getattr(model, name) for name in columns])
+        if date_from:
+            stmt = stmt.where(model.booking_date >= date_from)
+        if date_to:
+            stmt = stmt.where(model.booking_date < date_to + timedelta(days=1))
+        if args.get('status'):
+            stmt = stmt.where(model.status == args['status'])
+        if args.get('service_type'):
+            stmt = stmt.where(model.service_type == args['service_type'])
+        return stmt.order_by(model.id)
+    
+    statements = [bookings_from(Booking)]
+    if archive_reaches(ArchivedBooking.booking_date, date_from):
+        statements.insert(0, bookings_from(ArchivedBooking))
+    return statements, columns
+
+def promotions_export_query(args):
+    """Build the promotions export SELECTs (with provider name) from query
+    arguments: archived promotions first when the date range reaches back
+    into the archive"""
+    columns = [
+        'id', 'provider_id', 'provider_name', 'promotion_type', 'title',
+        'start_date', 'end_date', 'status', 'price', 'impressions', 'clicks', 'created_at'
     ]
+    # Date range matches promotions whose run overlaps [from, to]
+    date_from = parse_date_arg(args, 'from')
+    date_to = parse_date_arg(args, 'to')
     
-    for provider_data in providers_data:
-        # Check if provider exists by name
-        existing_provider = ServiceProvider.query.filter_by(name=provider_data['name']).first()
-        if not existing_provider:
-            provider = ServiceProvider(
-                name=provider_data['name'],
-                email=provider_data['email'],
-                service_type=provider_data['service_type'],
-                is_premium=provider_data['is_premium'],
-                rating=4.5,
-                total_bookings=0
-            )
-            db.session.add(provider)
-            print(f"Created provider: {provider_data['name']}")
+    def promotions_from(model):
+        stmt = select(
+            model.id,
+            model.provider_id,
+            ServiceProvider.name,
+            model.promotion_type,
+            model.title,
+            model.start_date,
+            model.end_date,
+            model.status,
+            model.price,
+            model.impressions,
+            model.clicks,
+            model.created_at
+        ).outerjoin(ServiceProvider, model.provider_id == ServiceProvider.id)
+        if date_from:
+            stmt = stmt.where(model.end_date >= date_from)
+        if date_to:
+            stmt = stmt.where(model.start_date < date_to + timedelta(days=1))
+        if args.get('status'):
+            stmt = stmt.where(model.status == args['status'])
+        if args.get('service_type'):
+            stmt = stmt.where(ServiceProvider.service_type == args['service_type'])
+        return stmt.order_by(model.id)
     
-    db.session.commit()
+    statements = [promotions_from(Promotion)]
+    if archive_reaches(ArchivedPromotion.end_date, date_from):
+        statements.insert(0, promotions_from(ArchivedPromotion))
+    return statements, columns
+
+EXPORT_DATASETS = {
+    'bookings': bookings_export_query,
+    'promotions': promotions_export_query
+}
+
+@bp.route('/admin/analytics/export/<dataset>')
+@use_read_replica
+def export_data(dataset):
+    """Stream raw bookings or promotions as CSV or NDJSON
+    
+    Query args: format (csv or ndjson), from and to (YYYY-MM-DD),
+    status, service_type. Archived rows are included when the range
+    reaches back into the archive.
+    """
+    if 'admin_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'success': False, 'message': f'Unknown dataset: {dataset}'}), 404
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f'Unsupported format: {fmt}'}), 400
+    
+    try:
+        statements, columns = EXPORT_DATASETS[dataset](request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    filename = f"{dataset}-{datetime.utcnow().strftime('%Y-%m-%d')}.{fmt}"
+    return Response(
+        stream_with_context(stream_rows(statements, columns, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
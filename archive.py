@@ -0,0 +1,105 @@
+"""
+archive.py - Moving old bookings and promotions out of the hot tables
+
+Completed and cancelled bookings and expired promotions older than
+ARCHIVE_BOOKINGS_AFTER_DAYS / ARCHIVE_PROMOTIONS_AFTER_DAYS are copied to
+bookings_archive / promotions_archive and deleted from bookings /
+promotions, ARCHIVE_BATCH_SIZE rows per transaction, so writers are never
+locked out for longer than one small batch.
+
+Rows are moved with Core statements, which the ORM flush listeners don't
+see: booking_daily_stats, the provider counters, the sketches and the
+cohort tables keep counting archived bookings. The rebuild functions read
+all_bookings(), the union of both tables, so a rebuild gives the same
+figures. Exports read the archive too when their date range reaches back
+into it (see archive_reaches).
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal, select, union_all
+
+from database import db, chunks
+from models import Booking, Promotion, ArchivedBooking, ArchivedPromotion
+
+ARCHIVE_BOOKING_STATUSES = ('completed', 'cancelled')
+ARCHIVE_PROMOTION_STATUSES = ('expired',)
+
+def all_bookings():
+    """bookings and bookings_archive as one subquery with the columns of bookings"""
+    names = [column.name for column in Booking.__table__.columns]
+    archive = ArchivedBooking.__table__
+    return union_all(
+        select(*Booking.__table__.columns),
+        select(*[archive.c[name] for name in names])
+    ).subquery('all_bookings')
+
+def archive_reaches(date_column, date_from):
+    """Whether rows dated on or after the datetime date_from may be in the
+    archive that date_column belongs to (always, for an open-ended range)"""
+    if date_from is None:
+        return True
+    newest = db.session.execute(select(func.max(date_column))).scalar()
+    return newest is not None and newest >= date_from
+
+def move_rows(source, archive, eligible, batch_size=500):
+    """Move the rows of source matching `eligible` to archive, batch_size
+    rows per transaction; returns how many were moved.
+    
+    Each batch copies and deletes the same ids in one transaction, re-checking
+    `eligible` so a row edited since it was picked stays put. The row with
+    the highest id is never moved: SQLite would hand its id out again.
+    """
+    source_id = source.c.id
+    with db.engine.connect() as connection:
+        newest = connection.execute(select(func.max(source_id))).scalar()
+    if newest is None:
+        return 0
+    
+    names = [column.name for column in source.columns]
+    archived = select(archive.c.id)
+    moved = 0
+    last_id = 0
+    while True:
+        with db.engine.connect() as connection:
+            ids = connection.execute(
+                select(source_id).where(eligible, source_id > last_id, source_id < newest)
+                .order_by(source_id).limit(batch_size)
+            ).scalars().all()
+        if not ids:
+            return moved
+        
+        archived_at = literal(datetime.utcnow(), archive.c.archived_at.type)
+        with db.engine.begin() as connection:
+            for chunk in chunks(ids):
+                connection.execute(archive.insert().from_select(
+                    names + ['archived_at'],
+                    select(*source.columns, archived_at).where(source_id.in_(chunk), eligible)
+                ))
+                moved += connection.execute(source.delete().where(
+                    source_id.in_(chunk),
+                    source_id.in_(archived.where(archive.c.id.in_(chunk)))
+                )).rowcount
+        last_id = ids[-1]
+
+def archive_bookings(days=365, batch_size=500):
+    """Archive completed and cancelled bookings made more than `days` days ago"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    table = Booking.__table__
+    return move_rows(
+        table,
+        ArchivedBooking.__table__,
+        table.c.status.in_(ARCHIVE_BOOKING_STATUSES) & (table.c.booking_date < cutoff),
+        batch_size
+    )
+
+def archive_promotions(days=180, batch_size=500):
+    """Archive expired promotions that ended more than `days` days ago"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    table = Promotion.__table__
+    return move_rows(
+        table,
+        ArchivedPromotion.__table__,
+        table.c.status.in_(ARCHIVE_PROMOTION_STATUSES) & (table.c.end_date < cutoff),
+        batch_size
+    )
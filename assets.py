@@ -0,0 +1,203 @@
+"""
+assets.py - Vendored UI libraries and fingerprinted, precompressed static files
+
+`flask --app app vendor-assets` downloads the pinned Bootstrap, Font Awesome
+and Chart.js releases into static/vendor/, so the admin pages work without
+CDN access. `flask --app app build-assets` copies every file under static/
+to static/dist/ with a content hash in its name, points url(...) references
+in stylesheets at the hashed names, writes a gzip variant of each
+compressible file and records the mapping in static/dist/manifest.json.
+
+With the manifest loaded, url_for('static', filename=...) returns the
+hashed copy, which is served with a one-year immutable Cache-Control and as
+its .gz variant to clients that accept gzip. Old hashed files are kept
+(unless build-assets --clean) for pages still referencing them.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.request
+
+from flask import current_app, request, send_from_directory, url_for
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+ASSET_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 12
+# Already-compressed formats (woff2, images) gain nothing from gzip
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.map', '.svg', '.ttf', '.txt')
+
+FONT_AWESOME = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0'
+# Vendored files: path under static/ -> pinned CDN URL. Each is linked from
+# the CDN until it has been downloaded.
+VENDOR_FILES = {
+    'vendor/bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/chart.js/chart.umd.min.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js',
+    'vendor/fontawesome/css/all.min.css': f'{FONT_AWESOME}/css/all.min.css',
+}
+for font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility'):
+    for extension in ('woff2', 'ttf'):
+        VENDOR_FILES[f'vendor/fontawesome/webfonts/{font}.{extension}'] = f'{FONT_AWESOME}/webfonts/{font}.{extension}'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+class AssetManifest:
+    """Source path -> fingerprinted path under static/, and which fingerprinted
+    files have a .gz variant"""
+    
+    def __init__(self):
+        self.files = {}
+        self.compressed = set()
+    
+    def load(self, path):
+        with open(path) as f:
+            data = json.load(f)
+        self.files = data['files']
+        self.compressed = set(data['gzip'])
+    
+    def clear(self):
+        self.files = {}
+        self.compressed = set()
+
+asset_manifest = AssetManifest()
+
+def fingerprint(path, content):
+    """path with a hash of content before its extension"""
+    root, extension = posixpath.splitext(path)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}'
+
+def rewrite_css_urls(css_path, content, files):
+    """Point relative url(...) references of a stylesheet at the hashed
+    copies of the files they name"""
+    css_dir = posixpath.dirname(css_path)
+    # The hashed stylesheet lands in the same directory under dist/
+    hashed_dir = posixpath.join(DIST_DIR, css_dir)
+    
+    def replace(match):
+        reference = match.group(2).strip()
+        if reference.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        if target not in files:
+            return match.group(0)
+        return f'url({posixpath.relpath(files[target], hashed_dir)}{suffix})'
+    
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+def source_files(static_folder):
+    """Paths under static/ to fingerprint, relative and '/'-separated,
+    stylesheets last so the files they reference are hashed first"""
+    paths = []
+    for root, dirs, names in os.walk(static_folder):
+        relative_root = os.path.relpath(root, static_folder)
+        if relative_root == DIST_DIR or relative_root.startswith(DIST_DIR + os.sep):
+            dirs[:] = []
+            continue
+        for name in names:
+            relative = os.path.normpath(os.path.join(relative_root, name)).replace(os.sep, '/')
+            paths.append(relative)
+    return sorted(paths, key=lambda path: (path.endswith('.css'), path))
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+def build_assets(static_folder, clean=False):
+    """Fingerprint and gzip everything under static_folder; returns the manifest dict"""
+    files = {}
+    compressed = []
+    for path in source_files(static_folder):
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = rewrite_css_urls(path, content, files)
+        hashed = posixpath.join(DIST_DIR, fingerprint(path, content))
+        files[path] = hashed
+        
+        target = os.path.join(static_folder, hashed)
+        if not os.path.exists(target):
+            _write(target, content)
+        if path.endswith(COMPRESSIBLE_EXTENSIONS):
+            # mtime=0 keeps the .gz byte-identical across builds
+            packed = gzip.compress(content, 9, mtime=0)
+            if len(packed) < len(content):
+                if not os.path.exists(target + '.gz'):
+                    _write(target + '.gz', packed)
+                compressed.append(hashed)
+    
+    manifest = {'files': files, 'gzip': compressed}
+    dist = os.path.join(static_folder, DIST_DIR)
+    _write(os.path.join(dist, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    
+    if clean:
+        keep = set(files.values()) | {f'{path}.gz' for path in compressed} | {posixpath.join(DIST_DIR, MANIFEST_NAME)}
+        for root, _, names in os.walk(dist):
+            for name in names:
+                relative = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+                if relative not in keep:
+                    os.remove(os.path.join(root, name))
+    return manifest
+
+def vendor_assets(static_folder, force=False, timeout=30):
+    """Download the pinned vendor files that are missing; returns their paths"""
+    fetched = []
+    for path, url in VENDOR_FILES.items():
+        target = os.path.join(static_folder, path)
+        if os.path.exists(target) and not force:
+            continue
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            _write(target, response.read())
+        fetched.append(path)
+    return fetched
+
+def vendor_url(filename):
+    """URL of a vendored file: the local (fingerprinted) copy once it has
+    been downloaded, the pinned CDN URL until then"""
+    if filename in asset_manifest.files or os.path.exists(os.path.join(current_app.static_folder, filename)):
+        return url_for('static', filename=filename)
+    return VENDOR_FILES[filename]
+
+def serve_static(filename):
+    """Static view: fingerprinted files are cached for a year and sent
+    gzipped when the client accepts it; the rest as Flask serves them"""
+    if not filename.startswith(DIST_DIR + '/'):
+        return current_app.send_static_file(filename)
+    
+    mimetype = mimetypes.guess_type(filename)[0]
+    if filename in asset_manifest.compressed and 'gzip' in request.accept_encodings:
+        response = send_from_directory(
+            current_app.static_folder, filename + '.gz', mimetype=mimetype, max_age=ASSET_MAX_AGE
+        )
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(
+            current_app.static_folder, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE
+        )
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+def init_app(app):
+    asset_manifest.clear()
+    manifest_path = os.path.join(app.static_folder, DIST_DIR, MANIFEST_NAME)
+    if app.config['ASSETS_FINGERPRINT'] and os.path.exists(manifest_path):
+        asset_manifest.load(manifest_path)
+    
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static':
+            hashed = asset_manifest.files.get(values.get('filename'))
+            if hashed:
+                values['filename'] = hashed
+    
+    app.view_functions['static'] = serve_static
+    app.add_template_global(vendor_url)
@@ -0,0 +1,513 @@
+"""
+benchmark.py - Endpoint benchmark suite
+
+Builds fixture databases of several sizes with the init_db.py generator,
+drives the hot admin and promotion endpoints through the Flask test client
+and prints throughput, latency percentiles and SQL query counts per
+endpoint as JSON.
+
+Usage: python benchmark.py
+       python benchmark.py --sizes small,medium --requests 200 --threads 4
+       python benchmark.py --sizes 5k:1M --endpoints analytics_data,providers_list -o bench.json
+       python benchmark.py --sizes 2k:10k --promotions 100k --endpoints promotions_list --serialization-rows 50k
+
+Fixtures are cached in instance/benchmarks/ and reused across runs; each
+run works on a copy so the write endpoints never change a fixture.
+"""
+
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sqlalchemy
+from flask import jsonify
+from sqlalchemy import desc, event
+from sqlalchemy.orm import joinedload
+
+from app import create_app, query_promotions
+from config import DevelopmentConfig
+from database import db
+from geo import AREA_COORDINATES
+from init_db import generate_dataset, parse_count
+from models import Promotion
+from promotions import promotion_counters
+from sketches import booking_sketches
+from serializers import json_response
+
+# Named dataset sizes: (providers, bookings)
+SIZES = {
+    'small': (200, 10000),
+    'medium': (2000, 200000),
+    'large': (20000, 2000000)
+}
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'benchmarks')
+
+
+class BenchmarkConfig(DevelopmentConfig):
+    # No background scheduler or replica: measure the request path only
+    PROMOTION_SCHEDULER_ENABLED = False
+    DATABASE_REPLICA_URL = None
+    ANALYTICS_CACHE_TTL = 0.0
+    TESTING = True
+
+
+def parse_size(value):
+    """Parse a size name or a providers:bookings pair like 5k:1M"""
+    if value in SIZES:
+        return value, SIZES[value]
+    providers, sep, bookings = value.partition(':')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"unknown size {value!r}; use {', '.join(SIZES)} or providers:bookings")
+    return value.replace(':', '-'), (parse_count(providers), parse_count(bookings))
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not values:
+        return None
+    position = (len(values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class QueryCounter:
+    """Count SQL statements per client thread on every engine the app uses.
+
+    The count lives in a context variable, so statements the app runs on
+    its own pools in a copied context are charged to the request.
+    """
+
+    def __init__(self):
+        self._count_var = ContextVar('benchmark_query_count', default=None)
+
+    def install(self, engines):
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        counts = self._count_var.get()
+        if counts is not None:
+            counts[0] += 1
+
+    def reset(self):
+        self._count_var.set([0])
+
+    @property
+    def count(self):
+        counts = self._count_var.get()
+        return counts[0] if counts else 0
+
+
+# Endpoints: name -> function(rng, state) returning (method, path, json body)
+def _analytics_data(rng, state):
+    return 'GET', '/admin/analytics/data', None
+
+def _analytics_sections(rng, state):
+    sections = rng.choice(['statistics', 'statistics,revenue', 'revenue,providers'])
+    return 'GET', f"/admin/analytics/data?sections={sections}&days={rng.choice([30, 90])}", None
+
+def _analytics_query(rng, state):
+    group_by = rng.choice(['day', 'week,service_type', 'month,status', 'service_type', 'provider'])
+    since = (state['end'] - timedelta(days=rng.choice([30, 90, 365]))).strftime('%Y-%m-%d')
+    return 'GET', f'/admin/analytics/query?group_by={group_by}&from={since}&order=revenue&limit=100', None
+
+def _customer_sketches(rng, state):
+    since = (state['end'] - timedelta(days=rng.choice([7, 30, 365]))).strftime('%Y-%m-%d')
+    by = rng.choice(['', 'service_type'])
+    return 'GET', f"/admin/analytics/customers?from={since}&to={state['end']:%Y-%m-%d}&by={by}", None
+
+def _customer_cohorts(rng, state):
+    grain = rng.choice(['month', 'week'])
+    return 'GET', f"/admin/analytics/cohorts?grain={grain}&cohorts={rng.choice([6, 12, 24])}", None
+
+def _analytics_report(rng, state):
+    return 'GET', '/admin/analytics/export', None
+
+def _promotions_list(rng, state):
+    status = rng.choice(['', 'active', 'expired'])
+    return 'GET', f'/admin/promotions/list?limit=50&status={status}', None
+
+def _providers_list(rng, state):
+    service_type = rng.choice(['', 'Plumber', 'Barber', 'Electrician'])
+    return 'GET', f'/admin/providers/list?limit=50&service_type={service_type}', None
+
+def _provider_leaderboard(rng, state):
+    by = rng.choice(['rating', 'bookings', 'revenue'])
+    service_type = rng.choice(['', 'Plumber', 'Barber', 'Electrician'])
+    return 'GET', f'/admin/providers/leaderboard?by={by}&service_type={service_type}', None
+
+def _provider_search(rng, state):
+    query = rng.choice(['quick', 'pro plu', 'elite barber', 'dhan', 'ac rep', 'master carp'])
+    return 'GET', f'/providers/search?q={query}&limit=20', None
+
+def _nearby_providers(rng, state):
+    lat, lng = rng.choice(list(AREA_COORDINATES.values())[:-1])
+    lat += rng.uniform(-0.01, 0.01)
+    lng += rng.uniform(-0.01, 0.01)
+    radius = rng.choice([1, 2, 5])
+    sort = rng.choice(['', 'promoted'])
+    return 'GET', f'/providers/nearby?lat={lat:.5f}&lng={lng:.5f}&radius_km={radius}&sort={sort}', None
+
+def _export_bookings(rng, state):
+    since = (state['end'] - timedelta(days=30)).strftime('%Y-%m-%d')
+    return 'GET', f'/admin/analytics/export/bookings?format=csv&from={since}', None
+
+def _promotion_payload(rng, state):
+    start = state['end'] + timedelta(days=rng.randint(-30, 30))
+    return {
+        'provider_id': rng.randint(1, state['providers']),
+        'promotion_type': rng.choice(['featured', 'banner']),
+        'title': 'Benchmark promotion',
+        'description': 'Created by benchmark.py',
+        'start_date': start.strftime('%Y-%m-%d'),
+        'end_date': (start + timedelta(days=14)).strftime('%Y-%m-%d'),
+        'price': 2500
+    }
+
+def _create_promotion(rng, state):
+    return 'POST', '/admin/promotions/create', _promotion_payload(rng, state)
+
+def _bulk_create_promotions(rng, state):
+    return 'POST', '/admin/promotions/bulk/create', {
+        'promotions': [_promotion_payload(rng, state) for _ in range(50)]
+    }
+
+def _update_promotion(rng, state):
+    promotion_id = rng.randint(1, state['promotions'])
+    return 'PUT', f'/admin/promotions/{promotion_id}/update', {'status': rng.choice(['active', 'expired'])}
+
+def _bulk_update_promotions(rng, state):
+    return 'PUT', '/admin/promotions/bulk/update', {
+        'updates': [
+            {'id': rng.randint(1, state['promotions']), 'status': rng.choice(['active', 'expired'])}
+            for _ in range(50)
+        ]
+    }
+
+def _track_impressions(rng, state):
+    return 'POST', '/promotions/impressions', {
+        'ids': [rng.randint(1, state['promotions']) for _ in range(10)]
+    }
+
+ENDPOINTS = {
+    'analytics_data': _analytics_data,
+    'analytics_sections': _analytics_sections,
+    'analytics_query': _analytics_query,
+    'customer_sketches': _customer_sketches,
+    'customer_cohorts': _customer_cohorts,
+    'analytics_report': _analytics_report,
+    'promotions_list': _promotions_list,
+    'providers_list': _providers_list,
+    'provider_leaderboard': _provider_leaderboard,
+    'provider_search': _provider_search,
+    'nearby_providers': _nearby_providers,
+    'export_bookings': _export_bookings,
+    'create_promotion': _create_promotion,
+    'bulk_create_promotions': _bulk_create_promotions,
+    'update_promotion': _update_promotion,
+    'bulk_update_promotions': _bulk_update_promotions,
+    'track_impressions': _track_impressions
+}
+
+
+def build_fixture(name, providers, bookings, args):
+    """Return the path of a fixture database, generating it if needed"""
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    path = os.path.join(
+        FIXTURE_DIR,
+        f"{name}-{providers}-{bookings}-{args.days}d-seed{args.seed}-{args.end_date:%Y%m%d}"
+        + (f"-{args.promotions}p" if args.promotions is not None else '') + '.db'
+    )
+    if os.path.exists(path) and not args.rebuild:
+        return path, 0.0
+    
+    started = time.perf_counter()
+    partial = path + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    app = create_app(type('FixtureConfig', (BenchmarkConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{partial}'
+    }))
+    generate_dataset(
+        providers=providers,
+        bookings=bookings,
+        days=args.days,
+        promotions=args.promotions,
+        seed=args.seed,
+        end_date=args.end_date,
+        flask_app=app,
+        quiet=not args.verbose
+    )
+    with app.app_context():
+        # Fold the WAL back into the main file so the fixture is one file
+        db.session.execute(sqlalchemy.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        db.session.commit()
+        db.engine.dispose()
+    os.replace(partial, path)
+    return path, time.perf_counter() - started
+
+
+def run_endpoint(app, counter, name, factory, state, args):
+    """Drive one endpoint and summarise its latencies and query counts"""
+    latencies = []
+    queries = []
+    sizes = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_id, count):
+        rng = random.Random(f"{args.seed}-{name}-{worker_id}")
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['admin_id'] = 1
+        for i in range(args.warmup + count):
+            method, path, body = factory(rng, state)
+            counter.reset()
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            data = response.get_data()
+            elapsed = time.perf_counter() - started
+            if i < args.warmup:
+                continue
+            with lock:
+                latencies.append(elapsed * 1000.0)
+                queries.append(counter.count)
+                sizes.append(len(data))
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+    
+    per_thread = [args.requests // args.threads] * args.threads
+    for i in range(args.requests % args.threads):
+        per_thread[i] += 1
+    threads = [
+        threading.Thread(target=worker, args=(i, count))
+        for i, count in enumerate(per_thread) if count
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    
+    latencies.sort()
+    measured = len(latencies)
+    return {
+        'requests': measured,
+        'errors': len(errors),
+        'error_statuses': sorted(set(errors)),
+        'throughput_rps': round(measured / wall, 2) if wall else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / measured, 3) if measured else None,
+            'p50': round(percentile(latencies, 50), 3) if measured else None,
+            'p95': round(percentile(latencies, 95), 3) if measured else None,
+            'p99': round(percentile(latencies, 99), 3) if measured else None,
+            'max': round(latencies[-1], 3) if measured else None
+        },
+        'queries': {
+            'mean': round(sum(queries) / measured, 2) if measured else None,
+            'max': max(queries) if measured else None
+        },
+        'response_bytes_mean': round(sum(sizes) / measured) if measured else None
+    }
+
+
+def _promotion_list_orm(limit):
+    """The promotion list as built before serializers.py: full ORM objects
+    with their providers, hand-built dicts and jsonify"""
+    promotions = Promotion.query.options(joinedload(Promotion.provider)).order_by(
+        desc(Promotion.created_at), desc(Promotion.id)
+    ).limit(limit).all()
+    return jsonify({
+        'success': True,
+        'promotions': [
+            {
+                'id': p.id,
+                'provider_id': p.provider_id,
+                'provider_name': p.provider.name if p.provider else 'Unknown',
+                'promotion_type': p.promotion_type,
+                'title': p.title,
+                'description': p.description,
+                'start_date': p.start_date.strftime('%Y-%m-%d'),
+                'end_date': p.end_date.strftime('%Y-%m-%d'),
+                'status': p.status,
+                'price': p.price,
+                'impressions': p.impressions,
+                'clicks': p.clicks,
+                'created_at': p.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            } for p in promotions
+        ]
+    })
+
+def _promotion_list_projected(limit):
+    promotions, _ = query_promotions(limit=limit)
+    return json_response({'success': True, 'promotions': promotions})
+
+SERIALIZERS = {
+    'orm_dicts': _promotion_list_orm,
+    'projected': _promotion_list_projected
+}
+
+
+def run_serialization(app, rows, repeat):
+    """Rows/sec of building one large promotion list response, the old way
+    and through serializers.py (best of `repeat` runs each)"""
+    results = {}
+    for name, build in SERIALIZERS.items():
+        timings = []
+        for _ in range(repeat):
+            with app.test_request_context():
+                started = time.perf_counter()
+                response = build(rows)
+                body = response.get_data()
+                timings.append(time.perf_counter() - started)
+                db.session.remove()
+        served = len(json.loads(body)['promotions'])
+        best = min(timings)
+        results[name] = {
+            'rows': served,
+            'seconds': round(best, 4),
+            'rows_per_second': round(served / best) if best else None,
+            'response_bytes': len(body)
+        }
+    before, after = results['orm_dicts']['seconds'], results['projected']['seconds']
+    results['speedup'] = round(before / after, 2) if after else None
+    return results
+
+
+def run_size(name, providers, bookings, args):
+    """Benchmark every selected endpoint against one dataset size"""
+    fixture, build_seconds = build_fixture(name, providers, bookings, args)
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        working_copy = os.path.join(workdir, 'bench.db')
+        shutil.copyfile(fixture, working_copy)
+        overrides = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{working_copy}'}
+        if args.analytics_cache:
+            overrides['ANALYTICS_CACHE_TTL'] = DevelopmentConfig.ANALYTICS_CACHE_TTL
+        app = create_app(type('RunConfig', (BenchmarkConfig,), overrides))
+        
+        counter = QueryCounter()
+        with app.app_context():
+            counter.install(db.engines.values())
+            promotions = db.session.execute(sqlalchemy.text('SELECT COUNT(*) FROM promotions')).scalar()
+        
+        state = {'providers': providers, 'promotions': max(promotions, 1), 'end': args.end_date}
+        endpoints = {}
+        for endpoint in args.endpoints:
+            endpoints[endpoint] = run_endpoint(app, counter, endpoint, ENDPOINTS[endpoint], state, args)
+            if args.verbose:
+                summary = endpoints[endpoint]
+                print(f"  {name:>8} {endpoint:<24} p50 {summary['latency_ms']['p50']}ms "
+                      f"p99 {summary['latency_ms']['p99']}ms {summary['throughput_rps']} req/s",
+                      file=sys.stderr)
+        
+        serialization = None
+        if args.serialization_rows:
+            serialization = run_serialization(app, args.serialization_rows, args.serialization_repeat)
+        
+        # Write buffered impressions and sketches now, while the working copy still exists
+        promotion_counters.flush()
+        booking_sketches.flush()
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    return {
+        'dataset': name,
+        'providers': providers,
+        'bookings': bookings,
+        'fixture': os.path.basename(fixture),
+        'fixture_build_seconds': round(build_seconds, 2),
+        'endpoints': endpoints,
+        'serialization': serialization
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot endpoints against generated datasets')
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"comma separated sizes: {', '.join(SIZES)} or providers:bookings (default: small,medium)")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='comma separated endpoint names (default: all)')
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per endpoint (default: 100)')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per thread first (default: 5)')
+    parser.add_argument('--threads', type=int, default=1, help='concurrent client threads (default: 1)')
+    parser.add_argument('--days', type=int, default=730, help='days of booking history (default: 730)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--end-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        default=datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
+                        help='last day of generated history, YYYY-MM-DD (default: today)')
+    parser.add_argument('--analytics-cache', action='store_true',
+                        help='keep the analytics section cache on (default: off, every request computes)')
+    parser.add_argument('--promotions', type=parse_count,
+                        help='promotions per fixture (default: providers / 10)')
+    parser.add_argument('--serialization-rows', type=parse_count, default=0,
+                        help='also time building a promotion list of this many rows, ORM vs projected (default: off)')
+    parser.add_argument('--serialization-repeat', type=int, default=5,
+                        help='runs per serializer; the best is reported (default: 5)')
+    parser.add_argument('--rebuild', action='store_true', help='regenerate fixtures even if cached')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print progress to stderr')
+    args = parser.parse_args(argv)
+    
+    try:
+        args.sizes = [parse_size(size.strip()) for size in args.sizes.split(',') if size.strip()]
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    args.endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in args.endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}; choose from {', '.join(ENDPOINTS)}")
+    if args.requests < 1 or args.threads < 1 or args.warmup < 0:
+        parser.error('--requests and --threads must be positive and --warmup not negative')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        'generated_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform()
+        },
+        'settings': {
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'threads': args.threads,
+            'days': args.days,
+            'seed': args.seed,
+            'end_date': args.end_date.strftime('%Y-%m-%d'),
+            'analytics_cache': args.analytics_cache,
+            'promotions': args.promotions,
+            'serialization_rows': args.serialization_rows
+        },
+        'results': [run_size(name, providers, bookings, args) for name, (providers, bookings) in args.sizes]
+    }
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
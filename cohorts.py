@@ -0,0 +1,269 @@
+"""
+cohorts.py - Customer cohorts and retention curves
+
+A customer's cohort is the week (starting Monday) or month of their first
+booking. cohort_activity holds, per grain, cohort and period offset, how
+many of the cohort's customers booked in that period: offset 0 is the
+cohort's size, and offset k over offset 0 is the share of the cohort that
+came back k periods later.
+
+The matrix is maintained from an after_flush listener as bookings are
+inserted. customer_cohorts remembers each customer's first booking and
+customer_activity the periods they have already been counted in, so a
+customer adds one to a cell however many bookings they make in a period.
+A booking dated before a customer's first one moves all of their activity
+to the earlier cohort. Deleted bookings and edits to user_id or
+booking_date are not subtracted; rebuild_cohorts() recomputes everything
+in one streaming pass over bookings and the archive.
+"""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, select
+
+from archive import all_bookings
+from database import db, chunks, insert_ignore, upsert_increments
+from models import Booking, CustomerCohort, CustomerActivity, CohortActivity
+
+COHORT_GRAINS = ('week', 'month')
+COHORT_COUNT_DEFAULT = 12
+COHORT_COUNT_MAX = 104
+COHORT_PERIODS_DEFAULT = 12
+COHORT_PERIODS_MAX = 104
+
+def period_start(day, grain):
+    """First day of the week (Monday) or month containing day"""
+    if grain == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def shift_period(period, grain, periods):
+    """Start of the period `periods` weeks or months after (or before) period"""
+    if grain == 'week':
+        return period + timedelta(weeks=periods)
+    months = period.year * 12 + period.month - 1 + periods
+    return date(months // 12, months % 12 + 1, 1)
+
+def period_offset(cohort, period, grain):
+    """Number of weeks or months from cohort to period"""
+    if grain == 'week':
+        return (period - cohort).days // 7
+    return (period.year - cohort.year) * 12 + period.month - cohort.month
+
+def cohort_cell(first_day, day, grain):
+    """cohort_activity key a booking on `day` counts towards"""
+    cohort = period_start(first_day, grain)
+    return (grain, cohort, period_offset(cohort, period_start(day, grain), grain))
+
+def _apply_cohort_deltas(connection, deltas):
+    upsert_increments(
+        connection,
+        CohortActivity.__table__,
+        ['grain', 'cohort', 'period_offset'],
+        ['customers'],
+        [
+            {'grain': grain, 'cohort': cohort, 'period_offset': offset, 'customers': count}
+            for (grain, cohort, offset), count in deltas.items() if count
+        ]
+    )
+
+def _move_cohort(connection, user_id, old_first, new_first, deltas):
+    """Move a customer's counted periods from their old cohort to the one
+    of an earlier first booking"""
+    activity = CustomerActivity.__table__
+    rows = connection.execute(
+        select(activity.c.grain, activity.c.period).where(activity.c.user_id == user_id)
+    )
+    for grain, period in rows:
+        for first, change in ((old_first, -1), (new_first, 1)):
+            cell = cohort_cell(first, period, grain)
+            deltas[cell] = deltas.get(cell, 0) + change
+
+def record_bookings(connection, bookings):
+    """Fold new bookings, as (user_id, day) pairs, into the cohort tables"""
+    cohorts = CustomerCohort.__table__
+    activity = CustomerActivity.__table__
+    # Earliest first, so a batch holding a customer's first booking never
+    # has to move the activity it has just counted
+    bookings = sorted(bookings, key=lambda booking: booking[1])
+    
+    firsts = {}
+    user_ids = sorted({user_id for user_id, _ in bookings})
+    for chunk in chunks(user_ids):
+        firsts.update(connection.execute(
+            select(cohorts.c.user_id, cohorts.c.first_booking_date).where(cohorts.c.user_id.in_(chunk))
+        ).all())
+    
+    deltas = {}
+    for user_id, day in bookings:
+        first = firsts.get(user_id)
+        if first is None:
+            if insert_ignore(connection, cohorts, {'user_id': user_id, 'first_booking_date': day}):
+                first = day
+            else:
+                # A concurrent transaction recorded them first
+                first = connection.execute(
+                    select(cohorts.c.first_booking_date).where(cohorts.c.user_id == user_id)
+                ).scalar_one()
+            firsts[user_id] = first
+        if day < first:
+            _move_cohort(connection, user_id, first, day, deltas)
+            connection.execute(
+                cohorts.update().where(cohorts.c.user_id == user_id).values(first_booking_date=day)
+            )
+            first = firsts[user_id] = day
+        
+        for grain in COHORT_GRAINS:
+            row = {'user_id': user_id, 'grain': grain, 'period': period_start(day, grain)}
+            if insert_ignore(connection, activity, row):
+                cell = cohort_cell(first, day, grain)
+                deltas[cell] = deltas.get(cell, 0) + 1
+    
+    _apply_cohort_deltas(connection, deltas)
+
+@event.listens_for(db.session, 'after_flush')
+def update_cohorts(session, flush_context):
+    """Count newly inserted bookings into their customers' cohorts"""
+    bookings = [
+        (obj.user_id, (obj.booking_date or datetime.utcnow()).date())
+        for obj in session.new
+        if isinstance(obj, Booking) and obj.user_id is not None
+    ]
+    if bookings:
+        record_bookings(session.connection(), bookings)
+
+def rebuild_cohorts(chunk_size=10000):
+    """Recompute the cohort tables from bookings in one streaming pass.
+    
+    Bookings are read ordered by customer and date, so each customer's
+    first booking arrives first and only one customer's periods are held
+    in memory at a time.
+    """
+    cohort_table = CustomerCohort.__table__
+    activity_table = CustomerActivity.__table__
+    for table in (CohortActivity.__table__, activity_table, cohort_table):
+        db.session.execute(table.delete())
+    
+    cells = {}
+    cohort_rows = []
+    activity_rows = []
+    
+    def write():
+        if cohort_rows:
+            db.session.execute(cohort_table.insert(), cohort_rows)
+        if activity_rows:
+            db.session.execute(activity_table.insert(), activity_rows)
+        cohort_rows.clear()
+        activity_rows.clear()
+    
+    # Stream bookings on their own connection so the inserts can go
+    # through the session while the cursor is open
+    bookings = all_bookings().c
+    stmt = select(bookings.user_id, bookings.booking_date).where(
+        bookings.user_id.isnot(None), bookings.booking_date.isnot(None)
+    ).order_by(bookings.user_id, bookings.booking_date)
+    current_user = None
+    with db.engine.connect() as connection:
+        for user_id, booking_date in connection.execution_options(yield_per=chunk_size).execute(stmt):
+            day = booking_date.date()
+            if user_id != current_user:
+                current_user, first, counted = user_id, day, set()
+                cohort_rows.append({'user_id': user_id, 'first_booking_date': day})
+            for grain in COHORT_GRAINS:
+                period = period_start(day, grain)
+                if (grain, period) in counted:
+                    continue
+                counted.add((grain, period))
+                activity_rows.append({'user_id': user_id, 'grain': grain, 'period': period})
+                cell = cohort_cell(first, day, grain)
+                cells[cell] = cells.get(cell, 0) + 1
+            if len(activity_rows) >= chunk_size:
+                write()
+    write()
+    
+    if cells:
+        db.session.execute(CohortActivity.__table__.insert(), [
+            {'grain': grain, 'cohort': cohort, 'period_offset': offset, 'customers': count}
+            for (grain, cohort, offset), count in cells.items()
+        ])
+    db.session.commit()
+
+def cohort_retention(grain='month', cohorts=COHORT_COUNT_DEFAULT, periods=COHORT_PERIODS_DEFAULT, date_from=None):
+    """Retention curves of `cohorts` consecutive cohorts over their first
+    `periods` periods, starting with the cohort of date_from or ending with
+    the current one.
+    
+    Each curve stops at the current period. `average` weights every cohort
+    that has reached an offset by its size.
+    """
+    current = period_start(datetime.utcnow().date(), grain)
+    if date_from:
+        first_cohort = period_start(date_from, grain)
+    else:
+        first_cohort = shift_period(current, grain, 1 - cohorts)
+    end = min(shift_period(first_cohort, grain, cohorts), shift_period(current, grain, 1))
+    
+    activity = {}
+    rows = db.session.execute(
+        select(CohortActivity.cohort, CohortActivity.period_offset, CohortActivity.customers).where(
+            CohortActivity.grain == grain,
+            CohortActivity.cohort >= first_cohort,
+            CohortActivity.cohort < end,
+            CohortActivity.period_offset < periods
+        )
+    )
+    for cohort, offset, customers in rows:
+        activity[(cohort, offset)] = customers
+    
+    curves = []
+    reached = [0] * periods
+    returned = [0] * periods
+    cohort = first_cohort
+    while cohort < end:
+        size = activity.get((cohort, 0), 0)
+        offsets = min(periods, period_offset(cohort, current, grain) + 1)
+        active = [activity.get((cohort, offset), 0) for offset in range(offsets)]
+        if size:
+            for offset, customers in enumerate(active):
+                reached[offset] += size
+                returned[offset] += customers
+        curves.append({
+            'cohort': cohort.isoformat(),
+            'customers': size,
+            'active': active,
+            'retention': [round(customers / size, 4) if size else 0.0 for customers in active]
+        })
+        cohort = shift_period(cohort, grain, 1)
+    
+    return {
+        'grain': grain,
+        'periods': periods,
+        'cohorts': curves,
+        'average': [
+            round(returned[offset] / reached[offset], 4)
+            for offset in range(periods) if reached[offset]
+        ]
+    }
+
+def parse_cohort_request(args):
+    """Validate /admin/analytics/cohorts args and return cohort_retention kwargs"""
+    grain = args.get('grain', 'month')
+    if grain not in COHORT_GRAINS:
+        raise ValueError(f"grain must be one of: {', '.join(COHORT_GRAINS)}")
+    
+    try:
+        date_from = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else None
+    except ValueError:
+        raise ValueError('from must be a date (YYYY-MM-DD)')
+    
+    try:
+        cohorts = int(args.get('cohorts', COHORT_COUNT_DEFAULT))
+        periods = int(args.get('periods', COHORT_PERIODS_DEFAULT))
+    except ValueError:
+        raise ValueError('cohorts and periods must be integers')
+    if not 1 <= cohorts <= COHORT_COUNT_MAX:
+        raise ValueError(f'cohorts must be between 1 and {COHORT_COUNT_MAX}')
+    if not 1 <= periods <= COHORT_PERIODS_MAX:
+        raise ValueError(f'periods must be between 1 and {COHORT_PERIODS_MAX}')
+    
+    return {'grain': grain, 'cohorts': cohorts, 'periods': periods, 'date_from': date_from}
@@ -0,0 +1,499 @@
+"""
+columnar.py - In-memory column store for ad-hoc booking aggregations
+
+Bookings are held as parallel typed arrays, one per column: the booking
+day as an int (days since 1970-01-01), service type and status as
+dictionary-encoded ints, the provider id as an int and the amount as a
+double. Group-by/filter queries over any date range run as vectorized
+NumPy operations on zero-copy views of those arrays. Without NumPy (it is
+in requirements.txt) they fall back to one much slower pure-Python pass.
+
+The store loads on its first query. Every later query first appends
+bookings with ids above the highest one loaded and re-reads the bookings
+that commits in this process touched; a full reload every
+ANALYTICS_COLUMNS_RELOAD_SECONDS picks up edits made by other processes.
+Reloads merge in bookings_archive, so archiving doesn't change results.
+Memory use is about 33 bytes per booking.
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+from operator import attrgetter
+
+from sqlalchemy import event, select
+
+from database import db, chunks
+from models import ArchivedBooking, Booking, ServiceProvider
+
+try:
+    import numpy as np
+except ImportError:  # degraded: queries fall back to a pure-Python scan
+    np = None
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+NO_DAY = -(1 << 31)  # bookings without a booking_date
+LOAD_CHUNK_SIZE = 10000
+
+TIME_GRAINS = ('day', 'week', 'month')
+GROUP_BY_FIELDS = TIME_GRAINS + ('service_type', 'provider', 'status')
+QUERY_ORDERS = ('key', 'bookings', 'revenue')
+QUERY_ROWS_MAX = 5000
+
+BOOKING_COLUMNS = select(
+    Booking.id, Booking.booking_date, Booking.service_type,
+    Booking.provider_id, Booking.status, Booking.amount
+)
+ARCHIVED_BOOKING_COLUMNS = select(
+    ArchivedBooking.id, ArchivedBooking.booking_date, ArchivedBooking.service_type,
+    ArchivedBooking.provider_id, ArchivedBooking.status, ArchivedBooking.amount
+)
+
+def to_day(value):
+    """Days since 1970-01-01 of a date or datetime"""
+    return value.toordinal() - EPOCH_ORDINAL
+
+def from_day(day):
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+def week_start(day):
+    """Day number of the Monday starting a day's week (1970-01-01 was a Thursday)"""
+    return day - (day + 3) % 7
+
+def month_index(day):
+    """Months since January 1970"""
+    value = from_day(day)
+    return (value.year - 1970) * 12 + value.month - 1
+
+
+class Dictionary:
+    """Maps column values to dense int codes and back"""
+    
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+    
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+    
+    def lookup(self, values):
+        """Codes of those values that occur in the column"""
+        return [self.codes[value] for value in values if value in self.codes]
+
+
+class BookingColumns:
+    """Bookings as parallel typed arrays, ordered by id"""
+    
+    def __init__(self):
+        self.ids = array('q')
+        self.day = array('i')
+        self.service_type = array('i')
+        self.provider = array('i')
+        self.status = array('i')
+        self.amount = array('d')
+        self.live = array('b')  # 0 once the booking is deleted
+        self.service_types = Dictionary()
+        self.statuses = Dictionary()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def _encode(self, row):
+        return (
+            to_day(row.booking_date) if row.booking_date else NO_DAY,
+            self.service_types.encode(row.service_type),
+            row.provider_id or 0,
+            self.statuses.encode(row.status),
+            row.amount or 0.0
+        )
+    
+    def append(self, row):
+        day, service_type, provider, status, amount = self._encode(row)
+        self.ids.append(row.id)
+        self.day.append(day)
+        self.service_type.append(service_type)
+        self.provider.append(provider)
+        self.status.append(status)
+        self.amount.append(amount)
+        self.live.append(1)
+    
+    def position(self, booking_id):
+        index = bisect_left(self.ids, booking_id)
+        if index < len(self.ids) and self.ids[index] == booking_id:
+            return index
+        return None
+    
+    def update(self, index, row):
+        (self.day[index], self.service_type[index], self.provider[index],
+         self.status[index], self.amount[index]) = self._encode(row)
+        self.live[index] = 1
+    
+    def remove(self, index):
+        self.live[index] = 0
+
+
+def _aggregate_numpy(columns, group_by, day_range, code_filters):
+    """{key tuple: (bookings, revenue)} using vectorized NumPy operations"""
+    size = len(columns)
+    if not size:
+        return {}
+    
+    def view(name, dtype):
+        return np.frombuffer(getattr(columns, name), dtype=dtype, count=size)
+    
+    day = view('day', np.int32)
+    mask = view('live', np.int8) == 1
+    if day_range:
+        mask &= (day >= day_range[0]) & (day <= day_range[1])
+    if any(field in TIME_GRAINS for field in group_by):
+        mask &= day != NO_DAY
+    for name, codes in code_filters.items():
+        mask &= np.isin(view(name, np.int32), np.array(codes, dtype=np.int32))
+    
+    amount = view('amount', np.float64)[mask]
+    if not group_by:
+        return {(): (int(amount.size), float(amount.sum()))} if amount.size else {}
+    if not amount.size:
+        return {}
+    
+    # Fold the group columns into one int64 key (mixed radix), then group
+    # with unique + bincount
+    key = np.zeros(amount.size, dtype=np.int64)
+    radices = []
+    for field in group_by:
+        if field in TIME_GRAINS:
+            values = day[mask].astype(np.int64)
+            if field == 'week':
+                values -= (values + 3) % 7
+            elif field == 'month':
+                values = values.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        else:
+            values = view(field, np.int32)[mask].astype(np.int64)
+        low = int(values.min())
+        span = int(values.max()) - low + 1
+        key = key * span + (values - low)
+        radices.append((low, span))
+    
+    keys, inverse = np.unique(key, return_inverse=True)
+    counts = np.bincount(inverse)
+    revenue = np.bincount(inverse, weights=amount)
+    
+    decoded = []
+    for low, span in reversed(radices):
+        decoded.append((keys % span + low).tolist())
+        keys = keys // span
+    decoded.reverse()
+    return {
+        key: (count, total)
+        for key, count, total in zip(zip(*decoded), counts.tolist(), revenue.tolist())
+    }
+
+def _aggregate_python(columns, group_by, day_range, code_filters):
+    """{key tuple: (bookings, revenue)} in a single pass over the arrays"""
+    low, high = day_range or (None, None)
+    has_grain = any(field in TIME_GRAINS for field in group_by)
+    service_types = set(code_filters['service_type']) if 'service_type' in code_filters else None
+    providers = set(code_filters['provider']) if 'provider' in code_filters else None
+    statuses = set(code_filters['status']) if 'status' in code_filters else None
+    months = {}
+    
+    def group_value(field, day, service_type, provider, status):
+        if field == 'day':
+            return day
+        if field == 'week':
+            return week_start(day)
+        if field == 'month':
+            month = months.get(day)
+            if month is None:
+                month = months[day] = month_index(day)
+            return month
+        return {'service_type': service_type, 'provider': provider, 'status': status}[field]
+    
+    groups = {}
+    for live, day, service_type, provider, status, amount in zip(
+        columns.live, columns.day, columns.service_type, columns.provider, columns.status, columns.amount
+    ):
+        if not live:
+            continue
+        if low is not None and not low <= day <= high:
+            continue
+        if has_grain and day == NO_DAY:
+            continue
+        if service_types is not None and service_type not in service_types:
+            continue
+        if providers is not None and provider not in providers:
+            continue
+        if statuses is not None and status not in statuses:
+            continue
+        key = tuple(group_value(field, day, service_type, provider, status) for field in group_by)
+        current = groups.get(key)
+        if current is None:
+            groups[key] = [1, amount]
+        else:
+            current[0] += 1
+            current[1] += amount
+    return {key: (count, total) for key, (count, total) in groups.items()}
+
+
+class BookingColumnStore:
+    """Keeps a BookingColumns in step with the bookings table"""
+    
+    def __init__(self, reload_interval=300.0):
+        self.reload_interval = reload_interval
+        self.columns = None
+        self.loaded_at = 0.0
+        self.max_id = 0
+        self._changed = set()
+        self._stale = False
+        self._lock = threading.RLock()
+    
+    @property
+    def engine(self):
+        return 'numpy' if np is not None else 'python'
+    
+    def size(self):
+        return len(self.columns) if self.columns is not None else 0
+    
+    def mark_changed(self, booking_ids):
+        with self._lock:
+            self._changed.update(booking_ids)
+    
+    def invalidate(self):
+        """Reload everything before the next query"""
+        with self._lock:
+            self._stale = True
+    
+    def _rows(self, stmt):
+        result = db.session.execute(stmt.execution_options(yield_per=LOAD_CHUNK_SIZE))
+        for partition in result.partitions():
+            yield from partition
+    
+    def _rows_on_own_connection(self, stmt):
+        """Like _rows, on a connection of its own (from the bind the session
+        would use), so it can stream alongside a _rows result: a server-side
+        cursor such as PyMySQL's discards an open one when another query
+        starts on the same connection"""
+        engine = db.session.get_bind(clause=stmt)
+        with engine.connect() as connection:
+            result = connection.execute(stmt.execution_options(yield_per=LOAD_CHUNK_SIZE))
+            for partition in result.partitions():
+                yield from partition
+    
+    def sync(self):
+        """Bring the columns up to date with committed bookings"""
+        with self._lock:
+            if (
+                self.columns is None or self._stale
+                or time.monotonic() - self.loaded_at >= self.reload_interval
+            ):
+                self._reload()
+                return
+            changed, self._changed = self._changed, set()
+            for row in self._rows(BOOKING_COLUMNS.where(Booking.id > self.max_id).order_by(Booking.id)):
+                self.columns.append(row)
+                self.max_id = row.id
+            self._apply_changes(changed)
+    
+    def _reload(self):
+        started = time.monotonic()
+        columns = BookingColumns()
+        # Both tables are read in id order, each on its own connection, and
+        # merged, so the columns stay sorted by id without a sort in the database
+        rows = heapq.merge(
+            self._rows(BOOKING_COLUMNS.order_by(Booking.id)),
+            self._rows_on_own_connection(ARCHIVED_BOOKING_COLUMNS.order_by(ArchivedBooking.id)),
+            key=attrgetter('id')
+        )
+        for row in rows:
+            columns.append(row)
+        self.columns = columns
+        self.max_id = columns.ids[-1] if len(columns) else 0
+        self.loaded_at = started
+        self._changed = set()
+        self._stale = False
+    
+    def _apply_changes(self, changed):
+        for chunk in chunks(sorted(changed)):
+            found = set()
+            for row in db.session.execute(BOOKING_COLUMNS.where(Booking.id.in_(chunk))):
+                found.add(row.id)
+                index = self.columns.position(row.id)
+                if index is None:
+                    # A reused id below max_id can't be appended in order
+                    self._stale = True
+                else:
+                    self.columns.update(index, row)
+            missing = set(chunk) - found
+            if missing:
+                # Archived since it changed; still counted
+                missing -= set(db.session.execute(
+                    select(ArchivedBooking.id).where(ArchivedBooking.id.in_(missing))
+                ).scalars())
+            for booking_id in missing:
+                index = self.columns.position(booking_id)
+                if index is not None:
+                    self.columns.remove(index)
+    
+    def aggregate(self, group_by=(), date_from=None, date_to=None, service_types=None,
+                  provider_ids=None, statuses=None):
+        """{key tuple: (bookings, revenue)} with raw (encoded) key values"""
+        self.sync()
+        # The lock also keeps appends from resizing arrays NumPy is viewing
+        with self._lock:
+            columns = self.columns
+            day_range = None
+            if date_from or date_to:
+                day_range = (
+                    to_day(date_from) if date_from else NO_DAY + 1,
+                    to_day(date_to) if date_to else (1 << 31) - 1
+                )
+            code_filters = {}
+            if service_types is not None:
+                code_filters['service_type'] = columns.service_types.lookup(service_types)
+            if provider_ids is not None:
+                code_filters['provider'] = list(provider_ids)
+            if statuses is not None:
+                code_filters['status'] = columns.statuses.lookup(statuses)
+            if any(not codes for codes in code_filters.values()):
+                return columns, {}
+            
+            aggregate = _aggregate_numpy if np is not None else _aggregate_python
+            return columns, aggregate(columns, tuple(group_by), day_range, code_filters)
+
+booking_columns = BookingColumnStore()
+
+def _decode(columns, field, value):
+    if field in ('day', 'week'):
+        return from_day(value).isoformat()
+    if field == 'month':
+        return f'{1970 + value // 12:04d}-{value % 12 + 1:02d}'
+    if field == 'service_type':
+        return columns.service_types.values[value]
+    if field == 'status':
+        return columns.statuses.values[value]
+    return value or None
+
+def query_bookings(group_by=(), date_from=None, date_to=None, service_types=None,
+                   provider_ids=None, statuses=None, order='key', limit=QUERY_ROWS_MAX):
+    """Booking counts and revenue grouped by `group_by`, one dict per group"""
+    columns, groups = booking_columns.aggregate(
+        group_by, date_from, date_to, service_types, provider_ids, statuses
+    )
+    rows = []
+    for key, (count, revenue) in groups.items():
+        row = {field: _decode(columns, field, value) for field, value in zip(group_by, key)}
+        row.update({
+            'bookings': count,
+            'revenue': round(revenue, 2),
+            'avg_amount': round(revenue / count, 2) if count else 0.0
+        })
+        rows.append(row)
+    
+    def group_key(row):
+        # Unknown service types/providers (None) sort last
+        return tuple((row[field] is None, row[field] or '') for field in group_by)
+    
+    if order == 'key':
+        rows.sort(key=group_key)
+    else:
+        rows.sort(key=lambda row: (-row[order], group_key(row)))
+    rows = rows[:limit]
+    
+    if 'provider' in group_by:
+        names = {}
+        provider_ids = [row['provider'] for row in rows if row['provider']]
+        for chunk in chunks(provider_ids):
+            names.update(db.session.execute(
+                select(ServiceProvider.id, ServiceProvider.name).where(ServiceProvider.id.in_(chunk))
+            ).all())
+        for row in rows:
+            row['provider_name'] = names.get(row['provider'])
+    return rows
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+def parse_booking_query(args):
+    """Validate /admin/analytics/query args and return query_bookings kwargs"""
+    group_by = _split(args.get('group_by')) or []
+    unknown = [field for field in group_by if field not in GROUP_BY_FIELDS]
+    if unknown:
+        raise ValueError(f"group_by fields must be among: {', '.join(GROUP_BY_FIELDS)}")
+    if len(set(group_by)) != len(group_by):
+        raise ValueError('group_by fields must not repeat')
+    if sum(field in TIME_GRAINS for field in group_by) > 1:
+        raise ValueError('group_by takes at most one of day, week and month')
+    
+    try:
+        date_from = datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from') else None
+        date_to = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else None
+    except ValueError:
+        raise ValueError('from and to must be dates (YYYY-MM-DD)')
+    if date_from and date_to and date_to < date_from:
+        raise ValueError('to must not be before from')
+    
+    try:
+        provider_ids = _split(args.get('provider_id'))
+        provider_ids = [int(value) for value in provider_ids] if provider_ids else None
+        limit = int(args.get('limit', QUERY_ROWS_MAX))
+    except ValueError:
+        raise ValueError('provider_id and limit must be integers')
+    if not 1 <= limit <= QUERY_ROWS_MAX:
+        raise ValueError(f'limit must be between 1 and {QUERY_ROWS_MAX}')
+    
+    order = args.get('order', 'key')
+    if order not in QUERY_ORDERS:
+        raise ValueError(f"order must be one of: {', '.join(QUERY_ORDERS)}")
+    
+    return {
+        'group_by': group_by,
+        'date_from': date_from,
+        'date_to': date_to,
+        'service_types': _split(args.get('service_type')),
+        'provider_ids': provider_ids,
+        'statuses': _split(args.get('status')),
+        'order': order,
+        'limit': limit
+    }
+
+# Keeping the store current with this process's commits
+@event.listens_for(db.session, 'after_flush')
+def track_booking_changes(session, flush_context):
+    """Remember bookings this transaction inserted, changed or deleted"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Booking) and obj.id is not None:
+            session.info.setdefault('columnar_changed', set()).add(obj.id)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def track_bulk_booking_changes(orm_execute_state):
+    """Bulk UPDATE/DELETE on bookings can't be tracked per row; reload instead"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) == 'bookings':
+        orm_execute_state.session.info['columnar_stale'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def apply_booking_changes(session):
+    changed = session.info.pop('columnar_changed', None)
+    if changed:
+        booking_columns.mark_changed(changed)
+    if session.info.pop('columnar_stale', False):
+        booking_columns.invalidate()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_booking_changes(session):
+    session.info.pop('columnar_changed', None)
+    session.info.pop('columnar_stale', None)
+
+def init_app(app):
+    booking_columns.reload_interval = app.config['ANALYTICS_COLUMNS_RELOAD_SECONDS']
+    if np is None:
+        app.logger.warning('NumPy is not installed; /admin/analytics/query uses the slow pure-Python scan')
@@ -0,0 +1,211 @@
+"""
+commands.py - Flask CLI commands for schema setup, seeding and maintenance
+
+Usage:
+    flask --app app init-db
+    flask --app app seed
+    flask --app app rebuild-rollups
+    flask --app app rebuild-provider-stats
+    flask --app app rebuild-booking-sketches
+    flask --app app rebuild-cohorts
+    flask --app app apply-promotion-transitions
+    flask --app app archive-data
+    flask --app app vendor-assets
+    flask --app app build-assets
+"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from archive import archive_bookings, archive_promotions
+from assets import build_assets, vendor_assets
+from database import db, ensure_columns, ensure_indexes
+from models import ServiceProvider, Booking, BookingDailyStat, BookingDailySketch, CohortActivity, CustomerCohort, Admin
+from promotions import promotion_scheduler
+from geo import area_coordinates, backfill_provider_coordinates
+from search import ensure_search_index
+from rollups import rebuild_booking_rollups, rebuild_provider_stats, smoothed_rating
+from sketches import rebuild_booking_sketches
+from cohorts import rebuild_cohorts
+
+# Providers every install starts with
+DEFAULT_PROVIDERS = [
+    {
+        'name': 'ABC Plumbing',
+        'email': 'abc.plumbing@localservice.com',
+        'service_type': 'Plumber',
+        'location': 'Dhanmondi, Dhaka',
+        'is_premium': True
+    },
+    {
+        'name': 'BRACU Barber',
+        'email': 'bracu.barber@localservice.com',
+        'service_type': 'Barber',
+        'location': 'Badda, Dhaka',
+        'is_premium': True
+    },
+    {
+        'name': 'Badda Electronics',
+        'email': 'badda.electronics@localservice.com',
+        'service_type': 'Electrician',
+        'location': 'Badda, Dhaka',
+        'is_premium': True
+    }
+]
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create missing tables, columns and indexes"""
+    db.create_all()
+    added = ensure_columns()
+    for column in added:
+        print(f"Added column: {column}")
+    ensure_indexes()
+    if ensure_search_index():
+        print("Provider search index (FTS5) is ready")
+    
+    if 'service_providers.latitude' in added:
+        located = backfill_provider_coordinates()
+        print(f"Placed {located} providers at the centre of their area")
+    
+    # Provider counters were static seed values before they were maintained
+    if 'service_providers.rating_count' in added:
+        rebuild_provider_stats()
+        print("Recomputed provider counters and ratings from bookings")
+    
+    # Backfill the rollup the first time it appears next to existing bookings
+    if not db.session.query(BookingDailyStat.day).first() and db.session.query(Booking.id).first():
+        rebuild_booking_rollups()
+        print("Backfilled booking_daily_stats from bookings")
+    
+    if not db.session.query(BookingDailySketch.day).first() and db.session.query(Booking.id).first():
+        rebuild_booking_sketches()
+        print("Backfilled booking_daily_sketches from bookings")
+    
+    if not db.session.query(CustomerCohort.user_id).first() and db.session.query(Booking.id).first():
+        rebuild_cohorts()
+        print("Backfilled customer cohorts from bookings")
+    
+    print("Database schema is up to date")
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Create the default admin and service providers if they don't exist"""
+    admin = Admin.query.filter_by(email='admin@localservice.com').first()
+    if not admin:
+        default_admin = Admin(
+            username='admin',
+            email='admin@localservice.com'
+        )
+        default_admin.set_password('admin123')
+        db.session.add(default_admin)
+        db.session.commit()
+        print("Default admin created: admin@localservice.com / admin123")
+    
+    for provider_data in DEFAULT_PROVIDERS:
+        # Check if provider exists by name
+        existing_provider = ServiceProvider.query.filter_by(name=provider_data['name']).first()
+        if not existing_provider:
+            latitude, longitude = area_coordinates(provider_data['location'])
+            provider = ServiceProvider(
+                name=provider_data['name'],
+                email=provider_data['email'],
+                service_type=provider_data['service_type'],
+                is_premium=provider_data['is_premium'],
+                location=provider_data['location'],
+                latitude=latitude,
+                longitude=longitude,
+                rating=smoothed_rating(0.0, 0),
+                total_bookings=0
+            )
+            db.session.add(provider)
+            print(f"Created provider: {provider_data['name']}")
+    
+    db.session.commit()
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Rebuild booking_daily_stats from the bookings table"""
+    rebuild_booking_rollups()
+    rows = BookingDailyStat.query.count()
+    print(f"Rebuilt booking_daily_stats: {rows} rows")
+
+@click.command('rebuild-provider-stats')
+@with_appcontext
+def rebuild_provider_stats_command():
+    """Recompute provider booking counters and ratings from bookings"""
+    rebuild_provider_stats()
+    print(f"Rebuilt counters for {ServiceProvider.query.count()} providers")
+
+@click.command('rebuild-booking-sketches')
+@with_appcontext
+def rebuild_booking_sketches_command():
+    """Recompute the unique-customer and heavy-hitter sketches from bookings"""
+    rebuild_booking_sketches()
+    print(f"Rebuilt booking_daily_sketches: {BookingDailySketch.query.count()} rows")
+
+@click.command('rebuild-cohorts')
+@with_appcontext
+def rebuild_cohorts_command():
+    """Recompute customer cohorts and the retention matrix from bookings"""
+    rebuild_cohorts()
+    print(f"Rebuilt cohorts: {CustomerCohort.query.count()} customers, "
+          f"{CohortActivity.query.count()} cohort_activity rows")
+
+@click.command('apply-promotion-transitions')
+@with_appcontext
+def apply_promotion_transitions_command():
+    """Activate and expire promotions that are due (for cron when the scheduler is off)"""
+    activated, expired = promotion_scheduler.run_due()
+    print(f"Promotions activated: {activated}, expired: {expired}")
+
+@click.command('archive-data')
+@click.option('--bookings-after', type=int, default=None, help='Days after which finished bookings are archived')
+@click.option('--promotions-after', type=int, default=None, help='Days after which expired promotions are archived')
+@with_appcontext
+def archive_data_command(bookings_after, promotions_after):
+    """Move old finished bookings and expired promotions to the archive tables"""
+    config = current_app.config
+    batch_size = config['ARCHIVE_BATCH_SIZE']
+    if bookings_after is None:
+        bookings_after = config['ARCHIVE_BOOKINGS_AFTER_DAYS']
+    if promotions_after is None:
+        promotions_after = config['ARCHIVE_PROMOTIONS_AFTER_DAYS']
+    bookings = archive_bookings(bookings_after, batch_size)
+    promotions = archive_promotions(promotions_after, batch_size)
+    print(f"Archived {bookings} bookings and {promotions} promotions")
+
+@click.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Download again even if present')
+@with_appcontext
+def vendor_assets_command(force):
+    """Download the pinned Bootstrap, Font Awesome and Chart.js files into static/vendor"""
+    fetched = vendor_assets(current_app.static_folder, force=force)
+    print(f"Vendored {len(fetched)} files" if fetched else "Vendored files are up to date")
+
+@click.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove fingerprinted files the new manifest no longer lists')
+@with_appcontext
+def build_assets_command(clean):
+    """Write content-hashed and gzipped copies of static files to static/dist"""
+    manifest = build_assets(current_app.static_folder, clean=clean)
+    print(f"Fingerprinted {len(manifest['files'])} static files ({len(manifest['gzip'])} gzipped)")
+
+def init_app(app):
+    for command in (
+        init_db_command,
+        seed_command,
+        rebuild_rollups_command,
+        rebuild_provider_stats_command,
+        rebuild_booking_sketches_command,
+        rebuild_cohorts_command,
+        apply_promotion_transitions_command,
+        archive_data_command,
+        vendor_assets_command,
+        build_assets_command
+    ):
+        app.cli.add_command(command)
@@ -1,6 +1,12 @@
 import os
 from datetime import timedelta
 
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
 class Config:
     # Database Configuration
     SQLALCHEMY_DATABASE_URI = os.getenv(
@@ -9,6 +15,28 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Optional read-only database (e.g. a MySQL replica) that the analytics
+    # and list endpoints read from. For SQLite in WAL mode the same file can
+    # be opened read-only: sqlite:///file:local_service.db?mode=ro&uri=true
+    DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+    
+    # Connection pool (applies to server databases, not SQLite)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+    
+    # Pragmas set on every new SQLite connection. WAL lets dashboard reads
+    # run alongside promotion writes instead of waiting on the file lock.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+        'cache_size': -20000
+    }
+    
     # Security
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
     
@@ -16,4 +44,83 @@ class Config:
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
-    SESSION_COOKIE_SAMESITE = 'Lax'
\ No newline at end of file
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    
+    # Promotions
+    # Seconds between flushes of buffered promotion impressions/clicks
+    PROMOTION_COUNTER_FLUSH_INTERVAL = float(os.getenv('PROMOTION_COUNTER_FLUSH_INTERVAL', 5.0))
+    # Promotions with unflushed counts held in memory; counts for more are dropped
+    PROMOTION_COUNTER_MAX_PENDING = int(os.getenv('PROMOTION_COUNTER_MAX_PENDING', 10000))
+    # Also keep per-hour impression/click counts for CTR charts
+    PROMOTION_HOURLY_STATS = _env_bool('PROMOTION_HOURLY_STATS', True)
+    # Background activation/expiry of promotions from their start/end dates
+    PROMOTION_SCHEDULER_ENABLED = _env_bool('PROMOTION_SCHEDULER_ENABLED', True)
+    # How far ahead the scheduler keeps upcoming transitions in memory
+    PROMOTION_SCHEDULER_HORIZON_DAYS = int(os.getenv('PROMOTION_SCHEDULER_HORIZON_DAYS', 7))
+    
+    # Analytics
+    # Seconds between merges of new bookings into the unique-customer and
+    # heavy-hitter sketches (booking_daily_sketches)
+    BOOKING_SKETCH_FLUSH_INTERVAL = float(os.getenv('BOOKING_SKETCH_FLUSH_INTERVAL', 10.0))
+    # Analytics results are cached per section for this many seconds
+    ANALYTICS_CACHE_TTL = float(os.getenv('ANALYTICS_CACHE_TTL', 60.0))
+    ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', 128))
+    # Threads computing uncached dashboard sections in parallel (1 = inline)
+    ANALYTICS_SECTION_WORKERS = int(os.getenv('ANALYTICS_SECTION_WORKERS', 4))
+    # The in-memory booking column store behind /admin/analytics/query is
+    # reloaded in full this often, to pick up other processes' edits
+    ANALYTICS_COLUMNS_RELOAD_SECONDS = float(os.getenv('ANALYTICS_COLUMNS_RELOAD_SECONDS', 300.0))
+    # Open dashboards get live figures over /admin/analytics/stream: the
+    # shared producer recomputes them this often (and after local commits),
+    # and idle streams send a keep-alive comment every HEARTBEAT seconds
+    ANALYTICS_STREAM_INTERVAL = float(os.getenv('ANALYTICS_STREAM_INTERVAL', 2.0))
+    ANALYTICS_STREAM_HEARTBEAT = float(os.getenv('ANALYTICS_STREAM_HEARTBEAT', 15.0))
+    
+    # Archival (`flask --app app archive-data`): completed and cancelled
+    # bookings and expired promotions older than these many days move to
+    # bookings_archive/promotions_archive, ARCHIVE_BATCH_SIZE rows per
+    # transaction
+    ARCHIVE_BOOKINGS_AFTER_DAYS = int(os.getenv('ARCHIVE_BOOKINGS_AFTER_DAYS', 365))
+    ARCHIVE_PROMOTIONS_AFTER_DAYS = int(os.getenv('ARCHIVE_PROMOTIONS_AFTER_DAYS', 180))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+    
+    # Providers
+    # Ratings are smoothed towards PRIOR_MEAN as if every provider
+    # started with PRIOR_WEIGHT ratings of that value
+    PROVIDER_RATING_PRIOR_MEAN = float(os.getenv('PROVIDER_RATING_PRIOR_MEAN', 4.0))
+    PROVIDER_RATING_PRIOR_WEIGHT = float(os.getenv('PROVIDER_RATING_PRIOR_WEIGHT', 10))
+    
+    # Provider search: 'auto' uses SQLite FTS5 when available and an
+    # in-process index otherwise; 'memory' always uses the in-process index
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+    
+    # ETags of admin JSON responses also change this often, so commits made
+    # by other worker processes show up within it (0: single process)
+    ETAG_WINDOW_SECONDS = float(os.getenv('ETAG_WINDOW_SECONDS', 60.0))
+    
+    # Static files
+    # Link static files through static/dist/manifest.json (written by
+    # `flask --app app build-assets`) when it exists
+    ASSETS_FINGERPRINT = _env_bool('ASSETS_FINGERPRINT', True)
+    
+    # Metrics
+    # Per-route latency and SQL accounting, served on /admin/metrics
+    METRICS_ENABLED = _env_bool('METRICS_ENABLED', True)
+    # Statements slower than this are logged with their SQL text
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    # Bearer token that lets a Prometheus scraper read /admin/metrics
+    # without an admin session
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+class DevelopmentConfig(Config):
+    # Local SQLite file (in the instance folder) and plain-HTTP cookies
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///local_service.db')
+    SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    SESSION_COOKIE_SECURE = False
+    # Edited static files show up without rerunning build-assets
+    ASSETS_FINGERPRINT = _env_bool('ASSETS_FINGERPRINT', False)
+
+
+class ProductionConfig(Config):
+    pass
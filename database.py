@@ -0,0 +1,171 @@
+"""
+database.py - Shared SQLAlchemy instance and database helpers
+"""
+
+import sqlite3
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+class RoutingSession(FlaskSession):
+    """Session that sends SELECTs to the replica bind inside read-only routes"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and clause is not None
+            and getattr(clause, 'is_select', False)
+            and has_app_context()
+            and g.get('use_read_replica')
+            and 'replica' in self._db.engines
+        ):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def use_read_replica(view):
+    """Route a read-only view's queries to the replica bind when one is configured"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.use_read_replica = True
+        return view(*args, **kwargs)
+    return wrapped
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def engine_options(config, uri):
+    """SQLAlchemy engine options for a database URI under the given config"""
+    if make_url(uri).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING']
+    }
+
+def configure_database(app):
+    """Derive engine options and the replica bind from the app config"""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+    if app.config.get('DATABASE_REPLICA_URL'):
+        replica_url = app.config['DATABASE_REPLICA_URL']
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica': dict(engine_options(app.config, replica_url), url=replica_url)
+        }
+
+def set_sqlite_pragmas(pragmas):
+    """Return a connect listener that applies `pragmas` to new SQLite connections"""
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            try:
+                cursor.execute(f'PRAGMA {name}={value}')
+            except sqlite3.OperationalError:
+                # Read-only connections cannot switch journal mode
+                pass
+        cursor.close()
+    return on_connect
+
+def init_app(app):
+    """Set up db for app; engines connect lazily, so this does no I/O"""
+    configure_database(app)
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', set_sqlite_pragmas(app.config['SQLITE_PRAGMAS']))
+
+def chunks(items, size=IN_CHUNK_SIZE):
+    """Split a list into slices small enough for an IN (...) clause"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def upsert_increments(connection, table, key_columns, increment_columns, rows):
+    """Add counter values to rows of table, inserting rows that don't exist yet.
+    
+    Uses a single INSERT ... ON CONFLICT / ON DUPLICATE KEY statement where
+    the dialect supports it, and falls back to UPDATE-then-INSERT per row.
+    """
+    if not rows:
+        return
+    
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[name] for name in key_columns],
+            set_={
+                name: table.c[name] + stmt.excluded[name] for name in increment_columns
+            }
+        )
+        connection.execute(stmt)
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update({
+            name: table.c[name] + stmt.inserted[name] for name in increment_columns
+        })
+        connection.execute(stmt)
+    else:
+        for row in rows:
+            result = connection.execute(
+                table.update().where(
+                    *[table.c[name] == row[name] for name in key_columns]
+                ).values({
+                    name: table.c[name] + row[name] for name in increment_columns
+                })
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(**row))
+
+def insert_ignore(connection, table, row):
+    """Insert a row unless its primary key already exists; returns whether
+    it was inserted"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        result = connection.execute(insert(table).values(**row).on_conflict_do_nothing())
+    elif dialect in ('mysql', 'mariadb'):
+        result = connection.execute(table.insert().prefix_with('IGNORE').values(**row))
+    else:
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert().values(**row))
+        except IntegrityError:
+            return False
+        return True
+    return result.rowcount > 0
+
+def ensure_columns():
+    """Add nullable columns declared on models that older databases are missing"""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+def ensure_indexes():
+    """Create indexes declared on models that older databases are missing"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,120 @@
+"""
+etags.py - Per-table version counters and conditional JSON responses
+
+Every committed INSERT, UPDATE or DELETE bumps an in-process counter for
+its table; engine events catch session flushes, bulk statements and the
+background writers alike. Views decorated with conditional_on(*tables)
+get an ETag built from those counters and answer a matching If-None-Match
+with 304 before running any query.
+
+The counters only see this process's commits, so ETags also include the
+process, the UTC date (for "last N days" figures) and a window that
+rolls every ETAG_WINDOW_SECONDS: changes committed by other workers are
+picked up within that window, as with ANALYTICS_CACHE_TTL.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import Response, make_response, request, session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+from database import db
+
+class TableVersions:
+    """Commit counters per table name"""
+    
+    def __init__(self, window=60.0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._token = None
+        self._token_pid = None
+    
+    def init_app(self, app):
+        self.window = app.config['ETAG_WINDOW_SECONDS']
+        with app.app_context():
+            for engine in db.engines.values():
+                if not event.contains(engine, 'after_execute', _track_writes):
+                    event.listen(engine, 'after_execute', _track_writes)
+                    event.listen(engine, 'commit', _bump_versions)
+                    event.listen(engine, 'rollback', _discard_writes)
+    
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+    
+    def version(self, table):
+        with self._lock:
+            return self._versions.get(table, 0)
+    
+    def _process_token(self):
+        # Regenerated after a fork so workers never share ETags
+        pid = os.getpid()
+        if self._token_pid != pid:
+            self._token = f'{pid}-{os.urandom(4).hex()}'
+            self._token_pid = pid
+        return self._token
+    
+    def etag(self, tables, *extra):
+        """ETag for a response computed from `tables`"""
+        with self._lock:
+            versions = [self._versions.get(table, 0) for table in tables]
+        window = int(time.time() // self.window) if self.window else 0
+        key = repr((self._process_token(), window, str(datetime.utcnow().date()), versions, extra))
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+table_versions = TableVersions()
+
+def _track_writes(connection, clauseelement, multiparams, params, execution_options, result):
+    """Remember the tables a transaction wrote to until it commits"""
+    if isinstance(clauseelement, UpdateBase):
+        table = getattr(clauseelement, 'table', None)
+        name = getattr(table, 'name', None)
+        if name:
+            connection.info.setdefault('written_tables', set()).add(name)
+
+def _bump_versions(connection):
+    written = connection.info.pop('written_tables', None)
+    if written:
+        table_versions.bump(written)
+
+def _discard_writes(connection):
+    connection.info.pop('written_tables', None)
+
+def conditional_on(*tables):
+    """Serve a view with an ETag from the versions of `tables`, and a 304
+    when the admin's If-None-Match still matches it.
+    
+    The URL's query string is part of the ETag. Requests without an admin
+    session always reach the view, which rejects them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if 'admin_id' not in session:
+                return view(*args, **kwargs)
+            
+            etag = table_versions.etag(tables, request.full_path)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+                return response
+            
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapped
+    return decorator
+
+def init_app(app):
+    table_versions.init_app(app)
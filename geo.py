@@ -0,0 +1,220 @@
+"""
+geo.py - Provider coordinates, geohash index and nearest-provider lookup
+
+Providers with a latitude/longitude also store their geohash, indexed on
+its own and behind service_type. A "k nearest within R km" lookup picks the
+finest geohash precision at which a handful of cells covers the circle's
+bounding box, reads those cells with index range scans on the geohash
+prefix, then filters and sorts the candidates by great-circle distance.
+"""
+
+import heapq
+import math
+
+from sqlalchemy import and_, event, or_, select
+
+from database import db, chunks
+from models import ServiceProvider, Promotion
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # ~5 m cells; stored on every located provider
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+NEARBY_RADIUS_DEFAULT_KM = 5.0
+NEARBY_RADIUS_MAX_KM = 100.0
+NEARBY_LIMIT_DEFAULT = 10
+NEARBY_LIMIT_MAX = 50
+# Most geohash prefixes one lookup reads; bounds the OR of index range scans
+NEARBY_MAX_CELLS = 24
+
+# Approximate centres of the areas used in provider locations, for seeding
+# and for backfilling providers that only have a location string
+AREA_COORDINATES = {
+    'Dhanmondi': (23.7461, 90.3742),
+    'Gulshan': (23.7925, 90.4078),
+    'Banani': (23.7937, 90.4066),
+    'Mirpur': (23.8223, 90.3654),
+    'Uttara': (23.8759, 90.3795),
+    'Mohammadpur': (23.7662, 90.3589),
+    'Badda': (23.7806, 90.4265),
+    'Bashundhara': (23.8193, 90.4526),
+    'Motijheel': (23.7330, 90.4172),
+    'Farmgate': (23.7561, 90.3872),
+    'Khilgaon': (23.7516, 90.4236),
+    'BRACU': (23.7800, 90.4073),
+    'Chittagong': (22.3569, 91.7832)
+}
+
+def area_coordinates(location):
+    """(lat, lng) of the first known area named in a location string, or None"""
+    if not location:
+        return None
+    lowered = location.lower()
+    for area, coordinates in AREA_COORDINATES.items():
+        if area.lower() in lowered:
+            return coordinates
+    return None
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Even bits split longitude, odd bits latitude
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        if coordinate >= mid:
+            value = (value << 1) | 1
+            interval[0] = mid
+        else:
+            value <<= 1
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+def cell_size_degrees(precision):
+    """(lat height, lng width) of a geohash cell in degrees"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+def covering_cells(lat, lng, radius_km, max_cells=NEARBY_MAX_CELLS):
+    """Geohash cells covering the bounding box of a circle, at the finest
+    precision that needs at most max_cells of them"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlng = min(radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)), 180.0)
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size_degrees(precision)
+        rows = range(int((south + 90.0) // height), int(min(north + 90.0, 179.999999) // height) + 1)
+        first_col = math.floor((lng - dlng + 180.0) / width)
+        last_col = math.floor((lng + dlng + 180.0) / width)
+        columns = min(last_col - first_col + 1, int(round(360.0 / width)))
+        if len(rows) * columns > max_cells and precision > 1:
+            continue
+        cells = set()
+        for row in rows:
+            cell_lat = -90.0 + (row + 0.5) * height
+            for col in range(first_col, first_col + columns):
+                cell_lng = (-180.0 + (col + 0.5) * width + 180.0) % 360.0 - 180.0
+                cells.add(encode_geohash(cell_lat, cell_lng, precision))
+        return sorted(cells)
+    return []
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def active_promotion_types(provider_ids):
+    """{provider_id: set of promotion types} for providers with active promotions"""
+    promoted = {}
+    for chunk in chunks(list(provider_ids)):
+        rows = db.session.execute(
+            select(Promotion.provider_id, Promotion.promotion_type).where(
+                Promotion.status == 'active',
+                Promotion.provider_id.in_(chunk)
+            )
+        )
+        for provider_id, promotion_type in rows:
+            promoted.setdefault(provider_id, set()).add(promotion_type)
+    return promoted
+
+def nearest_providers(lat, lng, radius_km=NEARBY_RADIUS_DEFAULT_KM, limit=NEARBY_LIMIT_DEFAULT,
+                      service_type=None, premium=None, promoted_first=False):
+    """Up to `limit` providers within radius_km of (lat, lng), nearest first.
+    
+    With promoted_first, providers with an active featured promotion come
+    first, then premium providers, each group ordered by distance.
+    """
+    geohash = ServiceProvider.geohash
+    # Geohashes sharing a prefix sort together; '{' follows 'z' in ASCII
+    cell_ranges = [
+        and_(geohash >= cell, geohash < cell + '{')
+        for cell in covering_cells(lat, lng, radius_km)
+    ]
+    stmt = select(
+        ServiceProvider.id, ServiceProvider.name, ServiceProvider.service_type,
+        ServiceProvider.location, ServiceProvider.rating, ServiceProvider.is_premium,
+        ServiceProvider.latitude, ServiceProvider.longitude
+    ).where(or_(*cell_ranges))
+    if service_type:
+        stmt = stmt.where(ServiceProvider.service_type == service_type)
+    if premium is not None:
+        stmt = stmt.where(ServiceProvider.is_premium == premium)
+    
+    candidates = []
+    for row in db.session.execute(stmt):
+        distance = haversine_km(lat, lng, row.latitude, row.longitude)
+        if distance <= radius_km:
+            candidates.append((distance, row))
+    
+    if promoted_first:
+        promoted = active_promotion_types(row.id for _, row in candidates)
+        candidates.sort(key=lambda item: (
+            'featured' not in promoted.get(item[1].id, ()),
+            not item[1].is_premium,
+            item[0],
+            item[1].id
+        ))
+        candidates = candidates[:limit]
+    else:
+        candidates = heapq.nsmallest(limit, candidates, key=lambda item: (item[0], item[1].id))
+        promoted = active_promotion_types(row.id for _, row in candidates)
+    
+    return [
+        {
+            'id': row.id,
+            'name': row.name,
+            'service_type': row.service_type,
+            'location': row.location,
+            'rating': row.rating,
+            'is_premium': row.is_premium,
+            'featured': 'featured' in promoted.get(row.id, ()),
+            'promotion_types': sorted(promoted.get(row.id, ())),
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'distance_km': round(distance, 3)
+        } for distance, row in candidates
+    ]
+
+def backfill_provider_coordinates():
+    """Give providers without coordinates their area's centre; returns the count"""
+    updated = 0
+    providers = ServiceProvider.query.filter(
+        ServiceProvider.latitude.is_(None), ServiceProvider.location.isnot(None)
+    ).all()
+    for provider in providers:
+        coordinates = area_coordinates(provider.location)
+        if coordinates:
+            provider.latitude, provider.longitude = coordinates
+            updated += 1
+    db.session.commit()
+    return updated
+
+@event.listens_for(db.session, 'before_flush')
+def update_provider_geohashes(session, flush_context, instances):
+    """Keep ServiceProvider.geohash in step with latitude/longitude"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, ServiceProvider):
+            continue
+        if obj.latitude is None or obj.longitude is None:
+            geohash = None
+        else:
+            geohash = encode_geohash(obj.latitude, obj.longitude)
+        if obj.geohash != geohash:
+            obj.geohash = geohash
@@ -3,79 +3,278 @@ init_db.py - Database Initialization Script
 Run this file to create database tables and populate with sample data
 
 Usage: python init_db.py
+       python init_db.py --providers 50k --bookings 10M --days 730 --seed 42
+
+With --providers/--bookings the hand-written sample data is replaced by a
+deterministic synthetic dataset for load testing and benchmarks. Rows are
+generated lazily and written in chunks with executemany, so memory stays
+bounded by --chunk-size no matter how many bookings are requested.
 """
 
 from datetime import datetime, timedelta
+from itertools import accumulate, islice
+import argparse
+import random
 import sys
 import os
+import time
 
 # Add the current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Import Flask app and database
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+# Import the app factory and the shared models
+from app import create_app
+from models import db, ServiceProvider, Promotion, Booking, Admin
+from promotions import promotion_status_for
+from rollups import rebuild_booking_rollups, rebuild_provider_stats
+from search import ensure_search_index
+from sketches import rebuild_booking_sketches
+from cohorts import rebuild_cohorts
+from geo import area_coordinates, encode_geohash
 
-# Create Flask app instance
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///local_service.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'your-secret-key-here'
+app = create_app()
 
-# Initialize database
-db = SQLAlchemy(app)
+# Relative share of providers per service type, and the median / spread of
+# booking amounts (lognormal) for each of them in BDT
+SERVICE_PROFILES = {
+    'Plumber': (0.20, 1800, 0.45),
+    'Electrician': (0.18, 2200, 0.50),
+    'AC Repair': (0.14, 3500, 0.40),
+    'Carpenter': (0.12, 4500, 0.60),
+    'Barber': (0.16, 700, 0.35),
+    'Cleaner': (0.10, 1500, 0.40),
+    'Painter': (0.06, 6000, 0.70),
+    'Pest Control': (0.04, 2500, 0.35)
+}
 
-# Define Models
-class ServiceProvider(db.Model):
-    __tablename__ = 'service_providers'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True)
-    phone = db.Column(db.String(20))
-    service_type = db.Column(db.String(50))
-    rating = db.Column(db.Float, default=0.0)
-    total_bookings = db.Column(db.Integer, default=0)
-    is_premium = db.Column(db.Boolean, default=False)
-    location = db.Column(db.String(200))
-    description = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+LOCATIONS = [
+    'Dhanmondi, Dhaka', 'Gulshan, Dhaka', 'Banani, Dhaka', 'Mirpur, Dhaka',
+    'Uttara, Dhaka', 'Mohammadpur, Dhaka', 'Badda, Dhaka', 'Bashundhara, Dhaka',
+    'Motijheel, Dhaka', 'Farmgate, Dhaka', 'Khilgaon, Dhaka', 'Chittagong'
+]
+
+NAME_PREFIXES = ['Quick', 'Pro', 'Elite', 'Master', 'Prime', 'City', 'Express', 'Trusted', 'Smart', 'Royal']
+
+# Settled bookings vs. ones still in flight near the end of the range
+SETTLED_STATUSES = (['completed', 'cancelled', 'confirmed', 'pending'], [0.78, 0.14, 0.05, 0.03])
+RECENT_STATUSES = (['completed', 'cancelled', 'confirmed', 'pending'], [0.25, 0.10, 0.35, 0.30])
+
+# Busier evenings and weekends (Friday/Saturday in Bangladesh)
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 1, 2, 4, 6, 7, 7, 6, 6, 6, 7, 8, 9, 9, 8, 6, 4, 2, 1]
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.05, 1.35, 1.3, 0.95]  # Monday first
+
+
+def parse_count(value):
+    """Parse counts like 500, 50k or 10M"""
+    text = value.strip().lower().replace('_', '')
+    multiplier = 1
+    if text and text[-1] in 'km':
+        multiplier = 1000 if text[-1] == 'k' else 1000000
+        text = text[:-1]
+    try:
+        count = int(float(text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid count: {value!r}")
+    if count < 0:
+        raise argparse.ArgumentTypeError(f"count must not be negative: {value!r}")
+    return count
+
+
+def execute_chunks(statement, rows, chunk_size, progress=None):
+    """Run statement with one executemany per chunk of an iterable of row dicts"""
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return total
+        db.session.execute(statement, chunk)
+        db.session.commit()
+        total += len(chunk)
+        if progress:
+            progress(total)
 
-class Promotion(db.Model):
-    __tablename__ = 'promotions'
-    id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
-    promotion_type = db.Column(db.String(50))
-    title = db.Column(db.String(200))
-    description = db.Column(db.Text)
-    start_date = db.Column(db.DateTime, nullable=False)
-    end_date = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='pending')
-    price = db.Column(db.Float)
-    impressions = db.Column(db.Integer, default=0)
-    clicks = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    provider = db.relationship('ServiceProvider', backref='promotions')
 
-class Booking(db.Model):
-    __tablename__ = 'bookings'
-    id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
-    user_id = db.Column(db.Integer)
-    service_type = db.Column(db.String(50))
-    amount = db.Column(db.Float)
-    status = db.Column(db.String(20))
-    booking_date = db.Column(db.DateTime, default=datetime.utcnow)
+def _quiet_print(*args, **kwargs):
+    pass
+
+
+def generate_providers(rng, count, start):
+    """Yield provider rows with ids 1..count"""
+    types = list(SERVICE_PROFILES)
+    shares = [SERVICE_PROFILES[t][0] for t in types]
+    for provider_id in range(1, count + 1):
+        service_type = rng.choices(types, shares)[0]
+        location = rng.choice(LOCATIONS)
+        # Scatter providers a couple of km around their area's centre
+        center_lat, center_lng = area_coordinates(location)
+        latitude = round(center_lat + rng.gauss(0, 0.015), 6)
+        longitude = round(center_lng + rng.gauss(0, 0.015), 6)
+        yield {
+            'id': provider_id,
+            'name': f"{rng.choice(NAME_PREFIXES)} {service_type} {provider_id}",
+            'email': f"provider{provider_id}@example.com",
+            'phone': f"01{rng.randint(3, 9)}{rng.randint(0, 99999999):08d}",
+            'service_type': service_type,
+            'rating': round(min(5.0, max(1.0, rng.gauss(4.3, 0.4))), 1),
+            'total_bookings': 0,
+            'is_premium': rng.random() < 0.1,
+            'location': location,
+            'latitude': latitude,
+            'longitude': longitude,
+            'geohash': encode_geohash(latitude, longitude),
+            'description': f"{service_type} services",
+            'created_at': start - timedelta(days=rng.randint(0, 365)),
+            'updated_at': start
+        }
+
+
+def generate_bookings(rng, count, provider_profiles, days, end):
+    """Yield booking rows spread over `days` days ending at `end`.
+    
+    Provider popularity follows a Zipf-like curve, volume grows over the
+    range with a weekly cycle, and amounts are lognormal per service type.
+    provider_profiles holds (service_type, quality) per provider id; most
+    completed bookings get a customer rating around the provider's quality.
+    """
+    start = end - timedelta(days=days)
+    provider_ids = range(1, len(provider_profiles) + 1)
+    popularity = list(accumulate(1.0 / rank ** 0.8 for rank in provider_ids))
+    # Shuffle which provider gets which popularity rank
+    ranked = list(provider_ids)
+    rng.shuffle(ranked)
+    day_weights = list(accumulate(
+        (1.0 + day / max(days, 1)) * WEEKDAY_WEIGHTS[(start + timedelta(days=day)).weekday()]
+        for day in range(days)
+    ))
+    hour_weights = list(accumulate(HOUR_WEIGHTS))
+    recent = end - timedelta(days=3)
+    users = max(count // 8, 1)
     
-    provider = db.relationship('ServiceProvider', backref='bookings')
+    for _ in range(count):
+        provider_id = ranked[rng.choices(provider_ids, cum_weights=popularity)[0] - 1]
+        service_type, quality = provider_profiles[provider_id - 1]
+        _, median, spread = SERVICE_PROFILES[service_type]
+        day = rng.choices(range(days), cum_weights=day_weights)[0]
+        hour = rng.choices(range(24), cum_weights=hour_weights)[0]
+        booking_date = start + timedelta(days=day, hours=hour, minutes=rng.randrange(60))
+        statuses, weights = RECENT_STATUSES if booking_date >= recent else SETTLED_STATUSES
+        status = rng.choices(statuses, weights)[0]
+        service_date = booking_date + timedelta(days=rng.randint(0, 7), hours=rng.randint(0, 4))
+        rating = None
+        if status == 'completed' and rng.random() < 0.6:
+            rating = min(5, max(1, round(rng.gauss(quality, 0.8))))
+        yield {
+            'provider_id': provider_id,
+            'user_id': rng.randint(1, users),
+            'service_type': service_type,
+            'amount': round(rng.lognormvariate(0, spread) * median / 50) * 50.0,
+            'status': status,
+            'rating': rating,
+            'booking_date': booking_date,
+            'service_date': service_date,
+            'completed_at': service_date + timedelta(hours=rng.randint(1, 6)) if status == 'completed' else None
+        }
+
 
-class Admin(db.Model):
-    __tablename__ = 'admins'
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), unique=True, nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+def generate_promotions(rng, count, provider_count, days, end):
+    """Yield promotions with run dates inside the booking range"""
+    start = end - timedelta(days=days)
+    for _ in range(count):
+        start_date = start + timedelta(days=rng.randint(0, days + 30))
+        end_date = start_date + timedelta(days=rng.choice([7, 14, 30, 30, 60]))
+        promotion_type = 'featured' if rng.random() < 0.4 else 'banner'
+        impressions = rng.randint(0, 20000)
+        yield {
+            'provider_id': rng.randint(1, provider_count),
+            'promotion_type': promotion_type,
+            'title': f"{promotion_type.title()} offer",
+            'description': 'Seasonal discount',
+            'start_date': start_date,
+            'end_date': end_date,
+            'status': promotion_status_for(start_date, end_date, end),
+            'price': float(rng.choice([1000, 2000, 2500, 3000, 4000, 5000])),
+            'impressions': impressions,
+            'clicks': int(impressions * rng.uniform(0.005, 0.08)),
+            'created_at': start_date - timedelta(days=rng.randint(1, 14)),
+            'updated_at': start_date
+        }
+
+
+def generate_dataset(providers, bookings, days, promotions=None, seed=42, chunk_size=10000, end_date=None,
+                     flask_app=None, quiet=False):
+    """Replace the database contents with a deterministic synthetic dataset
+    
+    flask_app selects the database to fill (default: this script's app).
+    """
+    rng = random.Random(seed)
+    end = end_date or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    providers = max(providers, 1)
+    days = max(days, 1)
+    if promotions is None:
+        promotions = max(providers // 10, 1)
+    
+    log = _quiet_print if quiet else print
+    
+    with (flask_app or app).app_context():
+        log("🗑️  Recreating tables...")
+        db.drop_all()
+        db.create_all()
+        
+        started = time.perf_counter()
+        log(f"👥 Generating {providers:,} providers...")
+        provider_profiles = []
+        
+        def track_profiles(rows):
+            # The generated rating is the provider's underlying quality; the
+            # stored one is recomputed from booking ratings at the end
+            for row in rows:
+                provider_profiles.append((row['service_type'], row['rating']))
+                yield row
+        
+        execute_chunks(
+            ServiceProvider.__table__.insert(),
+            track_profiles(generate_providers(rng, providers, end - timedelta(days=days))),
+            chunk_size
+        )
+        
+        log(f"📢 Generating {promotions:,} promotions...")
+        execute_chunks(Promotion.__table__.insert(), generate_promotions(rng, promotions, providers, days, end), chunk_size)
+        
+        log(f"📅 Generating {bookings:,} bookings over {days} days...")
+        report_every = chunk_size * max(1000000 // (chunk_size * 2), 1)
+        
+        def report(written):
+            if written % report_every == 0 or written == bookings:
+                rate = written / max(time.perf_counter() - started, 1e-9)
+                log(f"   {written:,} / {bookings:,} ({rate:,.0f} rows/s)")
+        
+        execute_chunks(
+            Booking.__table__.insert(),
+            generate_bookings(rng, bookings, provider_profiles, days, end),
+            chunk_size,
+            report
+        )
+        
+        log("🔢 Computing provider counters and ratings...")
+        rebuild_provider_stats(chunk_size)
+        
+        log("📈 Rebuilding booking rollups...")
+        rebuild_booking_rollups()
+        log("👥 Building unique-customer sketches...")
+        rebuild_booking_sketches(chunk_size)
+        log("🔁 Building customer cohorts...")
+        rebuild_cohorts(chunk_size)
+        ensure_search_index(rebuild=True)
+        
+        admin = Admin(username='admin', email='admin@localservice.com')
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.commit()
+        
+        elapsed = time.perf_counter() - started
+        log(f"\n🎉 Generated {providers:,} providers, {promotions:,} promotions and "
+              f"{bookings:,} bookings in {elapsed:.1f}s (seed {seed})\n")
 
 
 def init_database():
@@ -104,10 +303,10 @@ def init_database():
                 email='quickfix@email.com',
                 phone='01712345678',
                 service_type='Plumber',
-                rating=4.8,
-                total_bookings=156,
                 is_premium=True,
                 location='Dhanmondi, Dhaka',
+                latitude=23.7465,
+                longitude=90.376,
                 description='Professional plumbing services with 10+ years experience'
             ),
             ServiceProvider(
@@ -115,10 +314,10 @@ def init_database():
                 email='proelectric@email.com',
                 phone='01812345678',
                 service_type='Electrician',
-                rating=4.7,
-                total_bookings=142,
                 is_premium=True,
                 location='Gulshan, Dhaka',
+                latitude=23.7925,
+                longitude=90.415,
                 description='Expert electrical installations and repairs'
             ),
             ServiceProvider(
@@ -126,10 +325,10 @@ def init_database():
                 email='coolair@email.com',
                 phone='01912345678',
                 service_type='AC Repair',
-                rating=4.6,
-                total_bookings=128,
                 is_premium=True,
                 location='Banani, Dhaka',
+                latitude=23.794,
+                longitude=90.4043,
                 description='AC installation, servicing and repair specialists'
             ),
             ServiceProvider(
@@ -137,10 +336,10 @@ def init_database():
                 email='mastercarpenter@email.com',
                 phone='01612345678',
                 service_type='Carpenter',
-                rating=4.5,
-                total_bookings=98,
                 is_premium=True,
                 location='Mirpur, Dhaka',
+                latitude=23.8069,
+                longitude=90.3687,
                 description='Custom furniture and carpentry work'
             ),
             ServiceProvider(
@@ -148,10 +347,10 @@ def init_database():
                 email='elitebarber@email.com',
                 phone='01512345678',
                 service_type='Barber',
-                rating=4.9,
-                total_bookings=187,
                 is_premium=True,
                 location='Uttara, Dhaka',
+                latitude=23.8728,
+                longitude=90.3984,
                 description='Premium grooming and styling services'
             )
         ]
@@ -242,6 +441,7 @@ def init_database():
                 service_type='Plumber',
                 amount=1500.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime(2025, 11, 1, 10, 30)
             ),
             Booking(
@@ -250,6 +450,7 @@ def init_database():
                 service_type='Plumber',
                 amount=2500.00,
                 status='completed',
+                rating=4,
                 booking_date=datetime(2025, 11, 5, 9, 15)
             ),
             Booking(
@@ -258,6 +459,7 @@ def init_database():
                 service_type='Electrician',
                 amount=3000.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime(2025, 11, 3, 14, 20)
             ),
             Booking(
@@ -266,6 +468,7 @@ def init_database():
                 service_type='AC Repair',
                 amount=4000.00,
                 status='completed',
+                rating=4,
                 booking_date=datetime(2025, 11, 7, 11, 0)
             ),
             Booking(
@@ -274,6 +477,7 @@ def init_database():
                 service_type='Carpenter',
                 amount=5500.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime(2025, 11, 10, 16, 45)
             ),
             Booking(
@@ -282,6 +486,7 @@ def init_database():
                 service_type='Barber',
                 amount=800.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime(2025, 11, 12, 13, 30)
             ),
             Booking(
@@ -307,6 +512,7 @@ def init_database():
                 service_type='AC Repair',
                 amount=3500.00,
                 status='completed',
+                rating=4,
                 booking_date=datetime.utcnow() - timedelta(days=5)
             ),
             Booking(
@@ -315,6 +521,7 @@ def init_database():
                 service_type='Carpenter',
                 amount=4200.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime.utcnow() - timedelta(days=3)
             ),
             Booking(
@@ -323,6 +530,7 @@ def init_database():
                 service_type='Barber',
                 amount=1200.00,
                 status='completed',
+                rating=5,
                 booking_date=datetime.utcnow() - timedelta(days=1)
             )
         ]
@@ -333,13 +541,18 @@ def init_database():
         db.session.commit()
         print(f"✅ Added {len(bookings)} bookings!\n")
         
+        # Sample providers start from their sample bookings' counts and ratings
+        rebuild_provider_stats()
+        rebuild_booking_sketches()
+        ensure_search_index(rebuild=True)
+        
         # Add admin user
         print("👤 Creating admin user...")
         admin = Admin(
             username='admin',
-            email='admin@localservice.com',
-            password_hash='admin123'  # In production, use proper password hashing!
+            email='admin@localservice.com'
         )
+        admin.set_password('admin123')
         
         db.session.add(admin)
         db.session.commit()
@@ -354,8 +567,8 @@ def init_database():
         print(f"   ✓ {len(promotions)} Promotions")
         print(f"   ✓ {len(bookings)} Bookings")
         print(f"   ✓ 1 Admin User")
-        print("\n📁 Database File:")
-        print(f"   Location: {os.path.abspath('local_service.db')}")
+        print("\n📁 Database:")
+        print(f"   Location: {db.engine.url}")
         print("\n🔐 Admin Credentials:")
         print("   Username: admin")
         print("   Password: admin123")
@@ -370,9 +583,34 @@ def init_database():
         print("="*60 + "\n")
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Initialize the database with sample or synthetic data')
+    parser.add_argument('--providers', type=parse_count, help='number of providers to generate, e.g. 50k')
+    parser.add_argument('--bookings', type=parse_count, help='number of bookings to generate, e.g. 10M')
+    parser.add_argument('--promotions', type=parse_count, help='number of promotions (default: providers / 10)')
+    parser.add_argument('--days', type=int, default=730, help='days of booking history (default: 730)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--chunk-size', type=parse_count, default=10000, help='rows per executemany (default: 10000)')
+    parser.add_argument('--end-date', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        help='last day of generated history, YYYY-MM-DD (default: today)')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        init_database()
+        if args.providers is not None or args.bookings is not None:
+            generate_dataset(
+                providers=args.providers if args.providers is not None else 1000,
+                bookings=args.bookings or 0,
+                days=args.days,
+                promotions=args.promotions,
+                seed=args.seed,
+                chunk_size=max(args.chunk_size, 1),
+                end_date=args.end_date
+            )
+        else:
+            init_database()
     except Exception as e:
         print(f"\n❌ Error: {str(e)}")
         print("\nTroubleshooting:")
@@ -0,0 +1,241 @@
+"""
+live.py - Live analytics deltas for open dashboards over Server-Sent Events
+
+One producer thread per process computes a small snapshot of the figures
+the dashboard shows live (headline statistics, today's bookings and
+revenue per service type, promotions per status) every
+ANALYTICS_STREAM_INTERVAL seconds, and straight away after a commit in this
+process touches bookings, providers or promotions. Only the figures that
+changed since the previous snapshot are pushed to the connected
+dashboards, so any number of them cost one computation per change.
+
+A dashboard gets the full snapshot when it connects, then deltas. Each
+open stream holds a worker thread of the WSGI server for as long as the
+dashboard stays open.
+"""
+
+import atexit
+import json
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func, select
+
+from analytics import statistics_section
+from database import db
+from models import Booking, BookingDailyStat, Promotion, ServiceProvider
+
+# Events a slow dashboard may fall behind by before it is resynced with a
+# fresh snapshot instead
+STREAM_QUEUE_SIZE = 100
+LIVE_MODELS = (Booking, ServiceProvider, Promotion)
+
+def live_snapshot():
+    """Figures the dashboard keeps current, in three small queries"""
+    today = datetime.utcnow().date()
+    services = db.session.execute(
+        select(
+            BookingDailyStat.service_type,
+            func.sum(BookingDailyStat.booking_count),
+            func.sum(BookingDailyStat.revenue)
+        ).where(BookingDailyStat.day == today).group_by(BookingDailyStat.service_type)
+    ).all()
+    promotions = db.session.execute(
+        select(Promotion.status, func.count()).group_by(Promotion.status)
+    ).all()
+    
+    return {
+        'statistics': statistics_section(),
+        'today': {
+            'date': str(today),
+            'bookings': int(sum(count for _, count, _ in services)),
+            'revenue': float(sum(revenue for _, _, revenue in services)),
+            'services': {service_type or 'Unknown': int(count) for service_type, count, _ in services}
+        },
+        'promotions': {status or 'unknown': count for status, count in promotions}
+    }
+
+def snapshot_delta(old, new):
+    """Nested dict of the values that differ between two snapshots; keys
+    that disappeared map to None"""
+    delta = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changed = snapshot_delta(previous, value)
+            if changed:
+                delta[key] = changed
+        elif value != previous:
+            delta[key] = value
+    for key in old.keys() - new.keys():
+        delta[key] = None
+    return delta
+
+def format_event(name, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = [f'event: {name}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+class AnalyticsStream:
+    """Shared producer fanning snapshot deltas out to subscriber queues.
+    
+    The producer thread starts with the first subscriber and idles while
+    there are none; its snapshot is dropped when the last one leaves, so
+    the next dashboard starts from fresh figures.
+    """
+    
+    def __init__(self, app=None, interval=2.0, heartbeat=15.0):
+        self.app = app
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._snapshot = None
+        self._version = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['ANALYTICS_STREAM_INTERVAL']
+        self.heartbeat = app.config['ANALYTICS_STREAM_HEARTBEAT']
+    
+    def clients(self):
+        """Number of connected dashboards"""
+        with self._lock:
+            return len(self._subscribers)
+    
+    def subscribe(self):
+        """Register a dashboard; returns its queue, already holding the
+        current snapshot"""
+        subscriber = queue.Queue(STREAM_QUEUE_SIZE)
+        fresh = None
+        while True:
+            with self._lock:
+                if self._snapshot is None and fresh is not None:
+                    self._snapshot = fresh
+                if self._snapshot is not None:
+                    subscriber.put_nowait(('snapshot', self._snapshot, self._version))
+                    self._subscribers.add(subscriber)
+                    break
+            # First dashboard: query outside the lock, so the producer and
+            # other dashboards aren't held up by it
+            with self.app.app_context():
+                fresh = live_snapshot()
+        self._ensure_started()
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self._snapshot = None
+    
+    def events(self):
+        """Yield SSE messages for one dashboard until it disconnects.
+        
+        The dashboard is only subscribed once the response starts being
+        sent, so a client gone before then leaves no queue behind.
+        """
+        subscriber = None
+        try:
+            subscriber = self.subscribe()
+            yield f'retry: {int(self.interval * 1000)}\n\n'
+            while True:
+                try:
+                    name, data, version = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(name, data, version)
+        finally:
+            if subscriber is not None:
+                self.unsubscribe(subscriber)
+    
+    def notify(self):
+        """Recompute now rather than at the next interval"""
+        self._wake.set()
+    
+    def publish(self):
+        """Compute a snapshot and send what changed to every subscriber"""
+        with self._lock:
+            if not self._subscribers:
+                return 0
+        with self.app.app_context():
+            snapshot = live_snapshot()
+        
+        with self._lock:
+            if self._snapshot is None:
+                # The last subscriber left while the snapshot was computed
+                return 0
+            delta = snapshot_delta(self._snapshot, snapshot)
+            if not delta:
+                return 0
+            self._snapshot = snapshot
+            self._version += 1
+            for subscriber in self._subscribers:
+                try:
+                    subscriber.put_nowait(('delta', delta, self._version))
+                except queue.Full:
+                    # Too far behind for deltas to help; start it over
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    subscriber.put_nowait(('snapshot', snapshot, self._version))
+            return len(self._subscribers)
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='analytics-stream', daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.publish()
+            except Exception as e:
+                self.app.logger.warning('Analytics stream update failed: %s', e)
+    
+    def stop(self):
+        """Stop the producer thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+
+analytics_stream = AnalyticsStream()
+
+@event.listens_for(db.session, 'after_flush')
+def mark_live_changes(session, flush_context):
+    """Remember that this transaction touched figures the stream shows"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, LIVE_MODELS):
+            session.info['live_stale'] = True
+            return
+
+@event.listens_for(db.session, 'after_commit')
+def wake_analytics_stream(session):
+    if session.info.pop('live_stale', False):
+        analytics_stream.notify()
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_live_changes(session):
+    session.info.pop('live_stale', None)
+
+def init_app(app):
+    analytics_stream.init_app(app)
@@ -0,0 +1,286 @@
+"""
+metrics.py - Request timing, SQL accounting and Prometheus text export
+
+Every request records its latency per route, plus how many SQL statements
+it ran and how long they took in total (counted through SQLAlchemy engine
+events). Statements slower than SLOW_QUERY_THRESHOLD_MS are logged with
+their text. Template render times are recorded per template. Everything is
+exposed in the Prometheus text format by the /admin/metrics route.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import g, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+from analytics import analytics_cache
+from columnar import booking_columns
+from database import db
+from live import analytics_stream
+from promotions import promotion_counters
+from sketches import booking_sketches
+
+# Latency buckets in seconds; SQL statement counts per request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = ('le', _format_value(float(bound)))
+                yield f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(round(total, 6))}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time (kind may also be 'counter')"""
+    
+    def __init__(self, name, help, callback, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.kind = kind
+    
+    def samples(self):
+        yield f'{self.name} {_format_value(self.callback())}'
+
+
+class RequestMetrics:
+    """Collects per-route request and SQL metrics for an app"""
+    
+    def __init__(self, app=None):
+        self.app = app
+        self.slow_query_threshold = 0.5
+        # [statement count, SQL seconds] for the current request; a context
+        # variable so work handed to a pool in a copied context still counts
+        self._request_sql = ContextVar('request_sql', default=None)
+        self._metrics = []
+        
+        self.requests = self.register(Counter(
+            'http_requests_total', 'Requests handled, by route, method and status',
+            ('endpoint', 'method', 'status')
+        ))
+        self.request_latency = self.register(Histogram(
+            'http_request_duration_seconds', 'Time to produce a response, by route',
+            LATENCY_BUCKETS, ('endpoint', 'method')
+        ))
+        self.request_queries = self.register(Histogram(
+            'db_queries_per_request', 'SQL statements executed per request, by route',
+            QUERY_COUNT_BUCKETS, ('endpoint',)
+        ))
+        self.request_query_time = self.register(Histogram(
+            'db_query_duration_per_request_seconds', 'Total SQL time per request, by route',
+            LATENCY_BUCKETS, ('endpoint',)
+        ))
+        self.statements = self.register(Counter(
+            'db_statements_total', 'SQL statements executed, inside and outside requests'
+        ))
+        self.statement_time = self.register(Counter(
+            'db_statement_seconds_total', 'Time spent in SQL statements'
+        ))
+        self.slow_queries = self.register(Counter(
+            'db_slow_queries_total', 'Statements slower than the slow query threshold, by route',
+            ('endpoint',)
+        ))
+        self.template_latency = self.register(Histogram(
+            'template_render_duration_seconds', 'Jinja template render time, by template',
+            LATENCY_BUCKETS, ('template',)
+        ))
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def init_app(self, app):
+        self.app = app
+        self.slow_query_threshold = app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000.0
+        if not app.config['METRICS_ENABLED']:
+            return
+        
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            for engine in db.engines.values():
+                if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+                    event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                    event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+    
+    def _endpoint(self):
+        return request.endpoint or 'unmatched'
+    
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        self._request_sql.set([0, 0.0])
+    
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        sql = self._request_sql.get()
+        self._request_sql.set(None)
+        if started is None:
+            return response
+        
+        elapsed = time.perf_counter() - started
+        endpoint = self._endpoint()
+        self.requests.inc((endpoint, request.method, str(response.status_code)))
+        self.request_latency.observe((endpoint, request.method), elapsed)
+        if sql is not None:
+            self.request_queries.observe((endpoint,), sql[0])
+            self.request_query_time.observe((endpoint,), sql[1])
+            response.headers['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.1f}, db;dur={sql[1] * 1000:.1f};desc="{sql[0]} queries"'
+            )
+        return response
+    
+    def _teardown_request(self, exc):
+        # after_request is skipped when a view raises
+        self._request_sql.set(None)
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+    
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        self.statements.inc()
+        self.statement_time.inc(amount=elapsed)
+        
+        current = self._request_sql.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+        
+        if elapsed >= self.slow_query_threshold:
+            endpoint = self._endpoint() if current is not None else 'background'
+            self.slow_queries.inc((endpoint,))
+            self.app.logger.warning(
+                'Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, ' '.join(statement.split())
+            )
+    
+    def _before_render(self, sender, template, context, **extra):
+        g.setdefault('metrics_render_started', []).append(time.perf_counter())
+    
+    def _after_render(self, sender, template, context, **extra):
+        starts = g.get('metrics_render_started')
+        if starts:
+            self.template_latency.observe((template.name or 'string',), time.perf_counter() - starts.pop())
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+# State owned by other modules, read at scrape time
+for name, help, key, kind in (
+    ('analytics_cache_hits_total', 'Analytics section cache hits', 'hits', 'counter'),
+    ('analytics_cache_misses_total', 'Analytics section cache misses', 'misses', 'counter'),
+    ('analytics_cache_entries', 'Analytics sections currently cached', 'size', 'gauge')
+):
+    request_metrics.register(Gauge(name, help, lambda key=key: analytics_cache.stats()[key], kind))
+request_metrics.register(Gauge(
+    'analytics_column_store_rows', 'Bookings loaded in the analytics column store',
+    booking_columns.size
+))
+request_metrics.register(Gauge(
+    'promotion_counters_pending', 'Promotions with impressions/clicks waiting to be flushed',
+    promotion_counters.pending
+))
+request_metrics.register(Gauge(
+    'booking_sketches_pending', 'Day/service-type sketches waiting to be merged into the database',
+    booking_sketches.pending
+))
+request_metrics.register(Gauge(
+    'analytics_stream_clients', 'Dashboards connected to the live analytics stream',
+    analytics_stream.clients
+))
+
+def init_app(app):
+    request_metrics.init_app(app)
@@ -1,48 +1,64 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
-db = SQLAlchemy()
+from sqlalchemy.orm import column_property
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from database import db
 
 class ServiceProvider(db.Model):
     __tablename__ = 'service_providers'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(100), unique=True)
     phone = db.Column(db.String(20))
     service_type = db.Column(db.String(50))
+    # Bayesian average of rating_sum / rating_count; the counters below are
+    # kept up to date from bookings by the flush listener in rollups.py
     rating = db.Column(db.Float, default=0.0)
     total_bookings = db.Column(db.Integer, default=0)
+    total_revenue = db.Column(db.Float, default=0.0)  # completed bookings only
+    rating_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Float, default=0.0)
     is_premium = db.Column(db.Boolean, default=False)
     location = db.Column(db.String(200))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Derived from latitude/longitude by geo.py for nearest-provider lookups
+    geohash = db.Column(db.String(12))
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_service_providers_geohash', 'geohash'),
+        db.Index('ix_service_providers_type_geohash', 'service_type', 'geohash'),
+        # Leaderboards read the top N straight off these, overall and per type
+        db.Index('ix_service_providers_rating', 'rating', 'id'),
+        db.Index('ix_service_providers_total_bookings', 'total_bookings', 'id'),
+        db.Index('ix_service_providers_total_revenue', 'total_revenue', 'id'),
+        db.Index('ix_service_providers_type_rating', 'service_type', 'rating', 'id'),
+        db.Index('ix_service_providers_type_bookings', 'service_type', 'total_bookings', 'id'),
+        db.Index('ix_service_providers_type_revenue', 'service_type', 'total_revenue', 'id'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'email': self.email,
-            'service_type': self.service_type,
-            'rating': self.rating,
-            'total_bookings': self.total_bookings,
-            'is_premium': self.is_premium
-        }
+        from serializers import PROVIDER  # serializers imports the models
+        return PROVIDER.dump(self)
 
 
 class Promotion(db.Model):
     __tablename__ = 'promotions'
     
     id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'), nullable=False)
-    promotion_type = db.Column(db.String(50), nullable=False)  # 'featured' or 'banner'
-    title = db.Column(db.String(200), nullable=False)
+    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
+    promotion_type = db.Column(db.String(50))  # 'featured' or 'banner'
+    title = db.Column(db.String(200))
     description = db.Column(db.Text)
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, active, expired
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Float)
     impressions = db.Column(db.Integer, default=0)
     clicks = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -50,48 +66,173 @@ class Promotion(db.Model):
     
     provider = db.relationship('ServiceProvider', backref='promotions')
     
+    __table_args__ = (
+        # Keyset pagination walks promotions newest first on (created_at, id)
+        db.Index('ix_promotions_created_at_id', 'created_at', 'id'),
+        db.Index('ix_promotions_provider_id', 'provider_id'),
+        # The lifecycle scheduler loads upcoming transitions through these
+        db.Index('ix_promotions_status_start_date', 'status', 'start_date'),
+        db.Index('ix_promotions_status_end_date', 'status', 'end_date'),
+    )
+    
     def to_dict(self):
-        return {
-            'id': self.id,
-            'provider_id': self.provider_id,
-            'provider_name': self.provider.name,
-            'promotion_type': self.promotion_type,
-            'title': self.title,
-            'description': self.description,
-            'start_date': self.start_date.strftime('%Y-%m-%d'),
-            'end_date': self.end_date.strftime('%Y-%m-%d'),
-            'status': self.status,
-            'price': self.price,
-            'impressions': self.impressions,
-            'clicks': self.clicks
-        }
+        from serializers import PROMOTION  # serializers imports the models
+        return PROMOTION.dump(self)
 
 
 class Booking(db.Model):
     __tablename__ = 'bookings'
     
     id = db.Column(db.Integer, primary_key=True)
-    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'), nullable=False)
-    user_id = db.Column(db.Integer, nullable=False)
-    service_type = db.Column(db.String(50), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, confirmed, completed, cancelled
-    booking_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # active_history keeps the old value around so the rollup can subtract it
+    provider_id = column_property(db.Column(db.Integer, db.ForeignKey('service_providers.id')), active_history=True)
+    user_id = db.Column(db.Integer)
+    service_type = column_property(db.Column(db.String(50)), active_history=True)
+    amount = column_property(db.Column(db.Float), active_history=True)
+    status = column_property(db.Column(db.String(20), default='pending'), active_history=True)  # pending, confirmed, completed, cancelled
+    rating = column_property(db.Column(db.Integer), active_history=True)  # customer's 1-5 rating once completed
+    booking_date = column_property(db.Column(db.DateTime, default=datetime.utcnow), active_history=True)
     service_date = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     
     provider = db.relationship('ServiceProvider', backref='bookings')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'provider_id': self.provider_id,
-            'user_id': self.user_id,
-            'service_type': self.service_type,
-            'amount': self.amount,
-            'status': self.status,
-            'booking_date': self.booking_date.strftime('%Y-%m-%d %H:%M:%S')
-        }
+        from serializers import BOOKING  # serializers imports the models
+        return BOOKING.dump(self)
+
+
+class BookingDailyStat(db.Model):
+    """Pre-aggregated bookings per day, service type and provider.
+    
+    Maintained by the flush listener in rollups.py so the analytics dashboard
+    never has to scan the raw bookings table. Unknown service types and
+    providers are stored as '' and 0 so the composite key stays NOT NULL.
+    """
+    __tablename__ = 'booking_daily_stats'
+    
+    day = db.Column(db.Date, primary_key=True)
+    service_type = db.Column(db.String(50), primary_key=True, default='')
+    provider_id = db.Column(db.Integer, primary_key=True, default=0)
+    booking_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class BookingDailySketch(db.Model):
+    """Mergeable sketches of one day's bookings per service type.
+    
+    customers is a HyperLogLog of distinct user_ids; customer_counts and
+    provider_counts are count-min sketches, with their heaviest ids kept in
+    top_customers/top_providers as JSON. All are maintained by sketches.py.
+    """
+    __tablename__ = 'booking_daily_sketches'
+    
+    day = db.Column(db.Date, primary_key=True)
+    service_type = db.Column(db.String(50), primary_key=True, default='')
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    customers = db.Column(db.LargeBinary)
+    customer_counts = db.Column(db.LargeBinary)
+    provider_counts = db.Column(db.LargeBinary)
+    top_customers = db.Column(db.Text)
+    top_providers = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CustomerCohort(db.Model):
+    """The day of each customer's first booking, which fixes their cohort"""
+    __tablename__ = 'customer_cohorts'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    first_booking_date = db.Column(db.Date, nullable=False)
+
+
+class CustomerActivity(db.Model):
+    """Weeks and months in which a customer booked, one row per period.
+    
+    Lets cohorts.py count a customer once per period however many bookings
+    they make in it.
+    """
+    __tablename__ = 'customer_activity'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(5), primary_key=True)  # week, month
+    period = db.Column(db.Date, primary_key=True)
+
+
+class CohortActivity(db.Model):
+    """Customers of a cohort who booked `period_offset` periods after the
+    period of their first booking (offset 0 is the cohort's size).
+    
+    Maintained incrementally by cohorts.py; cohort is the first day of the
+    week (Monday) or month.
+    """
+    __tablename__ = 'cohort_activity'
+    
+    grain = db.Column(db.String(5), primary_key=True)
+    cohort = db.Column(db.Date, primary_key=True)
+    period_offset = db.Column(db.Integer, primary_key=True)
+    customers = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArchivedBooking(db.Model):
+    """A completed or cancelled booking moved out of bookings by archive.py.
+    
+    Same columns as bookings plus archived_at; ids are kept, so a booking
+    is in exactly one of the two tables.
+    """
+    __tablename__ = 'bookings_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
+    user_id = db.Column(db.Integer)
+    service_type = db.Column(db.String(50))
+    amount = db.Column(db.Float)
+    status = db.Column(db.String(20))
+    rating = db.Column(db.Integer)
+    booking_date = db.Column(db.DateTime)
+    service_date = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Exports read date ranges of the archive
+        db.Index('ix_bookings_archive_booking_date', 'booking_date'),
+    )
+
+
+class ArchivedPromotion(db.Model):
+    """An expired promotion moved out of promotions by archive.py; same
+    columns as promotions plus archived_at"""
+    __tablename__ = 'promotions_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    provider_id = db.Column(db.Integer, db.ForeignKey('service_providers.id'))
+    promotion_type = db.Column(db.String(50))
+    title = db.Column(db.String(200))
+    description = db.Column(db.Text)
+    start_date = db.Column(db.DateTime, nullable=False)
+    end_date = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    price = db.Column(db.Float)
+    impressions = db.Column(db.Integer)
+    clicks = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_promotions_archive_end_date', 'end_date'),
+    )
+
+
+class PromotionHourlyStat(db.Model):
+    """Impressions and clicks per promotion per hour, for CTR charts"""
+    __tablename__ = 'promotion_hourly_stats'
+    
+    promotion_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    impressions = db.Column(db.Integer, nullable=False, default=0)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
 
 
 class Admin(db.Model):
@@ -101,4 +242,12 @@ class Admin(db.Model):
     username = db.Column(db.String(50), unique=True, nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def set_password(self, password):
+        """Hash and set the password"""
+        self.password_hash = generate_password_hash(password)
+    
+    def check_password(self, password):
+        """Check if the provided password matches the hash"""
+        return check_password_hash(self.password_hash, password)
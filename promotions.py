@@ -0,0 +1,664 @@
+"""
+promotions.py - Promotion validation, lifecycle scheduling, serving and tracking
+"""
+
+import atexit
+import bisect
+import heapq
+import random
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, event, select, bindparam, update
+from sqlalchemy.exc import OperationalError
+
+from database import db, chunks, upsert_increments
+from models import ServiceProvider, Promotion, PromotionHourlyStat
+
+# Promotion payload validation
+PROMOTION_TYPES = ('featured', 'banner')
+PROMOTION_STATUSES = ('pending', 'active', 'expired')
+
+def promotion_expires_at(end_date):
+    """end_date is the last day of the run; expiry is the start of the next day"""
+    return end_date + timedelta(days=1)
+
+def promotion_status_for(start_date, end_date, now=None):
+    """Status a promotion should have at `now` given its run dates"""
+    now = now or datetime.utcnow()
+    if now >= promotion_expires_at(end_date):
+        return 'expired'
+    if now < start_date:
+        return 'pending'
+    return 'active'
+
+def parse_promotion_payload(data):
+    """Validate a create-promotion payload and return Promotion column values"""
+    if not isinstance(data, dict):
+        raise ValueError('Promotion must be an object')
+    
+    missing = [
+        field for field in ('provider_id', 'promotion_type', 'title', 'start_date', 'end_date', 'price')
+        if data.get(field) in (None, '')
+    ]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    
+    if data['promotion_type'] not in PROMOTION_TYPES:
+        raise ValueError(f"promotion_type must be one of: {', '.join(PROMOTION_TYPES)}")
+    
+    start_date = datetime.strptime(data['start_date'], '%Y-%m-%d')
+    end_date = datetime.strptime(data['end_date'], '%Y-%m-%d')
+    if end_date < start_date:
+        raise ValueError('end_date must not be before start_date')
+    
+    status = data.get('status') or promotion_status_for(start_date, end_date)
+    if status not in PROMOTION_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(PROMOTION_STATUSES)}")
+    
+    price = float(data['price'])
+    if price < 0:
+        raise ValueError('price must not be negative')
+    
+    return {
+        'provider_id': int(data['provider_id']),
+        'promotion_type': data['promotion_type'],
+        'title': data['title'],
+        'description': data.get('description', ''),
+        'start_date': start_date,
+        'end_date': end_date,
+        'price': price,
+        'status': status
+    }
+
+# Promotion impression/click tracking
+# Largest id a promotions row can have (a signed 64-bit integer)
+PROMOTION_ID_MAX = 2 ** 63 - 1
+# Promotions one page can report impressions for in a single request
+TRACK_IDS_MAX = 100
+
+def parse_tracking_id(value):
+    """A promotion id from a public tracking request, or ValueError"""
+    if isinstance(value, bool):
+        raise ValueError('ids must be integers')
+    try:
+        promotion_id = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+    if not 1 <= promotion_id <= PROMOTION_ID_MAX:
+        raise ValueError(f'ids must be between 1 and {PROMOTION_ID_MAX}')
+    return promotion_id
+
+def parse_tracking_ids(data):
+    """Validate a /promotions/impressions body and return its promotion ids"""
+    ids = (data or {}).get('ids')
+    if not isinstance(ids, list):
+        raise ValueError('ids must be a list')
+    if len(ids) > TRACK_IDS_MAX:
+        raise ValueError(f'At most {TRACK_IDS_MAX} ids per request')
+    return [parse_tracking_id(value) for value in ids]
+
+class PromotionCounterBuffer:
+    """Write-behind buffer for promotion impressions and clicks.
+    
+    Tracking requests only add to in-memory counters under a lock. A
+    background thread flushes them every flush_interval seconds as one
+    batched `UPDATE promotions SET impressions = impressions + ?` (plus an
+    upsert into promotion_hourly_stats), so page views never queue on row
+    locks or, on SQLite, the database lock. Counts that fail to flush
+    because the database is locked or unreachable are put back and retried
+    on the next cycle; after any other error each promotion is written on
+    its own and the counts that still fail are dropped.
+    
+    At most max_pending promotions (and promotion-hours) are buffered;
+    counts for further ones are dropped until the next flush.
+    """
+    
+    def __init__(self, app=None, flush_interval=5.0, hourly=True, max_pending=10000):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.hourly = hourly
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._hours = {}
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config['PROMOTION_COUNTER_FLUSH_INTERVAL']
+        self.hourly = app.config['PROMOTION_HOURLY_STATS']
+        self.max_pending = app.config['PROMOTION_COUNTER_MAX_PENDING']
+    
+    def _add(self, target, key, impressions, clicks):
+        """Add to one buffered counter; returns False if the buffer is full"""
+        counts = target.get(key)
+        if counts is None:
+            if len(target) >= self.max_pending:
+                self.dropped += 1
+                return False
+            counts = target[key] = [0, 0]
+        counts[0] += impressions
+        counts[1] += clicks
+        return True
+    
+    def record(self, promotion_id, impressions=0, clicks=0):
+        """Count impressions/clicks for a promotion; flushed later"""
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            if self._add(self._totals, promotion_id, impressions, clicks) and self.hourly:
+                self._add(self._hours, (promotion_id, hour), impressions, clicks)
+        self._ensure_started()
+    
+    def pending(self):
+        """Number of promotions with counts waiting to be flushed"""
+        with self._lock:
+            return len(self._totals)
+    
+    def flush(self):
+        """Write all buffered counts to the database in one transaction"""
+        with self._lock:
+            totals, self._totals = self._totals, {}
+            hours, self._hours = self._hours, {}
+        if not totals:
+            return 0
+        
+        with self.app.app_context():
+            try:
+                self._write(totals, hours)
+            except OperationalError:
+                self._merge_back(totals, hours)
+                raise
+            except Exception as e:
+                self.app.logger.warning('Promotion counter flush failed, writing promotions one by one: %s', e)
+                return self._write_each(totals, hours)
+        return len(totals)
+    
+    def _write_each(self, totals, hours):
+        """Write each promotion's counts in its own transaction, so one that
+        can never be written doesn't hold up the others"""
+        hours_by_promotion = {}
+        for (promotion_id, hour), counts in hours.items():
+            hours_by_promotion.setdefault(promotion_id, {})[(promotion_id, hour)] = counts
+        
+        written = 0
+        for promotion_id, counts in totals.items():
+            own_totals = {promotion_id: counts}
+            own_hours = hours_by_promotion.get(promotion_id, {})
+            try:
+                self._write(own_totals, own_hours)
+                written += 1
+            except OperationalError:
+                self._merge_back(own_totals, own_hours)
+            except Exception as e:
+                self.app.logger.warning('Dropped counts for promotion %r: %s', promotion_id, e)
+        return written
+    
+    def _write(self, totals, hours):
+        promotions = Promotion.__table__
+        with db.engine.begin() as connection:
+            # Drop counts for promotions that no longer exist
+            known = set()
+            for chunk in chunks(list(totals)):
+                known.update(connection.execute(
+                    select(promotions.c.id).where(promotions.c.id.in_(chunk))
+                ).scalars())
+            
+            params = [
+                {'promotion_id': pid, 'add_impressions': imp, 'add_clicks': clk}
+                for pid, (imp, clk) in totals.items() if pid in known
+            ]
+            if params:
+                connection.execute(
+                    promotions.update().where(
+                        promotions.c.id == bindparam('promotion_id')
+                    ).values(
+                        impressions=func.coalesce(promotions.c.impressions, 0) + bindparam('add_impressions'),
+                        clicks=func.coalesce(promotions.c.clicks, 0) + bindparam('add_clicks')
+                    ),
+                    params
+                )
+            
+            rows = [
+                {'promotion_id': pid, 'hour': hour, 'impressions': imp, 'clicks': clk}
+                for (pid, hour), (imp, clk) in hours.items() if pid in known
+            ]
+            for chunk in chunks(rows):
+                upsert_increments(
+                    connection,
+                    PromotionHourlyStat.__table__,
+                    ['promotion_id', 'hour'],
+                    ['impressions', 'clicks'],
+                    chunk
+                )
+    
+    def _merge_back(self, totals, hours):
+        with self._lock:
+            for source, target in ((totals, self._totals), (hours, self._hours)):
+                for key, (imp, clk) in source.items():
+                    self._add(target, key, imp, clk)
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='promotion-counter-flush', daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+    
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.warning('Promotion counter flush failed: %s', e)
+    
+    def stop(self):
+        """Stop the flush thread and write out whatever is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+promotion_counters = PromotionCounterBuffer()
+
+# Promotion lifecycle scheduling
+class PromotionScheduler:
+    """Moves promotions pending -> active -> expired as their dates pass.
+    
+    Upcoming transitions within `horizon` are kept in a min-heap ordered by
+    due time, loaded with indexed (status, start_date) / (status, end_date)
+    queries. A background thread sleeps until the earliest entry is due and
+    applies everything that has come due with one guarded bulk UPDATE per
+    transition, so no full-table sweep is ever needed. Heap entries can go
+    stale when a promotion is edited or deleted; the status/date conditions
+    in the UPDATEs make those no-ops.
+    """
+    
+    ACTIVATE = 'activate'
+    EXPIRE = 'expire'
+    MAX_SLEEP = 300
+    
+    def __init__(self, app=None, horizon=timedelta(days=7)):
+        self.app = app
+        self.horizon = horizon
+        self._heap = []
+        self._queued = set()
+        self._loaded_until = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def init_app(self, app):
+        self.app = app
+        self.horizon = timedelta(days=app.config['PROMOTION_SCHEDULER_HORIZON_DAYS'])
+    
+    def _push(self, due, promotion_id, action):
+        entry = (due, promotion_id, action)
+        if entry in self._queued:
+            return
+        self._queued.add(entry)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+    
+    def track(self, promotion_id, status, start_date, end_date, after=None):
+        """Queue the future transitions of a new or edited promotion (only
+        those due later than `after`, when given)"""
+        with self._lock:
+            limit = self._loaded_until
+            expires_at = promotion_expires_at(end_date)
+            if (
+                status == 'pending' and (limit is None or start_date <= limit)
+                and (after is None or start_date > after)
+            ):
+                self._push(start_date, promotion_id, self.ACTIVATE)
+            if (
+                status in ('pending', 'active') and (limit is None or expires_at <= limit)
+                and (after is None or expires_at > after)
+            ):
+                self._push(expires_at, promotion_id, self.EXPIRE)
+    
+    def refresh(self, promotion_ids, after=None):
+        """Re-read the dates of promotions whose status changed in bulk"""
+        for chunk in chunks(list(promotion_ids)):
+            rows = db.session.execute(
+                select(Promotion.id, Promotion.status, Promotion.start_date, Promotion.end_date)
+                .where(Promotion.id.in_(chunk))
+            ).all()
+            for row in rows:
+                self.track(*row, after=after)
+    
+    def load(self, now=None):
+        """(Re)build the due-queue for everything due before now + horizon"""
+        now = now or datetime.utcnow()
+        until = now + self.horizon
+        with self.app.app_context():
+            pending = db.session.execute(
+                select(Promotion.id, Promotion.start_date, Promotion.end_date).where(
+                    Promotion.status == 'pending',
+                    Promotion.start_date <= until
+                )
+            ).all()
+            # end_date <= until - 1 day  <=>  expiry (end_date + 1 day) <= until
+            active = db.session.execute(
+                select(Promotion.id, Promotion.end_date).where(
+                    Promotion.status == 'active',
+                    Promotion.end_date <= until - timedelta(days=1)
+                )
+            ).all()
+            db.session.rollback()
+        
+        with self._lock:
+            self._loaded_until = until
+            for promotion_id, start_date, end_date in pending:
+                self._push(start_date, promotion_id, self.ACTIVATE)
+                if promotion_expires_at(end_date) <= until:
+                    self._push(promotion_expires_at(end_date), promotion_id, self.EXPIRE)
+            for promotion_id, end_date in active:
+                self._push(promotion_expires_at(end_date), promotion_id, self.EXPIRE)
+    
+    def run_due(self, now=None):
+        """Apply every transition that is due; returns (activated, expired)"""
+        now = now or datetime.utcnow()
+        if self._loaded_until is None or now + self.horizon / 2 >= self._loaded_until:
+            self.load(now)
+        
+        activate, expire = set(), set()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                self._queued.discard(entry)
+                (activate if entry[2] == self.ACTIVATE else expire).add(entry[1])
+        if not activate and not expire:
+            return 0, 0
+        
+        expired = activated = 0
+        with self.app.app_context():
+            try:
+                for chunk in chunks(sorted(expire | activate)):
+                    expired += db.session.execute(
+                        update(Promotion).where(
+                            Promotion.id.in_(chunk),
+                            Promotion.status.in_(('pending', 'active')),
+                            Promotion.end_date <= now - timedelta(days=1)
+                        ).values(status='expired'),
+                        execution_options={'synchronize_session': False}
+                    ).rowcount
+                for chunk in chunks(sorted(activate)):
+                    activated += db.session.execute(
+                        update(Promotion).where(
+                            Promotion.id.in_(chunk),
+                            Promotion.status == 'pending',
+                            Promotion.start_date <= now,
+                            Promotion.end_date > now - timedelta(days=1)
+                        ).values(status='active'),
+                        execution_options={'synchronize_session': False}
+                    ).rowcount
+                db.session.commit()
+                if activated + expired < len(activate) + len(expire):
+                    # Some promotions were edited after being queued; queue
+                    # the transitions their current dates still have ahead
+                    self.refresh(activate | expire, after=now)
+                    db.session.rollback()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    for promotion_id in activate:
+                        self._push(now, promotion_id, self.ACTIVATE)
+                    for promotion_id in expire:
+                        self._push(now, promotion_id, self.EXPIRE)
+                raise
+        return activated, expired
+    
+    def _seconds_until_next(self):
+        with self._lock:
+            if not self._heap:
+                return self.MAX_SLEEP
+            delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+        return min(max(delay, 0), self.MAX_SLEEP)
+    
+    def start(self):
+        """Load the due-queue and start the background thread"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='promotion-scheduler', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                activated, expired = self.run_due()
+                if activated or expired:
+                    self.app.logger.info('Promotions activated: %d, expired: %d', activated, expired)
+            except Exception as e:
+                self.app.logger.warning('Promotion scheduler run failed: %s', e)
+            self._wakeup.wait(self._seconds_until_next())
+            self._wakeup.clear()
+    
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+promotion_scheduler = PromotionScheduler()
+
+# Featured promotion serving
+class FeaturedPromotionIndex:
+    """In-memory index of active promotions for public featured/banner slots.
+    
+    Entries are bucketed by (service_type, promotion_type), with None
+    standing for "any", and each bucket keeps cumulative price weights so a
+    page can draw its slots with a few bisects. Buckets are replaced, never
+    mutated, so readers need no lock and never touch the database. Commits
+    that change promotions or providers refresh just the affected entries.
+    """
+    
+    def __init__(self, app=None):
+        self.app = app
+        self._by_id = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+    
+    def init_app(self, app):
+        self.app = app
+    
+    @staticmethod
+    def _bucket_keys(entry):
+        service_type, promotion_type = entry['service_type'], entry['promotion_type']
+        return {
+            (service_type, promotion_type),
+            (service_type, None),
+            (None, promotion_type),
+            (None, None)
+        }
+    
+    def _fetch(self, connection, promotion_ids=None, provider_ids=None):
+        stmt = select(
+            Promotion.id,
+            Promotion.provider_id,
+            Promotion.promotion_type,
+            Promotion.title,
+            Promotion.price,
+            Promotion.end_date,
+            ServiceProvider.name,
+            ServiceProvider.rating,
+            ServiceProvider.service_type
+        ).join(
+            ServiceProvider, Promotion.provider_id == ServiceProvider.id
+        ).where(Promotion.status == 'active')
+        if promotion_ids is not None:
+            stmt = stmt.where(Promotion.id.in_(promotion_ids))
+        if provider_ids is not None:
+            stmt = stmt.where(Promotion.provider_id.in_(provider_ids))
+        
+        return {
+            row.id: {
+                'promotion_id': row.id,
+                'provider_id': row.provider_id,
+                'provider_name': row.name,
+                'rating': row.rating,
+                'service_type': row.service_type,
+                'promotion_type': row.promotion_type,
+                'title': row.title,
+                'price': row.price or 0.0,
+                'expires_at': promotion_expires_at(row.end_date)
+            } for row in connection.execute(stmt)
+        }
+    
+    def _build_bucket(self, key):
+        service_type, promotion_type = key
+        entries = [
+            entry for entry in self._by_id.values()
+            if (service_type is None or entry['service_type'] == service_type)
+            and (promotion_type is None or entry['promotion_type'] == promotion_type)
+        ]
+        cumulative = []
+        total = 0.0
+        for entry in entries:
+            # Free promotions still get a small share of the rotation
+            total += max(entry['price'], 1.0)
+            cumulative.append(total)
+        return entries, cumulative
+    
+    def rebuild(self):
+        """Load every active promotion from the database"""
+        with db.engine.connect() as connection:
+            by_id = self._fetch(connection)
+        with self._lock:
+            self._by_id = by_id
+            keys = set()
+            for entry in by_id.values():
+                keys |= self._bucket_keys(entry)
+            self._buckets = {key: self._build_bucket(key) for key in keys}
+            self.loaded = True
+    
+    def refresh(self, promotion_ids=(), provider_ids=()):
+        """Re-read the given promotions (and all promotions of the given providers)"""
+        promotion_ids, provider_ids = list(promotion_ids), list(provider_ids)
+        if not self.loaded or not (promotion_ids or provider_ids):
+            return
+        
+        fresh = {}
+        with db.engine.connect() as connection:
+            for chunk in chunks(promotion_ids):
+                fresh.update(self._fetch(connection, promotion_ids=chunk))
+            for chunk in chunks(provider_ids):
+                fresh.update(self._fetch(connection, provider_ids=chunk))
+        
+        with self._lock:
+            by_id = dict(self._by_id)
+            provider_set = set(provider_ids)
+            stale = set(promotion_ids) | {
+                pid for pid, entry in by_id.items() if entry['provider_id'] in provider_set
+            }
+            keys = set()
+            for pid in stale:
+                if pid in by_id:
+                    keys |= self._bucket_keys(by_id.pop(pid))
+            for pid, entry in fresh.items():
+                by_id[pid] = entry
+                keys |= self._bucket_keys(entry)
+            
+            self._by_id = by_id
+            buckets = dict(self._buckets)
+            for key in keys:
+                buckets[key] = self._build_bucket(key)
+            self._buckets = buckets
+    
+    def is_active(self, promotion_id):
+        """Whether a promotion is currently being served, so it can be tracked"""
+        if not self.loaded:
+            self.rebuild()
+        return promotion_id in self._by_id
+    
+    def select(self, service_type=None, promotion_type=None, limit=3, rng=random):
+        """Draw up to `limit` distinct active promotions, weighted by price"""
+        entries, cumulative = self._buckets.get((service_type, promotion_type), ((), ()))
+        now = datetime.utcnow()
+        if not entries:
+            return []
+        
+        if limit >= len(entries):
+            picked = list(entries)
+            rng.shuffle(picked)
+        else:
+            total = cumulative[-1]
+            seen = set()
+            picked = []
+            # A few extra draws absorb collisions before falling back to a scan
+            for _ in range(limit * 4):
+                index = bisect.bisect_left(cumulative, rng.random() * total)
+                if index not in seen:
+                    seen.add(index)
+                    picked.append(entries[min(index, len(entries) - 1)])
+                    if len(picked) == limit:
+                        break
+            for index, entry in enumerate(entries):
+                if len(picked) == limit:
+                    break
+                if index not in seen:
+                    seen.add(index)
+                    picked.append(entry)
+        
+        # The scheduler may lag by a moment; never serve a promotion past its run
+        return [entry for entry in picked if entry['expires_at'] > now]
+
+featured_index = FeaturedPromotionIndex()
+
+@event.listens_for(db.session, 'after_flush')
+def collect_featured_changes(session, flush_context):
+    """Remember which promotions/providers this transaction touched"""
+    promotions = session.info.setdefault('featured_promotions', set())
+    providers = session.info.setdefault('featured_providers', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Promotion):
+            promotions.add(obj.id)
+        elif isinstance(obj, ServiceProvider) and obj not in session.new:
+            providers.add(obj.id)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def collect_featured_bulk_changes(orm_execute_state):
+    """Bulk statements on promotions don't say which rows changed; reload all"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) in ('promotions', 'service_providers'):
+        orm_execute_state.session.info['featured_reload'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def refresh_featured_index(session):
+    reload = session.info.pop('featured_reload', False)
+    promotions = session.info.pop('featured_promotions', set())
+    providers = session.info.pop('featured_providers', set())
+    if not featured_index.loaded:
+        return
+    try:
+        if reload:
+            featured_index.rebuild()
+        else:
+            featured_index.refresh(promotions, providers)
+    except Exception as e:
+        current_app.logger.warning('Featured promotion index refresh failed: %s', e)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_featured_changes(session):
+    for key in ('featured_reload', 'featured_promotions', 'featured_providers'):
+        session.info.pop(key, None)
+
+def init_app(app):
+    promotion_counters.init_app(app)
+    promotion_scheduler.init_app(app)
+    featured_index.init_app(app)
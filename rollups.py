@@ -0,0 +1,258 @@
+"""
+rollups.py - Incrementally maintained booking aggregates
+
+Keeps booking_daily_stats and the per-provider counters on
+service_providers (total_bookings, total_revenue, rating_sum/rating_count
+and the smoothed rating) in step with bookings from after_flush listeners.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, event, inspect, bindparam, case, select
+
+from archive import all_bookings
+from database import db, upsert_increments
+from models import Booking, BookingDailyStat, ServiceProvider
+
+# Bayesian prior for provider ratings, set from the config by init_app
+RATING_PRIOR = {'mean': 4.0, 'weight': 10.0}
+
+def _booking_rollup_key(booking_date, service_type, provider_id):
+    """Return the booking_daily_stats key a booking contributes to"""
+    day = (booking_date or datetime.utcnow()).date()
+    return (day, service_type or '', provider_id or 0)
+
+def _previous_value(state, attr):
+    """Value an attribute had before the pending flush"""
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+def _apply_rollup_deltas(connection, deltas):
+    """Add (count, revenue) deltas to booking_daily_stats in one statement"""
+    rows = [
+        {
+            'day': key[0],
+            'service_type': key[1],
+            'provider_id': key[2],
+            'booking_count': count,
+            'revenue': revenue
+        } for key, (count, revenue) in deltas.items() if count or revenue
+    ]
+    upsert_increments(
+        connection,
+        BookingDailyStat.__table__,
+        ['day', 'service_type', 'provider_id'],
+        ['booking_count', 'revenue'],
+        rows
+    )
+
+@event.listens_for(db.session, 'after_flush')
+def update_booking_rollups(session, flush_context):
+    """Fold inserted, updated and deleted bookings into booking_daily_stats"""
+    deltas = {}
+    
+    def add(key, count, revenue):
+        current = deltas.get(key, (0, 0.0))
+        deltas[key] = (current[0] + count, current[1] + (revenue or 0.0))
+    
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            key = _booking_rollup_key(obj.booking_date, obj.service_type, obj.provider_id)
+            add(key, 1, obj.amount)
+    
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            key = _booking_rollup_key(obj.booking_date, obj.service_type, obj.provider_id)
+            add(key, -1, -(obj.amount or 0.0))
+    
+    for obj in session.dirty:
+        if not isinstance(obj, Booking) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        old_key = _booking_rollup_key(
+            _previous_value(state, 'booking_date'),
+            _previous_value(state, 'service_type'),
+            _previous_value(state, 'provider_id')
+        )
+        new_key = _booking_rollup_key(obj.booking_date, obj.service_type, obj.provider_id)
+        old_amount = _previous_value(state, 'amount') or 0.0
+        if old_key == new_key and old_amount == (obj.amount or 0.0):
+            continue
+        add(old_key, -1, -old_amount)
+        add(new_key, 1, obj.amount)
+    
+    if deltas:
+        _apply_rollup_deltas(session.connection(), deltas)
+
+def rebuild_booking_rollups():
+    """Recompute booking_daily_stats from scratch with one GROUP BY pass
+    over bookings and the archive"""
+    table = BookingDailyStat.__table__
+    bookings = all_bookings().c
+    day = func.date(bookings.booking_date)
+    service_type = func.coalesce(bookings.service_type, '')
+    provider_id = func.coalesce(bookings.provider_id, 0)
+    
+    aggregate = db.session.query(
+        day,
+        service_type,
+        provider_id,
+        func.count(bookings.id),
+        func.coalesce(func.sum(bookings.amount), 0.0)
+    ).filter(
+        bookings.booking_date.isnot(None)
+    ).group_by(day, service_type, provider_id)
+    
+    db.session.execute(table.delete())
+    db.session.execute(
+        table.insert().from_select(
+            ['day', 'service_type', 'provider_id', 'booking_count', 'revenue'],
+            aggregate
+        )
+    )
+    db.session.commit()
+
+# Provider counters
+def _provider_contribution(status, amount, rating):
+    """(bookings, revenue, rating_sum, rating_count) a booking adds to its provider"""
+    completed = status == 'completed'
+    rated = completed and rating is not None
+    return (
+        1,
+        (amount or 0.0) if completed else 0.0,
+        float(rating) if rated else 0.0,
+        1 if rated else 0
+    )
+
+def smoothed_rating(rating_sum, rating_count):
+    """Bayesian average: the prior counts as RATING_PRIOR['weight'] extra ratings"""
+    prior = RATING_PRIOR['mean'] * RATING_PRIOR['weight']
+    return (prior + rating_sum) / (RATING_PRIOR['weight'] + rating_count)
+
+def _apply_provider_deltas(connection, deltas):
+    """Add counter deltas to service_providers with one executemany UPDATE"""
+    params = [
+        {
+            'provider_id': provider_id,
+            'add_bookings': bookings,
+            'add_revenue': revenue,
+            'add_rating_sum': rating_sum,
+            'add_rating_count': rating_count
+        } for provider_id, (bookings, revenue, rating_sum, rating_count) in deltas.items()
+        if bookings or revenue or rating_sum or rating_count
+    ]
+    if not params:
+        return
+    
+    c = ServiceProvider.__table__.c
+    rating_sum = func.coalesce(c.rating_sum, 0.0)
+    rating_count = func.coalesce(c.rating_count, 0)
+    prior = RATING_PRIOR['mean'] * RATING_PRIOR['weight']
+    # rating goes first: MySQL evaluates SET clauses left to right against
+    # the already-updated row, SQLite against the old one
+    connection.execute(
+        ServiceProvider.__table__.update().where(
+            c.id == bindparam('provider_id')
+        ).ordered_values(
+            (c.rating, (prior + rating_sum + bindparam('add_rating_sum'))
+                / (RATING_PRIOR['weight'] + rating_count + bindparam('add_rating_count'))),
+            (c.total_bookings, func.coalesce(c.total_bookings, 0) + bindparam('add_bookings')),
+            (c.total_revenue, func.coalesce(c.total_revenue, 0.0) + bindparam('add_revenue')),
+            (c.rating_sum, rating_sum + bindparam('add_rating_sum')),
+            (c.rating_count, rating_count + bindparam('add_rating_count'))
+        ),
+        params
+    )
+
+@event.listens_for(db.session, 'after_flush')
+def update_provider_stats(session, flush_context):
+    """Fold inserted, updated and deleted bookings into their providers' counters"""
+    deltas = {}
+    
+    def add(provider_id, contribution, sign):
+        if not provider_id:
+            return
+        current = deltas.get(provider_id, (0, 0.0, 0.0, 0))
+        deltas[provider_id] = tuple(total + sign * part for total, part in zip(current, contribution))
+    
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            add(obj.provider_id, _provider_contribution(obj.status, obj.amount, obj.rating), 1)
+    
+    for obj in session.deleted:
+        if isinstance(obj, Booking):
+            add(obj.provider_id, _provider_contribution(obj.status, obj.amount, obj.rating), -1)
+    
+    for obj in session.dirty:
+        if not isinstance(obj, Booking) or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        old_provider = _previous_value(state, 'provider_id')
+        old = _provider_contribution(
+            _previous_value(state, 'status'),
+            _previous_value(state, 'amount'),
+            _previous_value(state, 'rating')
+        )
+        new = _provider_contribution(obj.status, obj.amount, obj.rating)
+        if old_provider == obj.provider_id and old == new:
+            continue
+        add(old_provider, old, -1)
+        add(obj.provider_id, new, 1)
+    
+    if deltas:
+        _apply_provider_deltas(session.connection(), deltas)
+
+def rebuild_provider_stats(chunk_size=1000):
+    """Recompute every provider's counters and rating from bookings and the archive"""
+    table = ServiceProvider.__table__
+    bookings = all_bookings().c
+    completed = bookings.status == 'completed'
+    rated = completed & bookings.rating.isnot(None)
+    aggregate = select(
+        bookings.provider_id,
+        func.count(bookings.id),
+        func.coalesce(func.sum(case((completed, bookings.amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((rated, bookings.rating), else_=0)), 0),
+        func.coalesce(func.sum(case((rated, 1), else_=0)), 0)
+    ).where(bookings.provider_id.isnot(None)).group_by(bookings.provider_id)
+    
+    db.session.execute(table.update().values(
+        total_bookings=0,
+        total_revenue=0.0,
+        rating_sum=0.0,
+        rating_count=0,
+        rating=smoothed_rating(0.0, 0)
+    ))
+    update = table.update().where(table.c.id == bindparam('provider_id')).values(
+        total_bookings=bindparam('bookings'),
+        total_revenue=bindparam('revenue'),
+        rating_sum=bindparam('new_rating_sum'),
+        rating_count=bindparam('new_rating_count'),
+        rating=bindparam('new_rating')
+    )
+    
+    batch = []
+    for provider_id, bookings, revenue, rating_sum, rating_count in db.session.execute(aggregate):
+        batch.append({
+            'provider_id': provider_id,
+            'bookings': bookings,
+            'revenue': float(revenue),
+            'new_rating_sum': float(rating_sum),
+            'new_rating_count': rating_count,
+            'new_rating': smoothed_rating(float(rating_sum), rating_count)
+        })
+        if len(batch) >= chunk_size:
+            db.session.execute(update, batch)
+            batch = []
+    if batch:
+        db.session.execute(update, batch)
+    db.session.commit()
+
+def init_app(app):
+    weight = app.config['PROVIDER_RATING_PRIOR_WEIGHT']
+    if weight <= 0:
+        raise ValueError('PROVIDER_RATING_PRIOR_WEIGHT must be positive')
+    RATING_PRIOR['mean'] = app.config['PROVIDER_RATING_PRIOR_MEAN']
+    RATING_PRIOR['weight'] = float(weight)
@@ -0,0 +1,363 @@
+"""
+search.py - Prefix/typeahead search over service providers
+
+On SQLite the search runs against an FTS5 table (provider_search) that
+mirrors service_providers through triggers, ranked with bm25. Elsewhere,
+or when FTS5 is unavailable, an in-process inverted index is loaded on
+first use and kept current from committed ORM changes.
+
+Every query token is matched as a prefix, so "quick plu" finds
+"Quick Fix Plumbing". Matches in the name rank above service type,
+location and description.
+"""
+
+import heapq
+import re
+import threading
+from bisect import bisect_left
+
+from flask import current_app
+from sqlalchemy import event, select, text
+
+from database import db, chunks
+from models import ServiceProvider
+
+# Ranking weight of a match in each column, in FTS5 column order
+SEARCH_FIELDS = (
+    ('name', 10.0),
+    ('service_type', 4.0),
+    ('location', 2.0),
+    ('description', 1.0)
+)
+SEARCH_LIMIT_DEFAULT = 10
+SEARCH_LIMIT_MAX = 50
+# Query tokens beyond this are ignored
+SEARCH_MAX_TOKENS = 8
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(value):
+    """Lower-cased word tokens of a string"""
+    return TOKEN_RE.findall((value or '').lower())
+
+def _result(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'service_type': row.service_type,
+        'location': row.location,
+        'rating': row.rating,
+        'is_premium': bool(row.is_premium)
+    }
+
+# SQLite FTS5
+FTS_TABLE = 'provider_search'
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, service_type, location, description,
+        content='service_providers', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON service_providers BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, service_type, location, description)
+        VALUES (new.id, new.name, new.service_type, new.location, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON service_providers BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, service_type, location, description)
+        VALUES ('delete', old.id, old.name, old.service_type, old.location, old.description);
+    END""",
+    # Only text columns matter; counter updates must not rewrite the index
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, service_type, location, description ON service_providers BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, service_type, location, description)
+        VALUES ('delete', old.id, old.name, old.service_type, old.location, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, service_type, location, description)
+        VALUES (new.id, new.name, new.service_type, new.location, new.description);
+    END"""
+]
+
+def fts_available(engine):
+    """True if engine is SQLite with the FTS5 extension compiled in"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as connection:
+        options = connection.exec_driver_sql('PRAGMA compile_options').scalars().all()
+    return 'ENABLE_FTS5' in options
+
+def ensure_search_index(rebuild=False):
+    """Create the FTS5 table and its triggers; rebuild=True re-reads every provider.
+    
+    Returns False when the database has no FTS5 and the in-process index
+    will be used instead.
+    """
+    if not fts_available(db.engine):
+        return False
+    with db.engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+        ).first()
+        for ddl in FTS_DDL:
+            connection.exec_driver_sql(ddl)
+        if rebuild or not exists:
+            connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    provider_search.reset()
+    return True
+
+def _fts_query(tokens):
+    """FTS5 MATCH expression requiring every token as a prefix"""
+    return ' AND '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+def fts_search(tokens, limit, service_type=None, premium=None):
+    weights = ', '.join(str(weight) for _, weight in SEARCH_FIELDS)
+    sql = f"""
+        SELECT sp.id, sp.name, sp.service_type, sp.location, sp.rating, sp.is_premium
+        FROM {FTS_TABLE}
+        JOIN service_providers AS sp ON sp.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :query
+    """
+    params = {'query': _fts_query(tokens), 'limit': limit}
+    if service_type:
+        sql += " AND sp.service_type = :service_type"
+        params['service_type'] = service_type
+    if premium is not None:
+        sql += " AND sp.is_premium = :premium"
+        params['premium'] = premium
+    sql += f" ORDER BY bm25({FTS_TABLE}, {weights}), sp.rating DESC, sp.id LIMIT :limit"
+    return [_result(row) for row in db.session.execute(text(sql), params)]
+
+# In-process inverted index
+class InvertedIndex:
+    """Token -> {provider_id: weight} postings with a sorted vocabulary.
+    
+    Prefix lookups bisect the sorted vocabulary, so a query touches only the
+    tokens it matches. A provider's weight for a token is the highest
+    weight among the columns the token appears in.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._vocabulary = []
+        self._docs = {}
+        self.loaded = False
+    
+    @staticmethod
+    def _weights(row):
+        weights = {}
+        for field, weight in SEARCH_FIELDS:
+            for token in tokenize(getattr(row, field)):
+                if weights.get(token, 0.0) < weight:
+                    weights[token] = weight
+        return weights
+    
+    def _remove(self, provider_id):
+        doc = self._docs.pop(provider_id, None)
+        if doc is None:
+            return
+        for token in doc['weights']:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(provider_id, None)
+            if not postings:
+                del self._postings[token]
+                index = bisect_left(self._vocabulary, token)
+                if index < len(self._vocabulary) and self._vocabulary[index] == token:
+                    del self._vocabulary[index]
+    
+    def _add(self, row, keep_sorted=True):
+        weights = self._weights(row)
+        self._docs[row.id] = {
+            'weights': weights,
+            'service_type': row.service_type,
+            'is_premium': bool(row.is_premium),
+            'rating': row.rating or 0.0
+        }
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                if keep_sorted:
+                    self._vocabulary.insert(bisect_left(self._vocabulary, token), token)
+            postings[row.id] = weight
+    
+    @staticmethod
+    def _columns():
+        return (
+            ServiceProvider.id, ServiceProvider.name, ServiceProvider.service_type,
+            ServiceProvider.location, ServiceProvider.description,
+            ServiceProvider.is_premium, ServiceProvider.rating
+        )
+    
+    def rebuild(self):
+        """Load every provider from the database"""
+        index = InvertedIndex()
+        with db.engine.connect() as connection:
+            result = connection.execution_options(yield_per=5000).execute(select(*self._columns()))
+            for row in result:
+                index._add(row, keep_sorted=False)
+        index._vocabulary = sorted(index._postings)
+        with self._lock:
+            self._postings = index._postings
+            self._vocabulary = index._vocabulary
+            self._docs = index._docs
+            self.loaded = True
+    
+    def refresh(self, provider_ids):
+        """Re-read the given providers; ids that no longer exist are dropped"""
+        provider_ids = list(provider_ids)
+        if not self.loaded or not provider_ids:
+            return
+        fresh = []
+        with db.engine.connect() as connection:
+            for chunk in chunks(provider_ids):
+                fresh.extend(connection.execute(
+                    select(*self._columns()).where(ServiceProvider.id.in_(chunk))
+                ))
+        with self._lock:
+            for provider_id in provider_ids:
+                self._remove(provider_id)
+            for row in fresh:
+                self._add(row)
+    
+    def _prefix_matches(self, token):
+        """{provider_id: weight} for every vocabulary token starting with token"""
+        matches = {}
+        start = bisect_left(self._vocabulary, token)
+        for candidate in self._vocabulary[start:]:
+            if not candidate.startswith(token):
+                break
+            # Whole-word matches outrank prefixes of longer words
+            factor = 1.0 if candidate == token else 0.8
+            for provider_id, weight in self._postings[candidate].items():
+                score = weight * factor
+                if matches.get(provider_id, 0.0) < score:
+                    matches[provider_id] = score
+        return matches
+    
+    def search(self, tokens, limit, service_type=None, premium=None):
+        """Top `limit` (provider_id, score) pairs matching every token"""
+        with self._lock:
+            scores = None
+            # Rarest-looking (longest) token first keeps the candidate set small
+            for token in sorted(tokens, key=len, reverse=True):
+                matches = self._prefix_matches(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {pid: score + matches[pid] for pid, score in scores.items() if pid in matches}
+                if not scores:
+                    return []
+            
+            candidates = []
+            for provider_id, score in scores.items():
+                doc = self._docs[provider_id]
+                if service_type and doc['service_type'] != service_type:
+                    continue
+                if premium is not None and doc['is_premium'] != premium:
+                    continue
+                candidates.append((score, doc['rating'], -provider_id))
+        
+        return [(-negative_id, score) for score, _, negative_id in heapq.nlargest(limit, candidates)]
+
+class ProviderSearch:
+    """Picks FTS5 or the in-process index for the app's database"""
+    
+    def __init__(self, app=None):
+        self.app = app
+        self.index = InvertedIndex()
+        self._use_fts = None
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        self.app = app
+        self.reset()
+    
+    def reset(self):
+        """Forget the backend choice so the next search checks again"""
+        self._use_fts = None
+    
+    def _fts_ready(self):
+        if self._use_fts is None:
+            backend = self.app.config['SEARCH_BACKEND']
+            use_fts = False
+            if backend != 'memory' and fts_available(db.engine):
+                with db.engine.connect() as connection:
+                    use_fts = connection.exec_driver_sql(
+                        "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)
+                    ).first() is not None
+                if not use_fts:
+                    current_app.logger.warning(
+                        'No %s table; using the in-process index. Run `flask --app app init-db`.', FTS_TABLE
+                    )
+            self._use_fts = use_fts
+        return self._use_fts
+    
+    def search(self, query, limit=SEARCH_LIMIT_DEFAULT, service_type=None, premium=None):
+        """Providers matching every word of query as a prefix, best first"""
+        tokens = tokenize(query)[:SEARCH_MAX_TOKENS]
+        if not tokens:
+            return []
+        if self._fts_ready():
+            return fts_search(tokens, limit, service_type, premium)
+        
+        if not self.index.loaded:
+            self.index.rebuild()
+        ranked = self.index.search(tokens, limit, service_type, premium)
+        if not ranked:
+            return []
+        ids = [provider_id for provider_id, _ in ranked]
+        rows = {
+            row.id: row for row in db.session.execute(
+                select(
+                    ServiceProvider.id, ServiceProvider.name, ServiceProvider.service_type,
+                    ServiceProvider.location, ServiceProvider.rating, ServiceProvider.is_premium
+                ).where(ServiceProvider.id.in_(ids))
+            )
+        }
+        return [_result(rows[provider_id]) for provider_id in ids if provider_id in rows]
+
+provider_search = ProviderSearch()
+
+@event.listens_for(db.session, 'after_flush')
+def collect_search_changes(session, flush_context):
+    """Remember which providers this transaction touched"""
+    if not provider_search.index.loaded:
+        return
+    changed = session.info.setdefault('search_providers', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ServiceProvider):
+            changed.add(obj.id)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def collect_search_bulk_changes(orm_execute_state):
+    """Bulk statements on providers don't say which rows changed; reload all"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if getattr(table, 'name', None) == 'service_providers':
+        orm_execute_state.session.info['search_reload'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def refresh_search_index(session):
+    reload = session.info.pop('search_reload', False)
+    changed = session.info.pop('search_providers', set())
+    if not provider_search.index.loaded:
+        return
+    try:
+        if reload:
+            provider_search.index.rebuild()
+        else:
+            provider_search.index.refresh(changed)
+    except Exception as e:
+        current_app.logger.warning('Provider search index refresh failed: %s', e)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_search_changes(session):
+    session.info.pop('search_reload', None)
+    session.info.pop('search_providers', None)
+
+def init_app(app):
+    provider_search.init_app(app)
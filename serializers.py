@@ -0,0 +1,121 @@
+"""
+serializers.py - Response shapes shared by the JSON routes and models
+
+Each shape declares its fields once: the column a field is selected from,
+how it is formatted, and how to read it off a model instance. List routes
+select only a shape's columns, so rows come back as plain tuples without
+ORM objects or identity-map bookkeeping, and the dates of a whole page
+are formatted column by column. json_response() then encodes the payload
+with a single json.dumps call.
+"""
+
+import json
+from operator import attrgetter
+
+from flask import Response
+from sqlalchemy import func
+
+from models import ServiceProvider, Promotion, Booking
+
+def format_date(value):
+    """YYYY-MM-DD of a date or datetime"""
+    return value.isoformat()[:10]
+
+def format_datetime(value):
+    """YYYY-MM-DD HH:MM:SS of a datetime"""
+    return value.isoformat(' ', 'seconds')
+
+class Field:
+    """One response field: its column, formatter and model attribute"""
+    
+    def __init__(self, name, column, formatter=None, attribute=None):
+        self.name = name
+        self.column = column
+        self.formatter = formatter
+        self.attribute = attribute or attrgetter(name)
+
+class Shape:
+    """An ordered set of fields a route responds with"""
+    
+    def __init__(self, *fields):
+        self.fields = fields
+        self.names = tuple(field.name for field in fields)
+        self.columns = [field.column.label(field.name) for field in fields]
+        self._formatted = [(index, field.formatter) for index, field in enumerate(fields) if field.formatter]
+    
+    def extend(self, *fields):
+        """A shape with these fields after this one's"""
+        return Shape(*self.fields, *fields)
+    
+    def serialize(self, rows):
+        """Dicts for rows selected with self.columns"""
+        if not rows:
+            return []
+        names = self.names
+        if not self._formatted:
+            return [dict(zip(names, row)) for row in rows]
+        
+        # Format each date column of the page in one pass, then zip the
+        # columns back into rows
+        columns = list(zip(*rows))
+        for index, formatter in self._formatted:
+            columns[index] = [None if value is None else formatter(value) for value in columns[index]]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+    
+    def dump(self, obj):
+        """Dict for one model instance"""
+        values = {}
+        for field in self.fields:
+            value = field.attribute(obj)
+            values[field.name] = value if value is None or not field.formatter else field.formatter(value)
+        return values
+
+def json_response(payload, status=200):
+    """Encode a JSON response body in one pass"""
+    return Response(
+        json.dumps(payload, separators=(',', ':'), check_circular=False),
+        status=status,
+        mimetype='application/json'
+    )
+
+PROVIDER = Shape(
+    Field('id', ServiceProvider.id),
+    Field('name', ServiceProvider.name),
+    Field('email', ServiceProvider.email),
+    Field('service_type', ServiceProvider.service_type),
+    Field('rating', ServiceProvider.rating),
+    Field('total_bookings', ServiceProvider.total_bookings),
+    Field('is_premium', ServiceProvider.is_premium)
+)
+
+# Promotion lists leave out the description; select_from(Promotion) with an
+# outer join to ServiceProvider for provider_name
+PROMOTION_SUMMARY = Shape(
+    Field('id', Promotion.id),
+    Field('provider_id', Promotion.provider_id),
+    Field(
+        'provider_name', func.coalesce(ServiceProvider.name, 'Unknown'),
+        attribute=lambda promotion: promotion.provider.name if promotion.provider else 'Unknown'
+    ),
+    Field('promotion_type', Promotion.promotion_type),
+    Field('title', Promotion.title),
+    Field('start_date', Promotion.start_date, format_date),
+    Field('end_date', Promotion.end_date, format_date),
+    Field('status', Promotion.status),
+    Field('price', Promotion.price),
+    Field('impressions', Promotion.impressions),
+    Field('clicks', Promotion.clicks),
+    Field('created_at', Promotion.created_at, format_datetime)
+)
+PROMOTION = PROMOTION_SUMMARY.extend(Field('description', Promotion.description))
+
+BOOKING = Shape(
+    Field('id', Booking.id),
+    Field('provider_id', Booking.provider_id),
+    Field('user_id', Booking.user_id),
+    Field('service_type', Booking.service_type),
+    Field('amount', Booking.amount),
+    Field('status', Booking.status),
+    Field('rating', Booking.rating),
+    Field('booking_date', Booking.booking_date, format_datetime)
+)
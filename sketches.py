@@ -0,0 +1,485 @@
+"""
+sketches.py - Mergeable booking sketches for unique customers and heavy hitters
+
+An exact COUNT(DISTINCT user_id) over a date range has to scan bookings.
+Instead every (day, service_type) row of booking_daily_sketches keeps a
+HyperLogLog of its customers (2^12 registers, ~1.6% standard error) and
+count-min sketches of bookings per customer and per provider, each with
+its top-k candidate ids. Any date range is answered from the daily rows:
+a register-wise max merges the HyperLogLogs, and heavy hitters are the
+shortlisted candidates' per-row estimates summed over the range.
+
+New bookings reach the sketches through a write-behind buffer, like the
+promotion counters. Sketches only grow: edited and deleted bookings are
+not subtracted until `flask --app app rebuild-booking-sketches` runs.
+"""
+
+import atexit
+import json
+import math
+import operator
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+from archive import all_bookings
+from database import db, chunks
+from models import Booking, BookingDailySketch, ServiceProvider
+
+HLL_PRECISION = 12
+CMS_WIDTH = 512
+CMS_DEPTH = 4
+TOP_K = 50  # ids tracked per row; about a day's customers of one service type
+RANGE_FINALISTS = 50
+MASK64 = (1 << 64) - 1
+
+def mix64(value):
+    """splitmix64 finaliser: a well-spread 64-bit hash of an int"""
+    z = (value + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2**precision one-byte registers"""
+    
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+    
+    def add(self, value):
+        hashed = mix64(value)
+        rest_bits = 64 - self.precision
+        index = hashed >> rest_bits
+        # Position of the first 1 bit in the remaining bits
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        harmonic = sum(self.registers.count(rank) * 2.0 ** -rank for rank in set(self.registers))
+        estimate = alpha * m * m / harmonic
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small sets
+            estimate = m * math.log(m / zeros)
+        return estimate
+    
+    def standard_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+    
+    def to_bytes(self):
+        return zlib.compress(bytes(self.registers))
+    
+    @classmethod
+    def from_bytes(cls, data):
+        registers = bytearray(zlib.decompress(data))
+        return cls(len(registers).bit_length() - 1, registers)
+
+
+class CountMinSketch:
+    """Frequency sketch: `depth` rows of `width` counters; never under-counts.
+    Sketches of disjoint bookings merge by adding their cells."""
+    
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, cells=None):
+        self.width = width
+        self.depth = depth
+        self.cells = cells if cells is not None else array('I', bytes(4 * width * depth))
+    
+    def _indexes(self, item):
+        # Double hashing: row i uses low + i * high
+        hashed = mix64(item)
+        low, high = hashed & 0xFFFFFFFF, hashed >> 32
+        return [row * self.width + (low + row * high) % self.width for row in range(self.depth)]
+    
+    def add(self, item, count=1):
+        """Count an item and return its new estimate.
+        
+        Conservative update: only cells below the new estimate are raised,
+        which keeps collision noise down without ever under-counting.
+        """
+        cells = self.cells
+        indexes = self._indexes(item)
+        estimate = min(cells[index] for index in indexes) + count
+        for index in indexes:
+            if cells[index] < estimate:
+                cells[index] = estimate
+        return estimate
+    
+    def estimate(self, item):
+        return min(self.cells[index] for index in self._indexes(item))
+    
+    def merge(self, other):
+        self.cells = array('I', map(operator.add, self.cells, other.cells))
+        return self
+    
+    def to_bytes(self):
+        cells = array('I', self.cells)
+        if sys.byteorder == 'big':
+            cells.byteswap()
+        return zlib.compress(struct.pack('<HH', self.width, self.depth) + cells.tobytes())
+    
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(data)
+        width, depth = struct.unpack_from('<HH', data)
+        cells = array('I')
+        cells.frombytes(data[4:])
+        if sys.byteorder == 'big':
+            cells.byteswap()
+        return cls(width, depth, cells)
+
+
+class HeavyHitters:
+    """Count-min sketch plus the k ids with the highest estimated counts"""
+    
+    def __init__(self, k=TOP_K, sketch=None, candidates=None):
+        self.k = k
+        self.sketch = sketch if sketch is not None else CountMinSketch()
+        self.candidates = candidates if candidates is not None else {}
+        # Lower bound on the smallest candidate count once the set is full
+        self._floor = 0
+    
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        candidates = self.candidates
+        if item in candidates or len(candidates) < self.k:
+            candidates[item] = estimate
+        elif estimate > self._floor:
+            weakest = min(candidates, key=candidates.get)
+            if estimate > candidates[weakest]:
+                del candidates[weakest]
+                candidates[item] = estimate
+            self._floor = min(candidates.values())
+    
+    def merge(self, other):
+        """Fold in another sketch of the same rows (e.g. a day's later bookings)"""
+        self.sketch.merge(other.sketch)
+        items = set(self.candidates) | set(other.candidates)
+        estimates = {item: self.sketch.estimate(item) for item in items}
+        self.candidates = dict(self.top(self.k, estimates))
+        self._floor = 0
+        return self
+    
+    def top(self, n, counts=None):
+        """The n heaviest (id, estimated count) pairs"""
+        counts = self.candidates if counts is None else counts
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+    
+    def candidates_json(self):
+        return json.dumps(self.top(self.k))
+    
+    @classmethod
+    def from_row(cls, sketch_bytes, candidates_json):
+        if sketch_bytes is None:
+            return cls()
+        candidates = {item: count for item, count in json.loads(candidates_json or '[]')}
+        return cls(sketch=CountMinSketch.from_bytes(sketch_bytes), candidates=candidates)
+
+
+class DaySketch:
+    """All sketches of one (day, service_type)'s bookings"""
+    
+    def __init__(self, bookings=0, customers=None, top_customers=None, top_providers=None):
+        self.bookings = bookings
+        self.customers = customers if customers is not None else HyperLogLog()
+        self.top_customers = top_customers if top_customers is not None else HeavyHitters()
+        self.top_providers = top_providers if top_providers is not None else HeavyHitters()
+    
+    def add(self, user_id, provider_id):
+        self.bookings += 1
+        if user_id is not None:
+            self.customers.add(user_id)
+            self.top_customers.add(user_id)
+        if provider_id is not None:
+            self.top_providers.add(provider_id)
+    
+    def merge(self, other, heavy_hitters=True):
+        self.bookings += other.bookings
+        self.customers.merge(other.customers)
+        if heavy_hitters:
+            self.top_customers.merge(other.top_customers)
+            self.top_providers.merge(other.top_providers)
+        return self
+    
+    def to_values(self):
+        """Column values for a booking_daily_sketches row"""
+        return {
+            'bookings': self.bookings,
+            'customers': self.customers.to_bytes(),
+            'customer_counts': self.top_customers.sketch.to_bytes(),
+            'provider_counts': self.top_providers.sketch.to_bytes(),
+            'top_customers': self.top_customers.candidates_json(),
+            'top_providers': self.top_providers.candidates_json()
+        }
+    
+    @classmethod
+    def from_row(cls, row, heavy_hitters=True):
+        return cls(
+            bookings=row.bookings or 0,
+            customers=HyperLogLog.from_bytes(row.customers) if row.customers else None,
+            top_customers=HeavyHitters.from_row(row.customer_counts, row.top_customers) if heavy_hitters else None,
+            top_providers=HeavyHitters.from_row(row.provider_counts, row.top_providers) if heavy_hitters else None
+        )
+
+
+class BookingSketchBuffer:
+    """Write-behind buffer folding new bookings into booking_daily_sketches.
+    
+    Committed bookings are added to in-memory sketches per (day,
+    service_type). A background thread merges them into the stored rows
+    every flush_interval seconds; sketches that fail to flush are kept and
+    retried on the next cycle.
+    """
+    
+    def __init__(self, app=None, flush_interval=10.0):
+        self.app = app
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config['BOOKING_SKETCH_FLUSH_INTERVAL']
+    
+    def record(self, bookings):
+        """Add (day, service_type, user_id, provider_id) tuples; flushed later"""
+        with self._lock:
+            for day, service_type, user_id, provider_id in bookings:
+                sketch = self._pending.get((day, service_type))
+                if sketch is None:
+                    sketch = self._pending[(day, service_type)] = DaySketch()
+                sketch.add(user_id, provider_id)
+        self._ensure_started()
+    
+    def pending(self):
+        """Number of (day, service_type) sketches waiting to be flushed"""
+        with self._lock:
+            return len(self._pending)
+    
+    def discard(self):
+        """Drop buffered sketches (a rebuild reads their bookings anyway)"""
+        with self._lock:
+            self._pending = {}
+    
+    def flush(self):
+        """Merge all buffered sketches into the database in one transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        
+        try:
+            with self.app.app_context():
+                self._write(pending)
+        except Exception:
+            with self._lock:
+                for key, sketch in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = sketch.merge(current) if current is not None else sketch
+            raise
+        return len(pending)
+    
+    def _write(self, pending):
+        table = BookingDailySketch.__table__
+        with db.engine.begin() as connection:
+            for (day, service_type), sketch in pending.items():
+                key = (table.c.day == day, table.c.service_type == service_type)
+                row = connection.execute(select(table).where(*key).with_for_update()).first()
+                if row is None:
+                    connection.execute(table.insert().values(
+                        day=day, service_type=service_type, **sketch.to_values()
+                    ))
+                else:
+                    merged = DaySketch.from_row(row).merge(sketch)
+                    connection.execute(table.update().where(*key).values(**merged.to_values()))
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='booking-sketch-flush', daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+    
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.warning('Booking sketch flush failed: %s', e)
+    
+    def stop(self):
+        """Stop the flush thread and write out whatever is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+booking_sketches = BookingSketchBuffer()
+
+def rebuild_booking_sketches(chunk_size=10000):
+    """Recompute booking_daily_sketches from bookings and the archive, one
+    day at a time"""
+    booking_sketches.discard()
+    table = BookingDailySketch.__table__
+    db.session.execute(table.delete())
+    
+    def write(day, sketches):
+        db.session.execute(table.insert(), [
+            dict(sketch.to_values(), day=day, service_type=service_type)
+            for service_type, sketch in sketches.items()
+        ])
+    
+    # Stream bookings on their own connection so the inserts can go
+    # through the session while the cursor is open
+    bookings = all_bookings().c
+    stmt = select(bookings.booking_date, bookings.service_type, bookings.user_id, bookings.provider_id).where(
+        bookings.booking_date.isnot(None)
+    ).order_by(bookings.booking_date)
+    current_day = None
+    sketches = {}
+    with db.engine.connect() as connection:
+        for booking_date, service_type, user_id, provider_id in connection.execution_options(
+            yield_per=chunk_size
+        ).execute(stmt):
+            day = booking_date.date()
+            if day != current_day:
+                if sketches:
+                    write(current_day, sketches)
+                current_day = day
+                sketches = {}
+            sketch = sketches.get(service_type or '')
+            if sketch is None:
+                sketch = sketches[service_type or ''] = DaySketch()
+            sketch.add(user_id, provider_id)
+    if sketches:
+        write(current_day, sketches)
+    db.session.commit()
+
+def range_heavy_hitters(rows, sketch_column, candidates_column, n):
+    """The n heaviest ids across many daily rows.
+    
+    Summing count-min sketches over a long range adds every row's
+    collision noise to every estimate. Instead, ids are shortlisted by the
+    counts the rows tracked for them, and each finalist's count is the sum
+    of its per-row estimates, which stays close to exact.
+    """
+    if n <= 0:
+        return []
+    tracked = {}
+    for row in rows:
+        for item, count in json.loads(getattr(row, candidates_column) or '[]'):
+            tracked[item] = tracked.get(item, 0) + count
+    finalists = sorted(tracked, key=lambda item: (-tracked[item], item))[:max(RANGE_FINALISTS, 5 * n)]
+    
+    estimates = dict.fromkeys(finalists, 0)
+    indexes = {}
+    for row in rows:
+        data = getattr(row, sketch_column)
+        if not data:
+            continue
+        sketch = CountMinSketch.from_bytes(data)
+        shape = (sketch.width, sketch.depth)
+        if shape not in indexes:
+            indexes[shape] = {item: sketch._indexes(item) for item in finalists}
+        cells = sketch.cells
+        for item, positions in indexes[shape].items():
+            estimates[item] += min(cells[position] for position in positions)
+    return HeavyHitters().top(n, estimates)
+
+def booking_sketch_summary(date_from, date_to, service_type=None, by=None, top=10):
+    """Unique customers and heaviest customers/providers between two dates
+    (inclusive), merged from the daily sketches. `by` ('service_type' or
+    'day') adds a unique-customer breakdown."""
+    stmt = select(BookingDailySketch).where(
+        BookingDailySketch.day >= date_from,
+        BookingDailySketch.day <= date_to
+    )
+    if service_type:
+        stmt = stmt.where(BookingDailySketch.service_type == service_type)
+    rows = db.session.execute(stmt).scalars().all()
+    
+    merged = DaySketch()
+    groups = {}
+    for row in rows:
+        sketch = DaySketch.from_row(row, heavy_hitters=False)
+        if by:
+            key = str(row.day) if by == 'day' else (row.service_type or None)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = DaySketch()
+            group.merge(sketch, heavy_hitters=False)
+        merged.merge(sketch, heavy_hitters=False)
+    
+    summary = {
+        'bookings': merged.bookings,
+        'unique_customers': round(merged.customers.estimate()),
+        'standard_error': round(merged.customers.standard_error(), 4),
+        'top_customers': [
+            {'user_id': user_id, 'bookings': count}
+            for user_id, count in range_heavy_hitters(rows, 'customer_counts', 'top_customers', top)
+        ],
+        'top_providers': [
+            {'provider_id': provider_id, 'bookings': count}
+            for provider_id, count in range_heavy_hitters(rows, 'provider_counts', 'top_providers', top)
+        ]
+    }
+    provider_ids = [item['provider_id'] for item in summary['top_providers']]
+    names = {}
+    for chunk in chunks(provider_ids):
+        names.update(db.session.execute(
+            select(ServiceProvider.id, ServiceProvider.name).where(ServiceProvider.id.in_(chunk))
+        ).all())
+    for item in summary['top_providers']:
+        item['name'] = names.get(item['provider_id'])
+    
+    if by:
+        summary['breakdown'] = [
+            {by: key, 'bookings': group.bookings, 'unique_customers': round(group.customers.estimate())}
+            for key, group in sorted(groups.items(), key=lambda item: (item[0] is None, item[0] or ''))
+        ]
+    return summary
+
+# Feeding new bookings to the buffer once they are committed
+@event.listens_for(db.session, 'after_flush')
+def collect_new_bookings(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            session.info.setdefault('sketch_bookings', []).append((
+                (obj.booking_date or datetime.utcnow()).date(),
+                obj.service_type or '',
+                obj.user_id,
+                obj.provider_id
+            ))
+
+@event.listens_for(db.session, 'after_commit')
+def record_new_bookings(session):
+    bookings = session.info.pop('sketch_bookings', None)
+    if bookings:
+        booking_sketches.record(bookings)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_new_bookings(session):
+    session.info.pop('sketch_bookings', None)
+
+def init_app(app):
+    booking_sketches.init_app(app)
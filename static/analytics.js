@@ -2,19 +2,26 @@
 
 let servicesChart = null;
 let revenueChart = null;
+let explorerChart = null;
+let retentionChart = null;
+let liveFigures = null;
+
+const EXPLORER_COLORS = ['67, 97, 238', '6, 214, 160', '255, 99, 132', '255, 159, 64', '153, 102, 255', '255, 205, 86', '54, 162, 235', '201, 203, 207'];
 
 // Load analytics data on page load
 document.addEventListener('DOMContentLoaded', function() {
-    loadAnalyticsData();
+    loadAnalyticsData().then(connectLiveStream);
+    loadBookingExplorer();
+    loadRetention();
 });
 
 async function loadAnalyticsData() {
     try {
-        const response = await fetch('/admin/analytics/data');
-        const data = await response.json();
+        const data = await conditionalFetch('/admin/analytics/data');
         
         // Update statistics
         updateStatistics(data.statistics);
+        updateUniqueCustomers(data.unique_customers);
         
         // Load charts
         renderServicesChart(data.most_booked_services);
@@ -37,6 +44,12 @@ function updateStatistics(stats) {
     document.getElementById('active-promotions').textContent = stats.active_promotions;
 }
 
+function updateUniqueCustomers(customers) {
+    const element = document.getElementById('unique-customers');
+    element.textContent = '~' + customers.unique_customers.toLocaleString();
+    element.title = `±${(customers.standard_error * 100).toFixed(1)}% standard error, from ${customers.bookings.toLocaleString()} bookings`;
+}
+
 function renderServicesChart(servicesData) {
     const ctx = document.getElementById('servicesChart').getContext('2d');
     
@@ -80,6 +93,10 @@ function renderServicesChart(servicesData) {
     });
 }
 
+function revenueLabel(date) {
+    return new Date(date).toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
+}
+
 function renderRevenueChart(revenueData) {
     const ctx = document.getElementById('revenueChart').getContext('2d');
     
@@ -91,10 +108,7 @@ function renderRevenueChart(revenueData) {
     // Sort by date
     revenueData.sort((a, b) => new Date(a.date) - new Date(b.date));
     
-    const labels = revenueData.map(item => {
-        const date = new Date(item.date);
-        return date.toLocaleDateString('en-US', { month: 'short', day: 'numeric' });
-    });
+    const labels = revenueData.map(item => revenueLabel(item.date));
     const revenues = revenueData.map(item => item.revenue);
     
     revenueChart = new Chart(ctx, {
@@ -173,6 +187,245 @@ function loadTopProviders(providers) {
     `;
 }
 
+// Live figures: a snapshot from /admin/analytics/stream, then deltas
+function connectLiveStream() {
+    if (!window.EventSource) {
+        return;
+    }
+    const source = new EventSource('/admin/analytics/stream');
+    source.addEventListener('snapshot', event => applyLiveFigures(JSON.parse(event.data)));
+    source.addEventListener('delta', event => applyLiveFigures(mergeDelta(liveFigures, JSON.parse(event.data))));
+    source.onerror = () => console.warn('Live analytics stream interrupted; reconnecting');
+}
+
+function mergeDelta(figures, delta) {
+    const merged = Object.assign({}, figures);
+    Object.entries(delta).forEach(([key, value]) => {
+        if (value === null) {
+            delete merged[key];
+        } else if (typeof value === 'object' && typeof merged[key] === 'object') {
+            merged[key] = mergeDelta(merged[key], value);
+        } else {
+            merged[key] = value;
+        }
+    });
+    return merged;
+}
+
+function applyLiveFigures(figures) {
+    const previous = liveFigures;
+    liveFigures = figures;
+    
+    updateStatistics(figures.statistics);
+    document.getElementById('active-promotions').title = Object.entries(figures.promotions)
+        .map(([status, count]) => `${count} ${status}`).join(', ');
+    
+    // The charts already hold everything up to the first snapshot, so only
+    // bookings counted since then are added to the services chart
+    if (previous && servicesChart) {
+        const before = previous.today.date === figures.today.date ? previous.today.services : {};
+        const services = new Set([...Object.keys(before), ...Object.keys(figures.today.services)]);
+        services.forEach(service => {
+            const added = (figures.today.services[service] || 0) - (before[service] || 0);
+            if (!added) {
+                return;
+            }
+            let index = servicesChart.data.labels.indexOf(service);
+            if (index === -1) {
+                index = servicesChart.data.labels.push(service) - 1;
+                servicesChart.data.datasets[0].data.push(0);
+            }
+            servicesChart.data.datasets[0].data[index] += added;
+        });
+        servicesChart.update('none');
+    }
+    
+    if (revenueChart && figures.today.bookings) {
+        const label = revenueLabel(figures.today.date);
+        const index = revenueChart.data.labels.indexOf(label);
+        if (index === -1) {
+            revenueChart.data.labels.push(label);
+            revenueChart.data.datasets[0].data.push(figures.today.revenue);
+        } else {
+            revenueChart.data.datasets[0].data[index] = figures.today.revenue;
+        }
+        revenueChart.update('none');
+    }
+}
+
+// Booking explorer: ad-hoc group-by queries against /admin/analytics/query
+async function loadBookingExplorer() {
+    const metric = document.getElementById('explorer-metric').value;
+    const grain = document.getElementById('explorer-grain').value;
+    const range = document.getElementById('explorer-range').value;
+    const split = document.getElementById('explorer-split').value;
+    const status = document.getElementById('explorer-status').value;
+    
+    const params = new URLSearchParams({ group_by: split ? `${grain},${split}` : grain });
+    if (range) {
+        const since = new Date(Date.now() - Number(range) * 24 * 60 * 60 * 1000);
+        params.set('from', since.toISOString().split('T')[0]);
+    }
+    if (status) {
+        params.set('status', status);
+    }
+    
+    try {
+        const data = await conditionalFetch(`/admin/analytics/query?${params.toString()}`);
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        renderExplorerChart(data.rows, grain, split, metric);
+    } catch (error) {
+        console.error('Error loading booking explorer:', error);
+    }
+}
+
+function renderExplorerChart(rows, grain, split, metric) {
+    const ctx = document.getElementById('explorerChart').getContext('2d');
+    
+    if (explorerChart) {
+        explorerChart.destroy();
+    }
+    
+    // Rows come back ordered by period; pivot the split values into series
+    const labels = [...new Set(rows.map(row => row[grain]))];
+    const series = {};
+    rows.forEach(row => {
+        const name = split ? (row[split] || 'Unknown') : (metric === 'revenue' ? 'Revenue (৳)' : 'Bookings');
+        if (!series[name]) {
+            series[name] = {};
+        }
+        series[name][row[grain]] = row[metric];
+    });
+    
+    const datasets = Object.entries(series).map(([name, values], index) => {
+        const color = EXPLORER_COLORS[index % EXPLORER_COLORS.length];
+        return {
+            label: name,
+            data: labels.map(label => values[label] || 0),
+            borderColor: `rgba(${color}, 1)`,
+            backgroundColor: `rgba(${color}, 0.6)`,
+            borderWidth: 2
+        };
+    });
+    
+    explorerChart = new Chart(ctx, {
+        type: split ? 'bar' : 'line',
+        data: {
+            labels: labels,
+            datasets: datasets
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: {
+                    display: true,
+                    position: 'top'
+                }
+            },
+            scales: {
+                x: {
+                    stacked: Boolean(split)
+                },
+                y: {
+                    stacked: Boolean(split),
+                    beginAtZero: true,
+                    ticks: {
+                        callback: function(value) {
+                            return metric === 'revenue' ? '৳' + value.toLocaleString() : value.toLocaleString();
+                        }
+                    }
+                }
+            }
+        }
+    });
+}
+
+// Customer retention: share of each cohort booking again N periods later
+async function loadRetention() {
+    const grain = document.getElementById('retention-grain').value;
+    const cohorts = document.getElementById('retention-cohorts').value;
+    const params = new URLSearchParams({ grain: grain, cohorts: cohorts, periods: cohorts });
+    
+    try {
+        const data = await conditionalFetch(`/admin/analytics/cohorts?${params.toString()}`);
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        renderRetentionChart(data);
+    } catch (error) {
+        console.error('Error loading retention:', error);
+    }
+}
+
+function renderRetentionChart(data) {
+    const ctx = document.getElementById('retentionChart').getContext('2d');
+    
+    if (retentionChart) {
+        retentionChart.destroy();
+    }
+    
+    const unit = data.grain === 'week' ? 'Week' : 'Month';
+    const labels = Array.from({ length: data.periods }, (_, offset) => `${unit} ${offset}`);
+    // One faint line per cohort with customers, and the size-weighted average on top
+    const datasets = data.cohorts.filter(cohort => cohort.customers).map((cohort, index) => {
+        const color = EXPLORER_COLORS[index % EXPLORER_COLORS.length];
+        return {
+            label: `${cohort.cohort} (${cohort.customers})`,
+            data: cohort.retention.map(value => value * 100),
+            borderColor: `rgba(${color}, 0.5)`,
+            backgroundColor: `rgba(${color}, 0.5)`,
+            borderWidth: 1,
+            pointRadius: 2
+        };
+    });
+    datasets.unshift({
+        label: 'Average',
+        data: data.average.map(value => value * 100),
+        borderColor: 'rgba(33, 37, 41, 1)',
+        backgroundColor: 'rgba(33, 37, 41, 1)',
+        borderWidth: 3
+    });
+    
+    retentionChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: labels,
+            datasets: datasets
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: {
+                    display: true,
+                    position: 'top'
+                },
+                tooltip: {
+                    callbacks: {
+                        label: function(context) {
+                            return `${context.dataset.label}: ${context.parsed.y.toFixed(1)}%`;
+                        }
+                    }
+                }
+            },
+            scales: {
+                y: {
+                    beginAtZero: true,
+                    max: 100,
+                    ticks: {
+                        callback: function(value) {
+                            return value + '%';
+                        }
+                    }
+                }
+            }
+        }
+    });
+}
+
 async function exportReport() {
     try {
         const response = await fetch('/admin/analytics/export');
@@ -196,3 +449,8 @@ async function exportReport() {
     }
 }
 
+// Raw exports are streamed by the server, so let the browser download them directly
+function exportData(dataset, format, filters = {}) {
+    const params = new URLSearchParams({ format: format, ...filters });
+    window.location.href = `/admin/analytics/export/${dataset}?${params.toString()}`;
+}
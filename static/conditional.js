@@ -0,0 +1,23 @@
+// Conditional GETs against the admin JSON endpoints, which answer 304
+// while the tables behind them are unchanged
+
+// Responses of conditional GETs by URL, so a 304 can be answered from the
+// copy already downloaded
+const conditionalCache = new Map();
+
+// fetch() that sends If-None-Match for a URL fetched before and returns
+// the JSON body, reusing the previous one when the server answers 304
+async function conditionalFetch(url) {
+    const cached = conditionalCache.get(url);
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    const response = await fetch(url, { headers: headers, cache: 'no-store' });
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        conditionalCache.set(url, { etag: etag, data: data });
+    }
+    return data;
+}